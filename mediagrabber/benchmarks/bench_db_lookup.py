@@ -0,0 +1,132 @@
+"""
+Per-lookup latency of DataBase.file_hash_matches() and DataBase.source_exists()
+
+Builds an index with the schema of the first release (so older versions of the code can open it,
+newer versions migrate it) and times random lookups, half of them hits. To compare with another
+version, check it out (e.g. git worktree add /tmp/mg-old <commit>) and pass its mediagrabber
+directory with --code.
+
+    python benchmarks/bench_db_lookup.py --records 1000000
+    python benchmarks/bench_db_lookup.py --records 1000000 --code /tmp/mg-old/mediagrabber
+"""
+import argparse
+import hashlib
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+BASELINE_SCHEMA = (
+    'CREATE TABLE file ('
+    'file_id INTEGER PRIMARY KEY NOT NULL,'
+    'file_type TEXT,'
+    'file_size BIGINT,'
+    'file_hash_md5 TEXT DEFAULT (NULL),'
+    'file_date TIMESTAMP,'
+    'date_time_original TIMESTAMP NOT NULL,'
+    'target_path TEXT NOT NULL DEFAULT (NULL),'
+    'target_filename TEXT NOT NULL DEFAULT (NULL),'
+    'image_width TEXT DEFAULT (NULL),'
+    'image_height TEXT DEFAULT (NULL),'
+    'camera_make TEXT DEFAULT (NULL),'
+    'camera_model TEXT DEFAULT (NULL),'
+    'gps_longitude TEXT DEFAULT (NULL),'
+    'gps_latitude TEXT DEFAULT (NULL),'
+    'date_added TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP),'
+    'copied BOOLEAN NOT NULL DEFAULT (0),'
+    'date_copied TIMESTAMP);'
+    'CREATE UNIQUE INDEX idx_unique_target_path_file ON file (target_path, target_filename);'
+    'CREATE UNIQUE INDEX idx_file_hash_md5 ON file (file_hash_md5);'
+    'CREATE TABLE source ('
+    'source_id INTEGER PRIMARY KEY NOT NULL UNIQUE,'
+    'source_path TEXT NOT NULL,'
+    'source_filename TEXT NOT NULL,'
+    'file_id INTEGER NOT NULL'
+    ' REFERENCES file (file_id) '
+    ' ON DELETE CASCADE'
+    ' ON UPDATE CASCADE,'
+    'date_added TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP));'
+    'CREATE UNIQUE INDEX unique_path_filename ON source (source_path, source_filename);'
+)
+
+
+def file_hash(number):
+    return hashlib.md5(str(number).encode()).hexdigest()
+
+
+def source_path(number):
+    return '/source/dir%d/IMG_%d.jpg' % (number % 1000, number)
+
+
+def create_index(path, records):
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.executemany(
+        'INSERT INTO file (file_id, file_type, file_size, file_hash_md5, date_time_original, target_path, '
+        'target_filename) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        ((number, 'JPG', number, file_hash(number), '2017-05-29 09:15:05', '2017/05', 'IMG_%d.jpg' % number)
+         for number in range(1, records + 1)))
+    connection.executemany(
+        'INSERT INTO source (source_path, source_filename, file_id) VALUES (?, ?, ?)',
+        ((os.path.dirname(source_path(number)), os.path.basename(source_path(number)), number)
+         for number in range(1, records + 1)))
+    connection.commit()
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='db lookup latency')
+    parser.add_argument('--records', type=int, default=1000000, help='file/source records in the index')
+    parser.add_argument('--lookups', type=int, default=50000, help='random lookups per method')
+    parser.add_argument('--code', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help='mediagrabber directory with the code to benchmark (default: this tree)')
+    parser.add_argument('--index', help='keep the generated (baseline) index in this file')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.code))
+    from database import DataBase
+    from exifmediafile import ExifMediaFile
+    logging.disable(logging.CRITICAL)
+
+    class HashedFile(ExifMediaFile):
+        """
+        File with hash and size only (no file on disk)
+        """
+        def __init__(self, number):
+            self.file_properties = {'file_hash_md5': file_hash(number), 'file_size': number}
+            self.file_id = None
+
+        def __del__(self):
+            pass
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = args.index or os.path.join(directory, 'baseline.db')
+        if not os.path.exists(baseline):
+            print('creating index with %d records' % args.records)
+            create_index(baseline, args.records)
+        db_file = os.path.join(directory, 'index.db')
+        shutil.copy(baseline, db_file)
+        db = DataBase(db_file)
+
+        numbers = [random.randrange(1, 2 * args.records) for _ in range(args.lookups)]
+        files = [HashedFile(number) for number in numbers]
+        start = time.perf_counter()
+        matches = sum(db.file_hash_matches(emf) for emf in files)
+        hash_time = time.perf_counter() - start
+
+        paths = [source_path(number) for number in numbers]
+        start = time.perf_counter()
+        sources = sum(db.source_exists(path) for path in paths)
+        source_time = time.perf_counter() - start
+        db.disconnect()
+
+    print('file_hash_matches %6.1f us/lookup (%d hits)' % (hash_time / len(files) * 1e6, matches))
+    print('source_exists     %6.1f us/lookup (%d hits)' % (source_time / len(paths) * 1e6, sources))
+
+
+if __name__ == '__main__':
+    main()
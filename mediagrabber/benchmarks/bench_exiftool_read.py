@@ -0,0 +1,77 @@
+"""
+Throughput of reading exiftool output up to the sentinel (ExifTool.execute())
+
+A thread writes JSON-like records and the sentinel into a pipe, the reader under test collects the
+output. "before" is the reader of the first release (4KB reads appended to a bytes object, tail
+checked after every read), "after" is ExifTool._read_output(). No exiftool is needed.
+
+    python benchmarks/bench_exiftool_read.py 0.01 0.1 1 4 32
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exiftool
+
+RECORD = b'{"SourceFile": "/volume1/photo/IMG_0001.mov", "QuickTime:Comment": "' + b'a' * 180 + b'"},\n'
+
+
+def read_before(fd):
+    output = b""
+    while not output[-32:].strip().endswith(b"{ready}"):
+        output += os.read(fd, 4096)
+    return output.strip()[:-len(b"{ready}")]
+
+
+def read_after(fd):
+    et = exiftool.ExifTool()
+    et._process = types.SimpleNamespace(stdout=types.SimpleNamespace(fileno=lambda: fd))
+    return et._read_output(b"{ready1}")
+
+
+def throughput(size_mb, reader, sentinel):
+    """
+    MB/s reading size_mb of output followed by the sentinel
+    """
+    payload = RECORD * max(1, int(size_mb * 1024 * 1024 / len(RECORD)))
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        with os.fdopen(write_fd, 'wb') as f:
+            f.write(payload + b'\n' + sentinel + b'\n')
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    start = time.perf_counter()
+    output = reader(read_fd)
+    elapsed = time.perf_counter() - start
+    writer.join()
+    os.close(read_fd)
+    assert output.rstrip() == payload.rstrip(), 'output does not match'
+    return len(payload) / 1024 / 1024 / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='exiftool output read throughput')
+    parser.add_argument('sizes', nargs='*', type=float, default=[0.01, 0.1, 1, 4, 32], help='output sizes in MB')
+    parser.add_argument('--max-before', type=float, default=8,
+                        help='largest size to read with the old reader (it takes quadratic time)')
+    args = parser.parse_args()
+
+    print('   size      before       after')
+    for size_mb in args.sizes:
+        if size_mb <= args.max_before:
+            before = '%7.1f MB/s' % throughput(size_mb, read_before, b'{ready}')
+        else:
+            before = '%12s' % '-'
+        after = throughput(size_mb, read_after, b'{ready1}')
+        print('%6.2fMB %s %7.1f MB/s' % (size_mb, before, after))
+
+
+if __name__ == '__main__':
+    main()
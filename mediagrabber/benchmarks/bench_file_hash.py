@@ -0,0 +1,58 @@
+"""
+Throughput of filehash.hash_for_file() per registered hash algorithm
+
+Hashes a generated file (or the given one) with every algorithm in filehash.HASH_ALGORITHMS. The
+file is read once before timing, so it comes from the page cache and the numbers show the cost of
+the hash function.
+
+    python benchmarks/bench_file_hash.py --size 200
+    python benchmarks/bench_file_hash.py --file ~/Videos/sample.mov
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import filehash
+
+
+def throughput(path, algorithm, repeat):
+    """
+    Best MB/s of repeat runs
+    """
+    size = os.path.getsize(path)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        filehash.hash_for_file(path, algorithm)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return size / best / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='file hash throughput')
+    parser.add_argument('--file', help='file to hash (default: generated file of --size MB)')
+    parser.add_argument('--size', type=int, default=200, help='size of the generated file in MB')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.file
+        if path is None:
+            path = os.path.join(directory, 'data.bin')
+            with open(path, 'wb') as f:
+                for _ in range(args.size):
+                    f.write(os.urandom(1024 * 1024))
+        # page cache
+        filehash.hash_for_file(path, 'md5')
+
+        for algorithm in sorted(filehash.HASH_ALGORITHMS):
+            print('%-8s %7.0f MB/s' % (algorithm, throughput(path, algorithm, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Bytes exiftool reads per file under each read profile (see READ_PROFILES in exif_mixin.py)
+
+Every file is read once per profile through a stay-open exiftool process. The bytes the process
+read are taken from /proc/<pid>/io (rchar: all reads, also from the page cache) before and after
+each call, minus the parameters sent to it. A first pass per process is not counted, so the perl
+modules exiftool loads on demand do not add up. Needs exiftool and Linux.
+
+    python benchmarks/bench_read_profiles.py ~/Pictures/samples
+    python benchmarks/bench_read_profiles.py --profiles full standard a.jpg b.mov
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exiftool
+from exif_mixin import ExifMixin, READ_PROFILES
+
+
+def read_chars(pid):
+    with open('/proc/%d/io' % pid) as f:
+        for line in f:
+            if line.startswith('rchar:'):
+                return int(line.split()[1])
+    raise OSError('no rchar in /proc/%d/io' % pid)
+
+
+def list_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                files.extend(os.path.join(dir_path, name) for name in sorted(file_names))
+        else:
+            files.append(path)
+    return files
+
+
+def file_type(path):
+    return os.path.splitext(path)[1].replace('.', '').upper()
+
+
+def measure(et, profile_name, files):
+    """
+    Bytes read and seconds per file type: {file type: [files, bytes, seconds]}
+    """
+    profiles = READ_PROFILES[profile_name]
+    results = defaultdict(lambda: [0, 0, 0.0])
+    for path in files:
+        profile = profiles.get(file_type(path), profiles['*'])
+        options = ExifMixin._exiftool_options(profile)
+        # the parameters of ExifTool.get_tags_batch()
+        params = [b'-j'] + [exiftool.fsencode(param) for param in
+                            list(options) + ['-' + tag for tag in profile.tags] + [path]]
+
+        before = read_chars(et._process.pid)
+        start = time.perf_counter()
+        et.execute(*params)
+        elapsed = time.perf_counter() - start
+        read = read_chars(et._process.pid) - before
+        # parameters and -executeNUM sent through stdin
+        read -= sum(len(param) + 1 for param in params) + len(b'-execute%d\n' % et._execute_number)
+
+        result = results[file_type(path)]
+        result[0] += 1
+        result[1] += max(0, read)
+        result[2] += elapsed
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bytes read by exiftool per read profile')
+    parser.add_argument('paths', nargs='+', help='sample files or directories')
+    parser.add_argument('--profiles', nargs='+', default=sorted(READ_PROFILES), choices=sorted(READ_PROFILES))
+    parser.add_argument('--executable', default=exiftool.executable, help='exiftool executable')
+    args = parser.parse_args()
+
+    files = list_files(args.paths)
+    if not files:
+        parser.error('no files found')
+
+    print('%-8s %-6s %6s %12s %10s' % ('profile', 'type', 'files', 'KB/file', 'ms/file'))
+    for profile_name in args.profiles:
+        with exiftool.ExifTool(args.executable) as et:
+            # load the exiftool modules needed for these files
+            measure(et, profile_name, files)
+            results = measure(et, profile_name, files)
+        for type_name, (count, read, elapsed) in sorted(results.items()):
+            print('%-8s %-6s %6d %12.1f %10.2f' % (profile_name, type_name, count, read / count / 1024,
+                                                   elapsed / count * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,17 @@
 # To change this template file, choose Tools | Templates
 # and open the template in the editor.
 
+import calendar
+import datetime
+import json
 import logging
 import os
 import re
 import sqlite3
+import time
+from contextlib import contextmanager
 
+import filehash
 from exifmediafile import ExifMediaFile
 
 if __name__ == "__main__":
@@ -14,13 +20,64 @@ if __name__ == "__main__":
 
 
 class DataBase:
-    def __init__(self, path_to_db, logger=None):
+    # schema migrations (method names), applied in this order to bring existing databases up to date
+    # the number of applied migrations is stored as schema version in the db header (pragma user_version)
+    schema_migrations = [
+        '_migration_lookup_indexes',
+        '_migration_scan_journal',
+        '_migration_dir_snapshots',
+        '_migration_intern_paths',
+        '_migration_scan_journal_lru',
+        '_migration_exif_skip_list',
+        '_migration_hash_algorithm',
+    ]
+
+    def __init__(self, path_to_db, logger=None, concurrent=False):
         self.logger = logger or logging.getLogger(__name__)
         self.logger.debug('Init DB')
         self.logger.debug('database: %s', path_to_db)
         self.simulate = False
         self.path_to_db = path_to_db
         self.db_connection = None
+        self.cached_statements = 256
+        self.fetch_chunk_size = 1000
+
+        # concurrent mode: several processes share the db (see write_lock())
+        self.concurrent = concurrent
+        self.busy_timeout = 60.0
+        self.busy_retries = 5
+
+        # batched write mode (see batch())
+        self.batch_size = 100
+        self.commit_interval = 5.0
+        self._batch_active = False
+        self._batch_units = 0
+        self._last_commit = None
+
+        # compact column encoding (see convert_to_compact())
+        self.compact = False
+
+        # cache of directory ids (see _get_directory_id())
+        self._directory_ids = {}
+
+        # in-memory index of known sources (see load_source_index())
+        self._source_index = None
+        self._source_index_roots = []
+
+        # scan journal budget (None: unlimited, see trim_scan_journal()) and counters
+        self.journal_max_entries = None
+        self.journal_max_bytes = None
+        self.journal_hits = 0
+        self.journal_misses = 0
+        self.journal_evicted = 0
+        # keys of the scan journal entries used since the last update of last_used
+        self._journal_used_keys = set()
+
+        # content hash algorithm of the index and algorithms of records not re-keyed yet
+        # (see set_hash_algorithm(), rehash_files())
+        self.hash_algorithm = filehash.DEFAULT_HASH_ALGORITHM
+        self.legacy_hash_algorithms = []
+
         self.connect()
 
     def __del__(self):
@@ -42,15 +99,28 @@ class DataBase:
                     setup_db = True
 
                 self.logger.debug('connecting db')
-                self.db_connection = sqlite3.connect(self.path_to_db)
+                # statements are cached per sql string (see execute_sql())
+                # (wait up to busy_timeout seconds for locks held by other processes)
+                self.db_connection = sqlite3.connect(self.path_to_db, timeout=self.busy_timeout,
+                                                     cached_statements=self.cached_statements)
 
                 # enable foreign key support
                 self.execute_sql('pragma foreign_keys = ON')
 
+                if self.concurrent:
+                    # readers do not block the writer (and vice versa)
+                    self.execute_sql('pragma journal_mode = WAL')
+
                 if setup_db:
                     self.logger.info('setting up fresh database: %s', self.path_to_db)
                     self.setup_db()
 
+                # bring schema up to date
+                self.migrate()
+
+                self.compact = self.get_setting('compact_encoding') == '1'
+                self._load_hash_algorithms()
+
             except Exception as error:
                 self.logger.error("Oops, Didn't work: %s", error)
 
@@ -75,13 +145,457 @@ class DataBase:
             # restore simulation mode
             self.simulate = simulate
 
+    def get_schema_version(self):
+        """
+        Get the schema version of the db (number of applied migrations)
+        :return: int
+        """
+        return self.db_connection.execute('pragma user_version').fetchone()[0]
+
+    def migrate(self):
+        """
+        Upgrade the db schema in place by applying all pending migrations
+
+        Every migration runs in its own transaction together with the update of the schema
+        version, so an interrupted migration is simply repeated on the next run.
+        Migrations are applied in simulation mode as well (same as setup_db()).
+
+        Foreign keys are switched off while migrating, so tables can be rebuilt without
+        triggering the foreign key actions (and checked afterwards).
+        """
+        schema_version = self.get_schema_version()
+        latest_version = len(self.schema_migrations)
+
+        if schema_version > latest_version:
+            self.logger.warning('database schema version %s is newer than supported version %s',
+                                schema_version, latest_version)
+            return
+
+        for version, migration in enumerate(self.schema_migrations, start=1):
+            if version <= schema_version:
+                continue
+
+            self._change_schema(getattr(self, migration), version)
+
+    def _change_schema(self, change, version=None):
+        """
+        Run a schema change in a transaction with foreign keys switched off
+
+        This way, tables can be rebuilt without triggering the foreign key actions.
+        The foreign keys are checked before committing. The transaction takes the write lock
+        right away, so concurrent processes do not migrate the same db twice.
+        :param change: method doing the changes (using _migration_sql())
+        :param version: new schema version to set along with the change
+        """
+        self.db_connection.execute('pragma foreign_keys = OFF')
+        try:
+            self.db_connection.execute('BEGIN IMMEDIATE')
+            try:
+                if version is not None and self.get_schema_version() >= version:
+                    # already done by another process
+                    self.db_connection.commit()
+                    return
+
+                self.logger.info('changing database schema: %s (version %s)', change.__name__, version)
+                change()
+                if self.db_connection.execute('pragma foreign_key_check').fetchone() is not None:
+                    raise sqlite3.IntegrityError('foreign key check failed')
+                if version is not None:
+                    # pragma values cannot be passed as parameters
+                    self.db_connection.execute('pragma user_version = {0:d}'.format(version))
+                self.db_connection.commit()
+            except Exception as error:
+                self.logger.error('schema change %s failed: %s', change.__name__, error)
+                self.db_connection.rollback()
+                raise error
+        finally:
+            self.db_connection.execute('pragma foreign_keys = ON')
+
+    def _migration_sql(self, sql_str, params=()):
+        """
+        Run a SQL statement within the transaction of a migration (no commit)
+        :param sql_str:
+        :param params:
+        """
+        self.logger.debug('migration statement: %s', sql_str)
+        return self.db_connection.execute(sql_str, params)
+
+    def _migration_lookup_indexes(self):
+        """
+        Migration 1: add covering indexes for the duplicate detection queries
+
+        - (date_time_original, file_type, file_size): file_date_type(_size)_matches
+        - (file_size, file_type): file_size_matches, file_type_size_matches
+        - target_filename: _is_unique_target_filename
+        - target_filename (nocase): prefix search with like in target_filename_matches
+        """
+        self._migration_sql(
+            'CREATE INDEX IF NOT EXISTS idx_file_date_type_size ON file (date_time_original, file_type, file_size);'
+        )
+        self._migration_sql(
+            'CREATE INDEX IF NOT EXISTS idx_file_size_type ON file (file_size, file_type);'
+        )
+        self._migration_sql(
+            'CREATE INDEX IF NOT EXISTS idx_file_target_filename ON file (target_filename);'
+        )
+        self._migration_sql(
+            'CREATE INDEX IF NOT EXISTS idx_file_target_filename_nocase ON file (target_filename COLLATE NOCASE);'
+        )
+
+    def _migration_scan_journal(self):
+        """
+        Migration 2: add the table "scan_journal"
+
+        Caches md5 hash and exif tags of scanned files by (device, inode, size, mtime),
+        so unchanged files are not parsed again - even if they were renamed or moved
+        """
+        self._migration_sql(
+            'CREATE TABLE IF NOT EXISTS scan_journal ('
+            'st_dev INTEGER NOT NULL,'
+            'st_ino INTEGER NOT NULL,'
+            'file_size BIGINT NOT NULL,'
+            'mtime_ns INTEGER NOT NULL,'
+            'file_hash_md5 TEXT NOT NULL,'
+            'exif_tags TEXT NOT NULL,'
+            'date_added TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP),'
+            'PRIMARY KEY (st_dev, st_ino));'
+        )
+
+    def _migration_scan_journal_lru(self):
+        """
+        Migration 5: record when scan journal entries were used last (least recently used entries
+        are removed first when the journal exceeds its budget)
+        """
+        self._migration_sql(
+            'ALTER TABLE scan_journal ADD COLUMN last_used INTEGER NOT NULL DEFAULT 0'
+        )
+        self._migration_sql(
+            "UPDATE scan_journal SET last_used = CAST(strftime('%s', date_added) AS INTEGER)"
+        )
+        self._migration_sql(
+            'CREATE INDEX IF NOT EXISTS idx_scan_journal_last_used ON scan_journal (last_used);'
+        )
+
+    def _migration_exif_skip_list(self):
+        """
+        Migration 6: add the table "exif_skip_list"
+
+        Files exiftool hung on (by device, inode, size and mtime), these are not read again
+        unless they are changed
+        """
+        self._migration_sql(
+            'CREATE TABLE IF NOT EXISTS exif_skip_list ('
+            'st_dev INTEGER NOT NULL,'
+            'st_ino INTEGER NOT NULL,'
+            'file_size BIGINT NOT NULL,'
+            'mtime_ns INTEGER NOT NULL,'
+            'file_path TEXT NOT NULL,'
+            'reason TEXT NOT NULL,'
+            'date_added TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP),'
+            'PRIMARY KEY (st_dev, st_ino));'
+        )
+
+    def _migration_hash_algorithm(self):
+        """
+        Migration 7: record the content hash algorithm of file records and scan journal entries
+
+        The hash columns keep their name file_hash_md5 (no table rebuild, same file property key),
+        they hold the digest of the algorithm named by hash_algorithm. Existing records were hashed
+        with md5 - the index keeps md5 until another algorithm is chosen. New (empty) indexes use
+        the default algorithm.
+        """
+        self._migration_sql(
+            "ALTER TABLE file ADD COLUMN hash_algorithm TEXT NOT NULL DEFAULT 'md5'"
+        )
+        self._migration_sql(
+            'CREATE INDEX IF NOT EXISTS idx_file_hash_algorithm ON file (hash_algorithm);'
+        )
+        self._migration_sql(
+            "ALTER TABLE scan_journal ADD COLUMN hash_algorithm TEXT NOT NULL DEFAULT 'md5'"
+        )
+        self._migration_sql(
+            "INSERT OR IGNORE INTO setting (key, value) "
+            "SELECT 'hash_algorithm', CASE WHEN EXISTS (SELECT 1 FROM file) THEN 'md5' ELSE ? END",
+            (filehash.DEFAULT_HASH_ALGORITHM,)
+        )
+
+    def _migration_dir_snapshots(self):
+        """
+        Migration 3: add the tables "dir_snapshot" and "setting"
+
+        dir_snapshot keeps mtime and number of entries of scanned source directories (used to skip
+        unchanged directories), setting is a simple key/value store for run state
+        """
+        self._migration_sql(
+            'CREATE TABLE IF NOT EXISTS dir_snapshot ('
+            'dir_path TEXT PRIMARY KEY NOT NULL,'
+            'parent_path TEXT,'
+            'mtime_ns INTEGER NOT NULL,'
+            'entry_count INTEGER NOT NULL,'
+            'date_added TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP));'
+        )
+        self._migration_sql(
+            'CREATE INDEX IF NOT EXISTS idx_dir_snapshot_parent ON dir_snapshot (parent_path);'
+        )
+        self._migration_sql(
+            'CREATE TABLE IF NOT EXISTS setting ('
+            'key TEXT PRIMARY KEY NOT NULL,'
+            'value TEXT);'
+        )
+
+    def _migration_intern_paths(self):
+        """
+        Migration 4: store source and target paths once in the table "directory"
+
+        source.source_path and file.target_path are replaced by references to the directory table
+        (source.source_directory_id, file.target_directory_id). Both tables are rebuilt and their
+        indexes recreated.
+        """
+        self._migration_sql(
+            'CREATE TABLE directory ('
+            'directory_id INTEGER PRIMARY KEY NOT NULL,'
+            'path TEXT NOT NULL UNIQUE);'
+        )
+        self._migration_sql('INSERT OR IGNORE INTO directory (path) SELECT DISTINCT target_path FROM file;')
+        self._migration_sql('INSERT OR IGNORE INTO directory (path) SELECT DISTINCT source_path FROM source;')
+
+        # file
+        self._migration_sql(
+            'CREATE TABLE file_new ('
+            'file_id INTEGER PRIMARY KEY NOT NULL,'
+            'file_type TEXT,'
+            'file_size BIGINT,'
+            'file_hash_md5 TEXT DEFAULT (NULL),'
+            'file_date TIMESTAMP,'
+            'date_time_original TIMESTAMP NOT NULL,'
+            'target_directory_id INTEGER NOT NULL'
+            ' REFERENCES directory (directory_id),'
+            'target_filename TEXT NOT NULL DEFAULT (NULL),'
+            'image_width TEXT DEFAULT (NULL),'
+            'image_height TEXT DEFAULT (NULL),'
+            'camera_make TEXT DEFAULT (NULL),'
+            'camera_model TEXT DEFAULT (NULL),'
+            'gps_longitude TEXT DEFAULT (NULL),'
+            'gps_latitude TEXT DEFAULT (NULL),'
+            'date_added TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP),'
+            'copied BOOLEAN NOT NULL DEFAULT (0),'
+            'date_copied TIMESTAMP);'
+        )
+        self._migration_sql(
+            'INSERT INTO file_new '
+            'SELECT f.file_id, f.file_type, f.file_size, f.file_hash_md5, f.file_date, f.date_time_original, '
+            'd.directory_id, f.target_filename, f.image_width, f.image_height, f.camera_make, f.camera_model, '
+            'f.gps_longitude, f.gps_latitude, f.date_added, f.copied, f.date_copied '
+            'FROM file f INNER JOIN directory d ON d.path = f.target_path;'
+        )
+
+        # source
+        self._migration_sql(
+            'CREATE TABLE source_new ('
+            'source_id INTEGER PRIMARY KEY NOT NULL UNIQUE,'
+            'source_directory_id INTEGER NOT NULL'
+            ' REFERENCES directory (directory_id),'
+            'source_filename TEXT NOT NULL,'
+            'file_id INTEGER NOT NULL'
+            ' REFERENCES file (file_id) '
+            ' ON DELETE CASCADE'
+            ' ON UPDATE CASCADE,'
+            'date_added TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP));'
+        )
+        self._migration_sql(
+            'INSERT INTO source_new '
+            'SELECT s.source_id, d.directory_id, s.source_filename, s.file_id, s.date_added '
+            'FROM source s INNER JOIN directory d ON d.path = s.source_path;'
+        )
+
+        self._migration_sql('DROP TABLE source;')
+        self._migration_sql('DROP TABLE file;')
+        self._migration_sql('ALTER TABLE file_new RENAME TO file;')
+        self._migration_sql('ALTER TABLE source_new RENAME TO source;')
+
+        # indexes
+        self._create_file_indexes()
+        self._migration_sql(
+            'CREATE UNIQUE INDEX unique_path_filename ON source (source_directory_id, source_filename);'
+        )
+        self._migration_sql('CREATE INDEX idx_source_file_id ON source (file_id);')
+
+    def _create_file_indexes(self):
+        """
+        Create the indexes of the (rebuilt) file table
+        """
+        self._migration_sql(
+            'CREATE UNIQUE INDEX idx_unique_target_path_file ON file (target_directory_id, target_filename);'
+        )
+        self._migration_sql('CREATE UNIQUE INDEX idx_file_hash_md5 ON file (file_hash_md5);')
+        self._migration_lookup_indexes()
+
+    def convert_to_compact(self):
+        """
+        Convert the file table to the compact column encoding (opt-in, cannot be undone)
+
+        - file_hash_md5: binary digest (BLOB) instead of hex string
+        - date_time_original, file_date: integer seconds since 1970-01-01 (the local timestamps are
+          converted as they are, without time zone conversion)
+        - image_width, image_height: INTEGER, gps_latitude, gps_longitude: REAL
+
+        The file properties keep their formats, values are converted when reading/writing records.
+        Values which cannot be converted are kept as they are.
+        """
+        if self.compact:
+            return
+
+        self.logger.info('converting database to compact encoding')
+        self.db_connection.create_function('mg_hash_to_blob', 1, self._hash_to_blob)
+        self.db_connection.create_function('mg_timestamp_to_epoch', 1, self._timestamp_to_epoch)
+        self.db_connection.create_function('mg_to_int', 1, lambda value: self._to_number(value, int))
+        self.db_connection.create_function('mg_to_float', 1, lambda value: self._to_number(value, float))
+
+        self._change_schema(self._convert_file_table_to_compact)
+        self.compact = True
+
+    def _convert_file_table_to_compact(self):
+        """
+        Rebuild the file table with compact column types (see convert_to_compact())
+        """
+        if self._migration_sql("SELECT value FROM setting WHERE key = 'compact_encoding'").fetchone() == ('1',):
+            # converted by another process in the meantime
+            return
+
+        self._migration_sql(
+            'CREATE TABLE file_new ('
+            'file_id INTEGER PRIMARY KEY NOT NULL,'
+            'file_type TEXT,'
+            'file_size INTEGER,'
+            'file_hash_md5 BLOB DEFAULT (NULL),'
+            'file_date INTEGER,'
+            'date_time_original INTEGER NOT NULL,'
+            'target_directory_id INTEGER NOT NULL'
+            ' REFERENCES directory (directory_id),'
+            'target_filename TEXT NOT NULL DEFAULT (NULL),'
+            'image_width INTEGER DEFAULT (NULL),'
+            'image_height INTEGER DEFAULT (NULL),'
+            'camera_make TEXT DEFAULT (NULL),'
+            'camera_model TEXT DEFAULT (NULL),'
+            'gps_longitude REAL DEFAULT (NULL),'
+            'gps_latitude REAL DEFAULT (NULL),'
+            'date_added TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP),'
+            'copied BOOLEAN NOT NULL DEFAULT (0),'
+            'date_copied TIMESTAMP,'
+            "hash_algorithm TEXT NOT NULL DEFAULT 'md5');"
+        )
+        self._migration_sql(
+            'INSERT INTO file_new '
+            'SELECT file_id, file_type, file_size, mg_hash_to_blob(file_hash_md5), mg_timestamp_to_epoch(file_date), '
+            'mg_timestamp_to_epoch(date_time_original), target_directory_id, target_filename, '
+            'mg_to_int(image_width), mg_to_int(image_height), camera_make, camera_model, '
+            'mg_to_float(gps_longitude), mg_to_float(gps_latitude), date_added, copied, date_copied, hash_algorithm '
+            'FROM file;'
+        )
+        self._migration_sql('DROP TABLE file;')
+        self._migration_sql('ALTER TABLE file_new RENAME TO file;')
+        self._create_file_indexes()
+        self._migration_sql('CREATE INDEX idx_file_hash_algorithm ON file (hash_algorithm);')
+
+        self._migration_sql("INSERT OR REPLACE INTO setting (key, value) values ('compact_encoding', '1')")
+
+    @staticmethod
+    def _hash_to_blob(value):
+        """
+        Convert a hex digest to bytes (other values are returned unchanged)
+        """
+        if isinstance(value, str):
+            try:
+                return bytes.fromhex(value)
+            except ValueError:
+                pass
+        return value
+
+    @staticmethod
+    def _blob_to_hash(value):
+        """
+        Convert a binary digest to a hex string (other values are returned unchanged)
+        """
+        if isinstance(value, bytes):
+            return value.hex()
+        return value
+
+    @staticmethod
+    def _timestamp_to_epoch(value):
+        """
+        Convert a timestamp 'YYYY-mm-dd HH:MM:SS' to seconds since 1970-01-01 (other values are returned unchanged)
+        """
+        if isinstance(value, str):
+            try:
+                return calendar.timegm(datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timetuple())
+            except ValueError:
+                pass
+        return value
+
+    @staticmethod
+    def _epoch_to_timestamp(value):
+        """
+        Convert seconds since 1970-01-01 to a timestamp 'YYYY-mm-dd HH:MM:SS' (other values are returned unchanged)
+        """
+        if isinstance(value, int):
+            return '{:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=value))
+        return value
+
+    @staticmethod
+    def _to_number(value, number_type):
+        """
+        Convert a value to a number (values which are not numbers are returned unchanged)
+        """
+        if isinstance(value, str):
+            try:
+                return number_type(value)
+            except ValueError:
+                pass
+        return value
+
+    def _encode_value(self, field, value):
+        """
+        Convert a file property to the representation used in the db (compact encoding only)
+        :param field: file field name
+        :param value:
+        """
+        if not self.compact or value is None:
+            return value
+
+        if field == 'file_hash_md5':
+            return self._hash_to_blob(value)
+        if field in ('date_time_original', 'file_date'):
+            return self._timestamp_to_epoch(value)
+        if field in ('image_width', 'image_height'):
+            return self._to_number(value, int)
+        if field in ('gps_latitude', 'gps_longitude'):
+            return self._to_number(value, float)
+        return value
+
+    def _decode_value(self, field, value):
+        """
+        Convert a value read from the db back to the format of the file properties
+        :param field: file field name
+        :param value:
+        """
+        if not self.compact or value is None:
+            return value
+
+        if field == 'file_hash_md5':
+            return self._blob_to_hash(value)
+        if field in ('date_time_original', 'file_date'):
+            return self._epoch_to_timestamp(value)
+        if field in ('image_width', 'image_height', 'gps_latitude', 'gps_longitude'):
+            return str(value)
+        return value
+
     def _create_table_source(self):
         """
         Create the table "source"
         """
         self.logger.debug('creating source table')
         structure_query = (
-            'CREATE TABLE source ('
+            'CREATE TABLE IF NOT EXISTS source ('
             'source_id INTEGER PRIMARY KEY NOT NULL UNIQUE,'
             'source_path TEXT NOT NULL,'
             'source_filename TEXT NOT NULL,'
@@ -95,7 +609,7 @@ class DataBase:
 
         self.logger.debug('creating indexes')
         index_query = (
-            'CREATE UNIQUE INDEX unique_path_filename ON source (source_path, source_filename);'
+            'CREATE UNIQUE INDEX IF NOT EXISTS unique_path_filename ON source (source_path, source_filename);'
         )
         self.execute_sql(index_query)
 
@@ -105,7 +619,7 @@ class DataBase:
         """
         self.logger.debug('creating file table')
         structure_query = (
-            'CREATE TABLE file ('
+            'CREATE TABLE IF NOT EXISTS file ('
             'file_id INTEGER PRIMARY KEY NOT NULL,'
             'file_type TEXT,'
             'file_size BIGINT,'
@@ -128,32 +642,70 @@ class DataBase:
 
         self.logger.debug('creating indexes')
         index_query = (
-            'CREATE UNIQUE INDEX idx_unique_target_path_file ON file (target_path, target_filename);'
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_target_path_file ON file (target_path, target_filename);'
         )
         self.execute_sql(index_query)
 
         index_query = (
-            'CREATE UNIQUE INDEX idx_file_hash_md5 ON file (file_hash_md5);'
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_file_hash_md5 ON file (file_hash_md5);'
         )
         self.execute_sql(index_query)
 
-    def execute_sql(self, sql_str):
+    def execute_sql(self, sql_str, params=()):
         """
         Run a SQL statement against the database
+
+        Values are passed as parameters ('?' placeholders), never formatted into the sql string.
+        This way, sqlite3 can reuse the prepared statement from its cache for every call
         :param sql_str:
+        :param params: sequence of values for the placeholders
+        """
+        return self._execute(sql_str, params)
+
+    def execute_many(self, sql_str, seq_of_params):
+        """
+        Run a SQL statement against the database once for every set of parameters
+        :param sql_str:
+        :param seq_of_params: iterable of parameter sequences
+        """
+        return self._execute(sql_str, seq_of_params, many=True)
+
+    def _execute(self, sql_str, params, many=False):
+        """
+        Execute statement(s), commit or roll back according to the current mode
+        :param sql_str:
+        :param params:
+        :param many: run executemany() instead of execute()
         """
         exec_result = None
 
         c = self.db_connection.cursor()
 
+        if many:
+            # params may be an iterator - keep it for retries
+            params = list(params)
+
         try:
-            self.logger.debug("executing statement: %s", sql_str)
-            exec_result = c.execute(sql_str)
+            for attempt in range(self.busy_retries + 1):
+                try:
+                    if many:
+                        self.logger.debug("executing statement (many): %s", sql_str)
+                        exec_result = c.executemany(sql_str, params)
+                    else:
+                        self.logger.debug("executing statement: %s %s", sql_str, params)
+                        exec_result = c.execute(sql_str, params)
+                    break
+                except sqlite3.OperationalError as error:
+                    # db locked by another process for longer than the busy timeout - retry
+                    if attempt == self.busy_retries or not self._is_busy_error(error):
+                        raise error
+                    self.logger.warning('database is busy - retrying (%s)', attempt + 1)
+                    time.sleep(0.1 * 2 ** attempt)
 
             if self.simulate:
                 self.logger.debug('Simulation mode active => Rollback!')
                 self.db_connection.rollback()
-            else:
+            elif not self._batch_active:
                 self.db_connection.commit()
 
         except Exception as error:
@@ -161,12 +713,122 @@ class DataBase:
             raise error
 
         finally:
-            if not exec_result:
+            # in batch mode, sqlite only undoes the failing statement - keep the pending units
+            if not exec_result and not self._batch_active:
                 self.logger.error('Rollback')
                 self.db_connection.rollback()
 
         return exec_result
 
+    @staticmethod
+    def _is_busy_error(error):
+        """
+        Check if a sqlite error was caused by a lock of another connection
+        :param error: sqlite3.OperationalError
+        :return: bool
+        """
+        message = str(error).lower()
+        return 'locked' in message or 'busy' in message
+
+    @contextmanager
+    def write_lock(self):
+        """
+        Hold the write lock of the db for the block (concurrent mode only)
+
+        Used to make check-and-insert sequences (e.g. assigning a unique target filename and adding
+        the file record) atomic when several importers share the target index. The block runs in an
+        immediate transaction, which is committed at the end of the block (statements are not
+        committed one by one, same as in batch mode). If a transaction is open already, it holds
+        the write lock (transactions start with a write) and is used as it is.
+        """
+        if not self.concurrent or self.db_connection.in_transaction:
+            yield self
+            return
+
+        for attempt in range(self.busy_retries + 1):
+            try:
+                self.db_connection.execute('BEGIN IMMEDIATE')
+                break
+            except sqlite3.OperationalError as error:
+                if attempt == self.busy_retries or not self._is_busy_error(error):
+                    raise error
+                self.logger.warning('waiting for database write lock (%s)', attempt + 1)
+                time.sleep(0.1 * 2 ** attempt)
+
+        batch_active = self._batch_active
+        self._batch_active = True
+        try:
+            yield self
+        except Exception:
+            self.db_connection.rollback()
+            raise
+        else:
+            self.flush()
+        finally:
+            self._batch_active = batch_active
+
+    @contextmanager
+    def batch(self, batch_size=None, commit_interval=None):
+        """
+        Group the statements of several units of work (e.g. imported files) into one transaction
+
+        Inside the block, statements are not committed one by one. Call end_unit() after each
+        unit - the transaction is committed when batch_size units are complete or when
+        commit_interval seconds have passed since the last commit. Pending changes are flushed
+        when the block is left, also if it is left by an exception.
+
+        :param batch_size: units per transaction (default: self.batch_size)
+        :param commit_interval: max. seconds between two commits (default: self.commit_interval)
+        """
+        if self._batch_active:
+            # already batching: join the outer batch
+            yield self
+            return
+
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if commit_interval is not None:
+            self.commit_interval = commit_interval
+
+        self.logger.debug('start batch (size: %s, interval: %ss)', self.batch_size, self.commit_interval)
+        self._batch_active = True
+        self._batch_units = 0
+        self._last_commit = time.monotonic()
+        try:
+            yield self
+        finally:
+            self._batch_active = False
+            self.flush()
+            self.logger.debug('end batch')
+
+    def end_unit(self):
+        """
+        Mark the end of a unit of work in batch mode, commit if the batch is full or due
+        """
+        if not self._batch_active:
+            return
+
+        self._batch_units += 1
+        if self._batch_units >= self.batch_size or \
+                time.monotonic() - self._last_commit >= self.commit_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Commit pending changes (roll back in simulation mode)
+        """
+        if self.db_connection is None:
+            return
+
+        if self.simulate:
+            self.db_connection.rollback()
+        else:
+            self.logger.debug('commit (%s units)', self._batch_units)
+            self.db_connection.commit()
+
+        self._batch_units = 0
+        self._last_commit = time.monotonic()
+
     def drop_all_records(self):
         """
         Empty all tables
@@ -176,6 +838,14 @@ class DataBase:
         self.execute_sql(sql)
         sql = "DELETE FROM source"
         self.execute_sql(sql)
+        sql = "DELETE FROM directory"
+        self.execute_sql(sql)
+
+        self._directory_ids = {}
+        self._clear_source_index()
+
+        # the sources are gone, so all source directories have to be scanned again
+        self.drop_dir_snapshots()
 
     def db_is_empty(self):
         """
@@ -211,6 +881,247 @@ class DataBase:
         sql = "DELETE FROM source"
         self.execute_sql(sql)
 
+        self._clear_source_index()
+
+        # sources are unknown now, so all source directories have to be scanned again
+        self.drop_dir_snapshots()
+
+        # ... and files exiftool hung on are tried again
+        self.execute_sql('DELETE FROM exif_skip_list')
+
+    def get_setting(self, key, default=None):
+        """
+        Get a value from the setting table
+        :param key:
+        :param default: returned if the key is not set
+        :return: str
+        """
+        db_data = self.execute_sql('SELECT value FROM setting WHERE key = ?', (key,)).fetchone()
+        if db_data is None:
+            return default
+        return db_data[0]
+
+    def set_setting(self, key, value):
+        """
+        Store a value in the setting table
+        :param key:
+        :param value:
+        """
+        self.execute_sql('INSERT OR REPLACE INTO setting (key, value) values (?,?)', (key, value))
+
+    def _load_hash_algorithms(self):
+        """
+        Read the hash algorithm of the index and find the algorithms of records not re-keyed yet
+        """
+        self.hash_algorithm = self.get_setting('hash_algorithm', filehash.DEFAULT_HASH_ALGORITHM)
+
+        # distinct values from the index (one lookup per algorithm, no table scan)
+        sql = 'SELECT min(hash_algorithm) FROM file WHERE hash_algorithm > ?'
+        self.legacy_hash_algorithms = []
+        algorithm = ''
+        while True:
+            algorithm = self.execute_sql(sql, (algorithm,)).fetchone()[0]
+            if algorithm is None:
+                break
+            if algorithm != self.hash_algorithm:
+                self.legacy_hash_algorithms.append(algorithm)
+
+    def set_hash_algorithm(self, algorithm):
+        """
+        Change the content hash algorithm of the index
+
+        New records are hashed with the algorithm, existing records are re-keyed by rehash_files().
+        Until then, files are compared with these records by the hash of their algorithm.
+        :param algorithm: name (see filehash.HASH_ALGORITHMS)
+        """
+        if algorithm == self.hash_algorithm:
+            return
+
+        self.logger.info('changing hash algorithm of the index: %s => %s', self.hash_algorithm, algorithm)
+        self.set_setting('hash_algorithm', algorithm)
+        # restart re-keying from the first record
+        self.set_setting('rehash_file_id', '0')
+        self._load_hash_algorithms()
+
+    def load_dir_snapshots(self, root_dir):
+        """
+        Get the snapshots of all directories in the given directory tree
+
+        :param root_dir:
+        :return: dict dir_path => (parent_path, mtime_ns, entry_count)
+        """
+        root_dir = os.path.abspath(root_dir)
+        root_prefix = os.path.join(root_dir, '')
+
+        sql = (
+            'SELECT dir_path, parent_path, mtime_ns, entry_count FROM dir_snapshot '
+            'WHERE '
+            'dir_path = ? '
+            'OR '
+            'substr(dir_path, 1, ?) = ?'
+        )
+
+        snapshots = {}
+        for dir_path, parent_path, mtime_ns, entry_count in self.iter_sql(sql, (root_dir, len(root_prefix),
+                                                                               root_prefix)):
+            snapshots[dir_path] = (parent_path, mtime_ns, entry_count)
+
+        self.logger.debug('loaded %s directory snapshots for %s', len(snapshots), root_dir)
+        return snapshots
+
+    def save_dir_snapshots(self, snapshots, removed_dirs=()):
+        """
+        Store directory snapshots
+        :param snapshots: dict dir_path => (parent_path, mtime_ns, entry_count)
+        :param removed_dirs: paths of directories which do not exist anymore
+        """
+        sql = (
+            'INSERT OR REPLACE INTO dir_snapshot (dir_path, parent_path, mtime_ns, entry_count) '
+            'values (?,?,?,?)'
+        )
+        self.execute_many(sql, ((dir_path,) + snapshot for dir_path, snapshot in snapshots.items()))
+
+        sql = 'DELETE FROM dir_snapshot WHERE dir_path = ?'
+        self.execute_many(sql, ((dir_path,) for dir_path in removed_dirs))
+
+    def drop_dir_snapshots(self):
+        """
+        Delete all directory snapshots (next run walks all directories)
+        """
+        self.execute_sql('DELETE FROM dir_snapshot')
+
+    def _get_directory_id(self, path, create=False):
+        """
+        Get the id of a directory path (source or target path)
+
+        :param path: str
+        :param create: add the path to the directory table if it is not there yet
+        :return: directory id or None (if not found and not created)
+        """
+        directory_id = self._directory_ids.get(path)
+        if directory_id is not None:
+            return directory_id
+
+        sql = 'SELECT directory_id FROM directory WHERE path = ?'
+        db_data = self.execute_sql(sql, (path,)).fetchone()
+
+        if db_data is None and create:
+            self.execute_sql('INSERT OR IGNORE INTO directory (path) values (?)', (path,))
+            db_data = self.execute_sql(sql, (path,)).fetchone()
+
+        if db_data is None:
+            return None
+
+        directory_id = db_data[0]
+        # new ids are rolled back in simulation mode - do not keep them
+        if not self.simulate:
+            self._directory_ids[path] = directory_id
+        return directory_id
+
+    def _get_file_record(self, exif_media_file: ExifMediaFile):
+        """
+        Get field names and values of the file record for the file properties (target path => directory id)
+        :param exif_media_file:
+        :return: tuple (list of field names, tuple of values)
+        """
+        fields = []
+        values = []
+        for field, value in exif_media_file.file_properties.items():
+            if field == 'target_path':
+                field = 'target_directory_id'
+                value = self._get_directory_id(value, create=True)
+            else:
+                value = self._encode_value(field, value)
+            fields.append(field)
+            values.append(value)
+        return fields, tuple(values)
+
+    def _get_source_record(self, exif_media_file: ExifMediaFile):
+        """
+        Get field names and values of the source record for the source properties (source path => directory id)
+        :param exif_media_file:
+        :return: tuple (list of field names, tuple of values)
+        """
+        fields = []
+        values = []
+        for field, value in exif_media_file.source_properties.items():
+            if field == 'source_path':
+                field = 'source_directory_id'
+                value = self._get_directory_id(value, create=True)
+            fields.append(field)
+            values.append(value)
+        return fields, tuple(values)
+
+    def load_source_index(self, root_dirs=None):
+        """
+        Preload known sources into memory, so source_exists() does not need to query the db
+
+        The index is kept up to date by add_source() and the drop methods. Paths outside of
+        the loaded root directories are still looked up in the db.
+
+        :param root_dirs: list of directories to prefetch the sources for (default: all sources)
+        """
+        self._source_index = {}
+
+        if root_dirs is None:
+            self._source_index_roots = None
+            queries = [(
+                'SELECT d.path, s.source_filename FROM source s '
+                'INNER JOIN directory d ON d.directory_id = s.source_directory_id',
+                ()
+            )]
+        else:
+            self._source_index_roots = []
+            queries = []
+            for root_dir in root_dirs:
+                root_dir = os.path.abspath(root_dir)
+                root_prefix = os.path.join(root_dir, '')
+                self._source_index_roots.append(root_prefix)
+                queries.append((
+                    'SELECT d.path, s.source_filename FROM directory d '
+                    'INNER JOIN source s ON s.source_directory_id = d.directory_id '
+                    'WHERE '
+                    'd.path = ? '
+                    'OR '
+                    'substr(d.path, 1, ?) = ?',
+                    (root_dir, len(root_prefix), root_prefix)
+                ))
+
+        nof_sources = 0
+        for sql, params in queries:
+            for source_path, source_filename in self.execute_sql(sql, params).fetchall():
+                self._source_index.setdefault(source_path, set()).add(source_filename)
+                nof_sources += 1
+
+        self.logger.debug('loaded %s known sources into source index', nof_sources)
+
+    def _is_in_source_index(self, source_path):
+        """
+        Check if the source index covers the given source directory
+        :param source_path:
+        :return: bool
+        """
+        if self._source_index is None:
+            return False
+
+        if self._source_index_roots is None:
+            return True
+
+        source_prefix = os.path.join(source_path, '')
+        return any(source_prefix.startswith(root_prefix) for root_prefix in self._source_index_roots)
+
+    def _clear_source_index(self, invalidate=False):
+        """
+        Empty the source index after sources have been deleted
+        :param invalidate: drop the index entirely (if it is unknown which sources were deleted)
+        """
+        if self._source_index is not None:
+            if invalidate:
+                self._source_index = None
+                self._source_index_roots = []
+            else:
+                self._source_index = {}
+
     def source_exists(self, source_file_path):
         """
         Check if source file path has match in db
@@ -222,16 +1133,29 @@ class DataBase:
         source_path = os.path.dirname(source_file_path)
         source_filename = os.path.basename(source_file_path)
 
+        if self._is_in_source_index(source_path):
+            if source_filename in self._source_index.get(source_path, ()):
+                self.logger.debug('source exists in index: %s', source_file_path)
+                return True
+            else:
+                self.logger.debug('source not in index: %s', source_file_path)
+                return False
+
+        source_directory_id = self._get_directory_id(source_path)
+
         sql = (
             'SELECT file_id FROM source '
             'WHERE '
-            "source_path = '{0}' "
+            'source_directory_id = ? '
             'AND '
-            "source_filename = '{1}'"
-        ).format(source_path, source_filename)
+            'source_filename = ?'
+        )
 
-        db_result = self.execute_sql(sql)
-        data = db_result.fetchone()
+        if source_directory_id is None:
+            data = None
+        else:
+            db_result = self.execute_sql(sql, (source_directory_id, source_filename))
+            data = db_result.fetchone()
         if data is None:
             self.logger.debug('source not in db: %s', source_file_path)
             return False
@@ -254,10 +1178,10 @@ class DataBase:
         sql = (
             'SELECT file_id FROM file '
             'WHERE '
-            "target_filename like '{0}%' "
-        ).format(target_file_name)
+            'target_filename like ?'
+        )
 
-        db_result = self.execute_sql(sql)
+        db_result = self.execute_sql(sql, (target_file_name + '%',))
         db_data = db_result.fetchone()
         if db_data is None:
             exif_media_file.file_id = None
@@ -284,12 +1208,12 @@ class DataBase:
         sql = (
             'SELECT file_id FROM file '
             'WHERE '
-            "date_time_original = '{0}' "
+            'date_time_original = ? '
             'AND '
-            "file_type = '{1}'"
-        ).format(date_time_original, file_type)
+            'file_type = ?'
+        )
 
-        db_result = self.execute_sql(sql)
+        db_result = self.execute_sql(sql, (self._encode_value('date_time_original', date_time_original), file_type))
         db_data = db_result.fetchone()
         if db_data is None:
             exif_media_file.file_id = None
@@ -318,14 +1242,15 @@ class DataBase:
         sql = (
             'SELECT file_id FROM file '
             'WHERE '
-            "date_time_original = '{0}' "
+            'date_time_original = ? '
             'AND '
-            "file_type = '{1}' "
+            'file_type = ? '
             'AND '
-            "file_size = {2}"
-        ).format(date_time_original, file_type, file_size)
+            'file_size = ?'
+        )
 
-        db_result = self.execute_sql(sql)
+        db_result = self.execute_sql(sql, (self._encode_value('date_time_original', date_time_original), file_type,
+                                           file_size))
         db_data = db_result.fetchone()
         if db_data is None:
             exif_media_file.file_id = None
@@ -351,10 +1276,10 @@ class DataBase:
         sql = (
             'SELECT file_id FROM file '
             'WHERE '
-            "file_size = {1}"
-        ).format(file_size)
+            'file_size = ?'
+        )
 
-        db_result = self.execute_sql(sql)
+        db_result = self.execute_sql(sql, (file_size,))
         db_data = db_result.fetchone()
         if db_data is None:
             self.logger.debug('file size does not match')
@@ -381,12 +1306,12 @@ class DataBase:
         sql = (
             'SELECT file_id FROM file '
             'WHERE '
-            "file_type = '{0}' "
+            'file_type = ? '
             'AND '
-            "file_size = {1}"
-        ).format(file_type, file_size)
+            'file_size = ?'
+        )
 
-        db_result = self.execute_sql(sql)
+        db_result = self.execute_sql(sql, (file_type, file_size))
         db_data = db_result.fetchone()
 
         if db_data is None:
@@ -408,16 +1333,7 @@ class DataBase:
 
         assert isinstance(exif_media_file, ExifMediaFile)
 
-        file_hash = exif_media_file.file_properties['file_hash_md5']
-
-        sql = (
-            'SELECT file_id FROM file '
-            'WHERE '
-            "file_hash_md5 = '{0}'"
-        ).format(file_hash)
-
-        db_result = self.execute_sql(sql)
-        db_data = db_result.fetchone()
+        db_data = self._find_file_by_hash(exif_media_file, 'f.file_id')
         if db_data is None:
             self.logger.debug("file hash value doesn't match")
             exif_media_file.file_id = None
@@ -427,6 +1343,46 @@ class DataBase:
             exif_media_file.file_id = str(db_data[0])
             return True
 
+    def _find_file_by_hash(self, exif_media_file: ExifMediaFile, columns):
+        """
+        Find the record of the file content by its hash
+
+        Records which were not re-keyed yet (see rehash_files()) are compared with the hash of
+        their algorithm. That hash is only calculated if a record of the same size exists.
+        :param exif_media_file: file with hash (file_hash_md5)
+        :param columns: columns to select from file f and directory d (target path)
+        :return: row or None
+        """
+        sql = (
+            'SELECT ' + columns + ' FROM file f '
+            'INNER JOIN directory d ON d.directory_id = f.target_directory_id '
+            'WHERE '
+            'f.file_hash_md5 = ?'
+        )
+        file_hash = exif_media_file.file_properties['file_hash_md5']
+        db_data = self.execute_sql(sql, (self._encode_value('file_hash_md5', file_hash),)).fetchone()
+
+        # (+: look up by the size index, not by the algorithm index)
+        sql_size = (
+            'SELECT 1 FROM file '
+            'WHERE '
+            'file_size = ? '
+            'AND '
+            '+hash_algorithm = ?'
+        )
+        for algorithm in self.legacy_hash_algorithms:
+            if db_data is not None:
+                break
+
+            file_size = exif_media_file.file_properties['file_size']
+            if self.execute_sql(sql_size, (file_size, algorithm)).fetchone() is None:
+                continue
+
+            file_hash = exif_media_file.get_hash(algorithm)
+            db_data = self.execute_sql(sql, (self._encode_value('file_hash_md5', file_hash),)).fetchone()
+
+        return db_data
+
     def assign_unique_target_filename(self, exif_media_file: ExifMediaFile):
         """
         Modify target filename to make it unique if it already exists with different content
@@ -449,8 +1405,11 @@ class DataBase:
 
         self.logger.debug('de-duplicating filename for: ' + source_filename)
 
+        # get all taken names for this base name at once, then pick the first free counter
+        taken_filenames = self._get_taken_target_filenames(base_target_filename)
+
         counter = 1
-        while not self._is_unique_target_filename(target_filename):
+        while target_filename in taken_filenames:
             self.logger.info('filename <' + target_filename + '> already exists - adding counter')
             target_filename = base_target_filename + '-' + str(counter) + '.' + target_file_extension
             counter += 1
@@ -458,24 +1417,24 @@ class DataBase:
             exif_media_file.file_properties['target_filename'] = target_filename
         self.logger.debug('filename after de-duplication: ' + target_filename)
 
-    def _is_unique_target_filename(self, target_filename):
+    def _get_taken_target_filenames(self, base_target_filename):
         """
-        Check if target filename exists in db (i.e. is not unique)
-        :param target_filename:
-        :return:
+        Get all target filenames in db starting with the given base filename (one index range scan)
+        :param base_target_filename:
+        :return: set of filenames
         """
+        # glob is case sensitive and can use the index on target_filename - escape glob wildcards
+        filename_glob = re.sub(r'([*?\[])', r'[\1]', base_target_filename) + '*'
+
         sql = (
-            'SELECT file_id FROM file '
+            'SELECT target_filename FROM file '
             'WHERE '
-            "target_filename = '{0}' "
-        ).format(target_filename)
+            'target_filename GLOB ?'
+        )
 
-        db_result = self.execute_sql(sql)
+        db_result = self.execute_sql(sql, (filename_glob,))
 
-        if db_result.fetchone() is None:
-            return True
-        else:
-            return False
+        return {row[0] for row in db_result.fetchall()}
 
     def add_file(self, exif_media_file: ExifMediaFile):
         """
@@ -484,18 +1443,44 @@ class DataBase:
         """
         assert isinstance(exif_media_file, ExifMediaFile)
 
-        target_fields_str = ','.join(exif_media_file.file_properties.keys())
-        target_values_str = ','.join("'{0}'".format(v) for v in exif_media_file.file_properties.values())
+        # field names are fixed property keys, only the values are passed as parameters
+        target_fields, target_values = self._get_file_record(exif_media_file)
+        target_fields_str = ','.join(target_fields)
+        target_values_str = ','.join('?' * len(target_fields))
 
         sql = 'INSERT INTO file ({0}) values ({1})'.format(target_fields_str, target_values_str)
-        db_result = self.execute_sql(sql)
+        db_result = self.execute_sql(sql, target_values)
 
-        # store file_id in emf object property
-        sql = "SELECT file_id FROM file WHERE file_hash_md5 = '{0}'".format(
-            exif_media_file.file_properties['file_hash_md5']
-        )
-        db_result = self.execute_sql(sql)
-        exif_media_file.file_id = str(db_result.fetchone()[0])
+        # store file_id in emf object property (file_id is the rowid of the new record)
+        exif_media_file.file_id = str(db_result.lastrowid)
+
+    def ingest_files(self, exif_media_files, add_sources=True):
+        """
+        Add file records and their source records for a batch of files in one transaction
+
+        The file ids are taken from the inserts (no re-query), the source records are
+        inserted in one go afterwards.
+        :param exif_media_files: list of ExifMediaFile objects (with unique target filenames)
+        :param add_sources: also add the source records
+        """
+        with self.batch():
+            for exif_media_file in exif_media_files:
+                self.add_file(exif_media_file)
+
+            if add_sources and exif_media_files:
+                source_fields = None
+                source_rows = []
+                for exif_media_file in exif_media_files:
+                    exif_media_file.source_properties['file_id'] = exif_media_file.file_id
+                    source_fields, source_values = self._get_source_record(exif_media_file)
+                    source_rows.append(source_values)
+
+                sql = 'INSERT INTO source ({0}) values ({1})'.format(','.join(source_fields),
+                                                                      ','.join('?' * len(source_fields)))
+                self.execute_many(sql, source_rows)
+
+                for exif_media_file in exif_media_files:
+                    self._add_to_source_index(exif_media_file)
 
     def update_copy_flags(self, exif_media_file: ExifMediaFile):
         """
@@ -512,9 +1497,9 @@ class DataBase:
             sql = (
                 'UPDATE file '
                 'SET copied = 1, date_copied = CURRENT_TIMESTAMP '
-                'WHERE file_id = {0}'.format(exif_media_file.file_id)
+                'WHERE file_id = ?'
             )
-            self.execute_sql(sql)
+            self.execute_sql(sql, (exif_media_file.file_id,))
         else:
             self.logger.warning("could not update copy flags: target file id is empty in emf!")
 
@@ -529,28 +1514,327 @@ class DataBase:
         if exif_media_file.file_id is not None:
             exif_media_file.source_properties['file_id'] = exif_media_file.file_id
 
-            source_fields_str = ','.join(exif_media_file.source_properties.keys())
-            source_values_str = ','.join("'{0}'".format(v) for v in exif_media_file.source_properties.values())
+            source_fields, source_values = self._get_source_record(exif_media_file)
+            source_fields_str = ','.join(source_fields)
+            source_values_str = ','.join('?' * len(source_fields))
 
             sql = 'INSERT INTO source ({0}) values ({1})'.format(source_fields_str, source_values_str)
-            self.execute_sql(sql)
+            self.execute_sql(sql, source_values)
+
+            self._add_to_source_index(exif_media_file)
         else:
             self.logger.warning("could not insert source: target file id is empty in in emf!")
 
+    def _add_to_source_index(self, exif_media_file: ExifMediaFile):
+        """
+        Keep source index in sync after adding a source (changes are rolled back in simulation mode)
+        :param exif_media_file:
+        """
+        if self._source_index is not None and not self.simulate:
+            self._source_index.setdefault(exif_media_file.source_properties['source_path'], set()).add(
+                exif_media_file.source_properties['source_filename'])
+
+    def iter_sql(self, sql_str, params=(), chunk_size=None):
+        """
+        Run a query and yield the result rows chunk by chunk (fetchmany)
+
+        Uses its own cursor, so memory use does not depend on the size of the result
+        :param sql_str:
+        :param params:
+        :param chunk_size: rows per fetch (default: self.fetch_chunk_size)
+        """
+        if chunk_size is None:
+            chunk_size = self.fetch_chunk_size
+
+        self.logger.debug("iterating statement: %s %s", sql_str, params)
+        c = self.db_connection.cursor()
+        try:
+            c.execute(sql_str, params)
+            while True:
+                rows = c.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            c.close()
+
+    @staticmethod
+    def _to_db_int(value):
+        """
+        Map unsigned 64bit values (e.g. device/inode numbers) to the signed range of sqlite integers
+        :param value: int
+        :return: int
+        """
+        if value >= 1 << 63:
+            value -= 1 << 64
+        return value
+
+    def get_scan_journal_entry(self, exif_media_file: ExifMediaFile):
+        """
+        Look up the results of an earlier scan of the (unchanged) file
+
+        :param exif_media_file:
+        :return: tuple (file_hash_md5, exif_tags) or None
+        """
+        assert isinstance(exif_media_file, ExifMediaFile)
+
+        file_identity = exif_media_file.get_file_identity()
+        if file_identity is None:
+            return None
+
+        st_dev, st_ino, file_size, mtime_ns = file_identity
+
+        sql = (
+            'SELECT file_hash_md5, exif_tags FROM scan_journal '
+            'WHERE '
+            'st_dev = ? '
+            'AND '
+            'st_ino = ? '
+            'AND '
+            'file_size = ? '
+            'AND '
+            'mtime_ns = ? '
+            'AND '
+            'hash_algorithm = ?'
+        )
+
+        db_data = self.execute_sql(sql, (self._to_db_int(st_dev), self._to_db_int(st_ino), file_size,
+                                         mtime_ns, self.hash_algorithm)).fetchone()
+        if db_data is None:
+            self.logger.debug('file not in scan journal: %s', exif_media_file.full_path)
+            self.journal_misses += 1
+            return None
+
+        self.logger.debug('file found in scan journal: %s', exif_media_file.full_path)
+        self.journal_hits += 1
+        file_hash_md5, exif_tags = db_data
+
+        # last_used is updated once for all hits (see update_scan_journal_last_used())
+        self._journal_used_keys.add((self._to_db_int(st_dev), self._to_db_int(st_ino)))
+        exif_tags = json.loads(exif_tags)
+
+        # the file name is not part of the identity (file may have been renamed)
+        exif_tags['File:FileName'] = exif_media_file.name()
+        return file_hash_md5, exif_tags
+
+    def add_scan_journal_entry(self, exif_media_file: ExifMediaFile):
+        """
+        Record hash and exif tags of a scanned file in the scan journal
+        :param exif_media_file:
+        """
+        assert isinstance(exif_media_file, ExifMediaFile)
+
+        file_identity = exif_media_file.get_file_identity()
+        if file_identity is None or exif_media_file.file_properties['file_hash_md5'] is None:
+            return
+
+        st_dev, st_ino, file_size, mtime_ns = file_identity
+
+        # path specific tags are not cached
+        exif_tags = {tag: value for tag, value in exif_media_file.exif_tags.items()
+                     if tag not in ('SourceFile', 'File:FileName')}
+
+        sql = (
+            'INSERT OR REPLACE INTO scan_journal '
+            '(st_dev, st_ino, file_size, mtime_ns, file_hash_md5, hash_algorithm, exif_tags, last_used) '
+            'values (?,?,?,?,?,?,?,?)'
+        )
+        self.execute_sql(sql, (self._to_db_int(st_dev), self._to_db_int(st_ino), file_size, mtime_ns,
+                               exif_media_file.file_properties['file_hash_md5'],
+                               exif_media_file.file_properties['hash_algorithm'], json.dumps(exif_tags),
+                               int(time.time())))
+
+    def is_exif_skip_listed(self, exif_media_file: ExifMediaFile):
+        """
+        Check if exiftool hung on the (unchanged) file before
+        :param exif_media_file:
+        :return: True if the file is on the skip list
+        """
+        assert isinstance(exif_media_file, ExifMediaFile)
+
+        file_identity = exif_media_file.get_file_identity()
+        if file_identity is None:
+            return False
+
+        st_dev, st_ino, file_size, mtime_ns = file_identity
+
+        sql = (
+            'SELECT 1 FROM exif_skip_list '
+            'WHERE '
+            'st_dev = ? '
+            'AND '
+            'st_ino = ? '
+            'AND '
+            'file_size = ? '
+            'AND '
+            'mtime_ns = ?'
+        )
+        return self.execute_sql(sql, (self._to_db_int(st_dev), self._to_db_int(st_ino), file_size,
+                                      mtime_ns)).fetchone() is not None
+
+    def add_exif_skip_entry(self, exif_media_file: ExifMediaFile, reason):
+        """
+        Put a file on the skip list (not read with exiftool again unless it is changed)
+        :param exif_media_file:
+        :param reason: e.g. the exiftool error
+        """
+        assert isinstance(exif_media_file, ExifMediaFile)
+
+        file_identity = exif_media_file.get_file_identity()
+        if file_identity is None:
+            return
+
+        st_dev, st_ino, file_size, mtime_ns = file_identity
+
+        sql = (
+            'INSERT OR REPLACE INTO exif_skip_list '
+            '(st_dev, st_ino, file_size, mtime_ns, file_path, reason) '
+            'values (?,?,?,?,?,?)'
+        )
+        self.execute_sql(sql, (self._to_db_int(st_dev), self._to_db_int(st_ino), file_size, mtime_ns,
+                               exif_media_file.full_path, reason))
+
+    def update_scan_journal_last_used(self):
+        """
+        Set last_used of the scan journal entries found since the last call to the current time
+
+        Lookups only collect the keys, so a scan does not write to the database for every file.
+        :return: number of updated entries
+        """
+        if not self._journal_used_keys:
+            return 0
+        used_keys = self._journal_used_keys
+        self._journal_used_keys = set()
+        last_used = int(time.time())
+        self.execute_many('UPDATE scan_journal SET last_used = ? WHERE st_dev = ? AND st_ino = ?',
+                          ((last_used, st_dev, st_ino) for st_dev, st_ino in used_keys))
+        return len(used_keys)
+
+    def trim_scan_journal(self):
+        """
+        Remove the least recently used scan journal entries exceeding the budget
+
+        The budget is set by journal_max_entries and journal_max_bytes (size of the stored hash and
+        tags plus the fixed size columns, approx. 40 bytes per entry). The entries found since the
+        last update are marked as used first.
+        :return: number of removed entries
+        """
+        self.update_scan_journal_last_used()
+        entry_overhead = 40
+        excess_entries = 0
+        excess_bytes = 0
+
+        if self.journal_max_entries is not None or self.journal_max_bytes is not None:
+            sql = (
+                'SELECT count(*), '
+                'coalesce(sum(length(file_hash_md5) + length(exif_tags)), 0) '
+                'FROM scan_journal'
+            )
+            entries, size = self.execute_sql(sql).fetchone()
+            size += entries * entry_overhead
+
+            if self.journal_max_entries is not None:
+                excess_entries = entries - self.journal_max_entries
+            if self.journal_max_bytes is not None:
+                excess_bytes = size - self.journal_max_bytes
+
+        if excess_entries <= 0 and excess_bytes <= 0:
+            return 0
+
+        # collect the least recently used entries until both limits are met
+        sql = (
+            'SELECT st_dev, st_ino, length(file_hash_md5) + length(exif_tags) '
+            'FROM scan_journal '
+            'ORDER BY last_used'
+        )
+        evict_keys = []
+        for st_dev, st_ino, entry_size in self.iter_sql(sql):
+            if excess_entries <= 0 and excess_bytes <= 0:
+                break
+            evict_keys.append((st_dev, st_ino))
+            excess_entries -= 1
+            excess_bytes -= entry_size + entry_overhead
+
+        self.execute_many('DELETE FROM scan_journal WHERE st_dev = ? AND st_ino = ?', evict_keys)
+        self.journal_evicted += len(evict_keys)
+        self.logger.info('removed %s least recently used entries from the scan journal', len(evict_keys))
+        return len(evict_keys)
+
     def fetch_all_records(self):
         """
         print all db records
         """
         sql = (
-            "SELECT *, 'db timestamps in GMT!' as 'note' FROM file f "
-            'INNER JOIN source s (using file_id) '
+            "SELECT f.*, td.path AS target_path, s.*, sd.path AS source_path, 'db timestamps in GMT!' as 'note' "
+            'FROM file f '
+            'INNER JOIN directory td ON td.directory_id = f.target_directory_id '
+            'INNER JOIN source s USING (file_id) '
+            'INNER JOIN directory sd ON sd.directory_id = s.source_directory_id '
             'ORDER by f.date_time_original DESC'
         )
 
-        db_result = self.execute_sql(sql)
+        c = self.db_connection.cursor()
+        c.execute(sql)
+        columns = [column[0] for column in c.description]
+
+        while True:
+            rows = c.fetchmany(self.fetch_chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                print(repr(tuple(self._decode_value(field, value) for field, value in zip(columns, row))))
+
+    def get_file_properties(self, file_id):
+        """
+        Get the file record with the given id (values in the format of the file properties)
+        :param file_id:
+        :return: dict or None
+        """
+        sql = (
+            'SELECT f.*, d.path AS target_path FROM file f '
+            'INNER JOIN directory d ON d.directory_id = f.target_directory_id '
+            'WHERE '
+            'f.file_id = ?'
+        )
+        db_result = self.execute_sql(sql, (file_id,))
+        row = db_result.fetchone()
+        if row is None:
+            return None
+
+        columns = [column[0] for column in db_result.description]
+        return {field: self._decode_value(field, value) for field, value in zip(columns, row)
+                if field != 'target_directory_id'}
+
+    def count_target_records(self):
+        """
+        get number of target file records in db
+        :return: int
+        """
+        return self.execute_sql('SELECT count(*) FROM file').fetchone()[0]
+
+    def iter_target_files(self, chunk_size=None, by_path=False):
+        """
+        iterate over target files in db
+
+        yields tuples (file_id, target_path, target_filename)
+        :param chunk_size: rows per fetch
+        :param by_path: order by target path and filename (read from the path index) instead of date added
+        """
+        if by_path:
+            sql = (
+                'SELECT f.file_id, d.path, f.target_filename FROM file f '
+                'INNER JOIN directory d ON d.directory_id = f.target_directory_id '
+                'ORDER by d.path, f.target_filename'
+            )
+        else:
+            sql = (
+                'SELECT f.file_id, d.path, f.target_filename FROM file f '
+                'INNER JOIN directory d ON d.directory_id = f.target_directory_id '
+                'ORDER by f.date_added ASC'
+            )
 
-        for row in db_result.fetchall():
-            print(repr(row))
+        return self.iter_sql(sql, chunk_size=chunk_size)
 
     def get_target_file_list(self):
         """
@@ -559,26 +1843,101 @@ class DataBase:
 
         file_list = []
 
+        for file_id, target_path, target_filename in self.iter_target_files():
+            row_object = {
+                'file_id': file_id,
+                'relative_path': target_path,
+                'filename': target_filename
+            }
+            file_list.append(row_object)
+
+        return file_list
+
+    def drop_target_record(self, file_id):
+        self.drop_target_records([file_id])
+
+    def drop_target_records(self, file_ids):
+        """
+        Delete the file records with the given ids (in one statement batch)
+
+        The snapshots of the source directories of the files and of their parent directories are
+        deleted as well, so these directories are scanned again and the sources can be imported again
+        (the walk does not descend from an unchanged directory into subdirectories without snapshot).
+        :param file_ids: iterable of file ids
+        """
+        file_ids = [(file_id,) for file_id in file_ids]
+
         sql = (
-            'SELECT file_id, target_path, target_filename FROM file ORDER by date_added ASC'
+            'WITH RECURSIVE affected (path) AS ('
+            'SELECT d.path FROM source s '
+            'INNER JOIN directory d ON d.directory_id = s.source_directory_id '
+            'WHERE s.file_id = ? '
+            'UNION '
+            'SELECT ds.parent_path FROM dir_snapshot ds '
+            'INNER JOIN affected a ON a.path = ds.dir_path '
+            'WHERE ds.parent_path IS NOT NULL) '
+            'DELETE FROM dir_snapshot '
+            'WHERE '
+            'dir_path IN (SELECT path FROM affected)'
         )
+        self.execute_many(sql, file_ids)
 
-        db_result = self.execute_sql(sql)
+        sql = 'DELETE FROM file WHERE file_id = ?'
+        self.execute_many(sql, file_ids)
 
-        if not db_result is None:
-            for row in db_result.fetchall():
-                row_object = {
-                    'file_id': row[0],
-                    'relative_path': row[1],
-                    'filename': row[2]
-                }
-                file_list.append(row_object)
+        # sources of the files are deleted by the foreign key action
+        self._clear_source_index(invalidate=True)
 
-        return file_list
+    def rehash_files(self, target_dir, limit=None):
+        """
+        Re-key records which were hashed with another algorithm than hash_algorithm
+
+        Runs in steps of limit records (continued where the last run stopped), so a large index is
+        converted over several runs. The target files are hashed before the records are updated,
+        the write lock is only held for the updates. Records of missing files are left as they are
+        (dropped when the index is validated).
+        :param target_dir: target directory of the index
+        :param limit: max. number of records (None: all)
+        :return: tuple (number of re-keyed records, number of records left)
+        """
+        if not self.legacy_hash_algorithms:
+            return 0, 0
 
-    def drop_target_record(self, file_id):
-        sql = 'DELETE FROM file WHERE file_id = {0}'.format(file_id)
-        self.execute_sql(sql)
+        start_file_id = int(self.get_setting('rehash_file_id', '0'))
+        sql = (
+            'SELECT f.file_id, d.path, f.target_filename FROM file f '
+            'INNER JOIN directory d ON d.directory_id = f.target_directory_id '
+            'WHERE '
+            'f.hash_algorithm != ? '
+            'AND '
+            'f.file_id > ? '
+            'ORDER BY f.file_id '
+            'LIMIT ?'
+        )
+        records = self.execute_sql(sql, (self.hash_algorithm, start_file_id,
+                                         -1 if limit is None else limit)).fetchall()
+
+        updates = []
+        for file_id, target_path, target_filename in records:
+            try:
+                file_hash = filehash.hash_for_file(os.path.join(target_dir, target_path, target_filename),
+                                                   self.hash_algorithm)
+            except OSError as error:
+                self.logger.warning('cannot re-hash target file: %s', error)
+                continue
+            updates.append((self._encode_value('file_hash_md5', file_hash), self.hash_algorithm, file_id))
+
+        # the next run continues after the last record (or starts over to retry skipped records)
+        next_file_id = records[-1][0] if limit is not None and len(records) == limit else 0
+
+        with self.write_lock():
+            self.execute_many('UPDATE file SET file_hash_md5 = ?, hash_algorithm = ? WHERE file_id = ?', updates)
+            self.set_setting('rehash_file_id', str(next_file_id))
+
+        self._load_hash_algorithms()
+        remaining = self.execute_sql('SELECT count(*) FROM file WHERE hash_algorithm != ?',
+                                     (self.hash_algorithm,)).fetchone()[0]
+        return len(updates), remaining
 
     def get_target_path_filename(self, exif_media_file: ExifMediaFile):
         """
@@ -587,14 +1946,6 @@ class DataBase:
         assert isinstance(exif_media_file, ExifMediaFile)
 
         if not exif_media_file.file_properties['file_hash_md5']:
-            exif_media_file.calculate_md5()
-
-        file_md5 = exif_media_file.file_properties['file_hash_md5']
-
-        sql = (
-            'SELECT target_path, target_filename FROM file '
-            'WHERE '
-            "file_hash_md5 = '{0}'"
-        ).format(file_md5)
+            exif_media_file.calculate_hash()
 
-        return self.execute_sql(sql).fetchone()
+        return self._find_file_by_hash(exif_media_file, 'd.path, f.target_filename')
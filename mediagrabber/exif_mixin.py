@@ -4,9 +4,55 @@
 
 import datetime
 import logging
+import os
 import re
-
-from exiftool import ExifTool
+from collections import namedtuple
+from functools import partial
+
+import exif_reader
+import exiftool_daemon
+from exiftool import ExifTool, ExifToolTimeoutError
+
+# what exiftool reads for a file type:
+# tags - tags to extract, fast - exiftool -fast level (0: off, 1: -fast, 2: -fast2),
+# maker_notes - extract maker notes (skipped by -fast2 in any case)
+ReadProfile = namedtuple('ReadProfile', ['tags', 'fast', 'maker_notes'])
+
+# tags used for images (all create dates which can occur in image files)
+IMAGE_READ_TAGS = (
+    'Make', 'Model', 'GPSLatitude', 'GPSLongitude', 'ImageWidth', 'ImageHeight',
+    'EXIF:DateTimeOriginal', 'EXIF:CreateDate', 'EXIF:ModifyDate',
+    'File:FileName', 'File:FileCreateDate', 'File:FileModifyDate'
+)
+
+# tags used for all other files (same as ExifMixin.exif_read_tags)
+ALL_READ_TAGS = (
+    'Make', 'Model', 'GPSLatitude', 'GPSLongitude', 'ImageWidth', 'ImageHeight',
+    'EXIF:DateTimeOriginal', 'EXIF:CreateDate', 'QuickTime:CreateDate', 'QuickTime:TrackCreateDate',
+    'H264:DateTimeOriginal', 'QuickTime:MediaCreateDate', 'MediaCreateDate', 'EXIF:ModifyDate',
+    'File:FileName', 'File:FileCreateDate', 'File:FileModifyDate'
+)
+
+IMAGE_FILE_TYPES = ('JPG', 'JPEG', 'JPE', 'TIF', 'TIFF', 'PNG', 'GIF', 'BMP', 'DNG', 'CR2', 'NEF', 'ARW', 'ORF',
+                    'RW2')
+
+# read profiles: file type (extension) => ReadProfile, '*' for all other types
+# - full: all tags for all files, no fast modes (same as versions before read profiles)
+# - standard: only tags which can occur in the file type, -fast (does not read trailers), no maker notes
+# - fast: same as standard with -fast2 (may miss dates which are only found by scanning the file, e.g. mts videos)
+READ_PROFILES = {
+    'full': {
+        '*': ReadProfile(ALL_READ_TAGS, 0, True),
+    },
+    'standard': dict(
+        {file_type: ReadProfile(IMAGE_READ_TAGS, 1, False) for file_type in IMAGE_FILE_TYPES},
+        **{'*': ReadProfile(ALL_READ_TAGS, 1, False)}
+    ),
+    'fast': dict(
+        {file_type: ReadProfile(IMAGE_READ_TAGS, 2, False) for file_type in IMAGE_FILE_TYPES},
+        **{'*': ReadProfile(ALL_READ_TAGS, 2, False)}
+    ),
+}
 
 
 class ExifMixin:
@@ -14,6 +60,18 @@ class ExifMixin:
     Mixin class used to add ExifTool related methods to a base class
     """
 
+    # read JPEG/TIFF/HEIC exif blocks directly, exiftool is used only if there is no valid create date
+    use_exif_reader = True
+
+    # read profile used for exiftool (see READ_PROFILES)
+    read_profile = 'standard'
+
+    # socket of the exiftool daemon, used instead of an own exiftool process if the daemon is running (None: off)
+    exif_daemon_socket = exiftool_daemon.default_socket_path()
+
+    # seconds exiftool may take without output before it is restarted (None: wait forever)
+    exif_timeout = None
+
     def __init__(self, exiftool_process=None, logger=None, *args, **kwargs):
         self.logger = logger or logging.getLogger(__name__)
         self.logger.debug('Init ExifMixin')
@@ -25,6 +83,8 @@ class ExifMixin:
         self._exiftool_process = exiftool_process
         self._external_et_process = False
         self.exif_data = {}
+        self.exif_tags = {}  # tags as read from the file (before collapsing the create dates)
+        self.exif_timed_out = False  # exiftool hung on the file (see read_exif_tags_batch())
 
         # exif tags used to determine creation timestamp - the oldest date of these is considered the create date!
         self.exif_create_date_tags = [
@@ -70,12 +130,18 @@ class ExifMixin:
 
     def start_et_process(self):
         """
-        Starts local ExifTool process
+        Starts local ExifTool process (or connects to the exiftool daemon if it is running)
 
         :return:
         """
         if not self._external_et_process and self._exiftool_process is None:
-            self._exiftool_process = ExifTool()
+            if self.exif_daemon_socket is not None:
+                self._exiftool_process = exiftool_daemon.connect(self.exif_daemon_socket, self.exif_timeout)
+                if self._exiftool_process is not None:
+                    self.logger.debug('connected to exiftool daemon')
+                    return
+
+            self._exiftool_process = ExifTool(timeout=self.exif_timeout)
             self._exiftool_process.start()
             self.logger.debug('started new et process')
 
@@ -112,19 +178,158 @@ class ExifMixin:
         :return:
         """
 
-        if self._exiftool_process is None:
-            self.start_et_process()
+        self.exif_data = self.read_exif_tags_fast(path_to_file)
+        if self.exif_data is None:
+            if self._exiftool_process is None:
+                self.start_et_process()
 
-        self.exif_data = {}
-        self.exif_data = self._exiftool_process.get_tags(self.exif_read_tags, path_to_file)
+            profile = self.get_read_profile(path_to_file)
+            self.exif_data = self._exiftool_process.get_tags(profile.tags, path_to_file,
+                                                             self._exiftool_options(profile))
         self.logger.debug('Read tags: %s', self.exif_data)
 
-    def parse_exif_tags(self, path_to_file):
+    def get_read_profile(self, path_to_file):
+        """
+        Get the read profile for the file type of the file (see READ_PROFILES)
+
+        :param path_to_file
+        :return: ReadProfile
+        """
+        profiles = READ_PROFILES[self.read_profile]
+        file_type = os.path.splitext(path_to_file)[1].replace('.', '').upper()
+        return profiles.get(file_type, profiles['*'])
+
+    @staticmethod
+    def _exiftool_options(profile):
+        """
+        exiftool options for a read profile
+        :param profile: ReadProfile
+        :return: list of options
+        """
+        options = []
+        if profile.fast == 1:
+            options.append('-fast')
+        elif profile.fast >= 2:
+            options.append('-fast2')
+        if not profile.maker_notes and profile.fast < 2:
+            options.append('--MakerNotes:all')
+        return options
+
+    @staticmethod
+    def _group_by_read_profile(exif_files):
+        """
+        Group files by their read profile (one exiftool call per profile)
+        :return: list of (ReadProfile, list of files)
+        """
+        groups = {}
+        for exif_file in exif_files:
+            groups.setdefault(exif_file.get_read_profile(exif_file.full_path), []).append(exif_file)
+        return list(groups.items())
+
+    @staticmethod
+    def request_exif_tags_batch(exif_files, exiftool_process):
+        """
+        Request the exif tags of several files from exiftool, without waiting for the result
+
+        :param exif_files: list of objects using this mixin
+        :param exiftool_process: running ExifToolThread or ExifToolPool (see submit_tags_batch())
+        :return: list of futures of the exiftool results (one per read profile)
+        """
+        return [exiftool_process.submit_tags_batch(profile.tags, [f.full_path for f in files],
+                                                   ExifMixin._exiftool_options(profile))
+                for profile, files in ExifMixin._group_by_read_profile(exif_files)]
+
+    def read_exif_tags_fast(self, path_to_file):
+        """
+        Read the exif tags without exiftool (see exif_reader)
+
+        :param path_to_file
+        :return: tags or None if exiftool is needed (unsupported file, no valid create date)
+        """
+        if not self.use_exif_reader:
+            return None
+
+        try:
+            exif_tags = exif_reader.read_exif_tags(path_to_file)
+        except Exception as error:
+            # malformed files the reader does not handle must not stop the import
+            self.logger.warning('cannot read exif block of "%s" (%s) - using exiftool', path_to_file, error)
+            return None
+        if exif_tags is not None:
+            self.logger.debug('read exif block: %s', path_to_file)
+        return exif_tags
+
+    @staticmethod
+    def read_exif_tags_batch(exif_files, exiftool_process, exif_requests=None):
+        """
+        Read the exif tags of several files with a single exiftool call (per read profile)
+
+        Files with a valid create date in their exif block are read without exiftool. For the
+        other files, the results are mapped back by their SourceFile. If the call fails or a file
+        is missing in the output, these files are read one by one, so a failing file does not
+        affect the other files of the batch. This includes batches interrupted by the exiftool
+        timeout - the file exiftool hangs on is then marked with exif_timed_out.
+        :param exif_files: list of objects using this mixin
+        :param exiftool_process: running ExifTool instance
+        :param exif_requests: futures returned by request_exif_tags_batch() for the files, if requested
+                              earlier (exiftool is used for all files in this case)
+        :return: list of tag dicts in the order of exif_files (None for files which could not be read)
+        """
+        results = [None] * len(exif_files)
+        if not exif_files:
+            return results
+
+        logger = exif_files[0].logger
+
+        def path_key(path):
+            return os.path.normcase(os.path.normpath(path))
+
+        if exif_requests is None:
+            for index, exif_file in enumerate(exif_files):
+                results[index] = exif_file.read_exif_tags_fast(exif_file.full_path)
+
+            pending_files = [f for f, tags in zip(exif_files, results) if tags is None]
+            batch_calls = [partial(exiftool_process.get_tags_batch, profile.tags, [f.full_path for f in files],
+                                   ExifMixin._exiftool_options(profile))
+                           for profile, files in ExifMixin._group_by_read_profile(pending_files)]
+        else:
+            batch_calls = [exif_request.result for exif_request in exif_requests]
+
+        tags_by_path = {}
+        for batch_call in batch_calls:
+            try:
+                tags_by_path.update((path_key(tags['SourceFile']), tags) for tags in batch_call())
+            except (ValueError, KeyError, TypeError) as error:
+                # e.g. no output at all (all files failed) - read files one by one
+                logger.warning('batch read failed (%s) - reading files one by one', error)
+
+        for index, exif_file in enumerate(exif_files):
+            if results[index] is None:
+                results[index] = tags_by_path.get(path_key(exif_file.full_path))
+            if results[index] is None:
+                try:
+                    profile = exif_file.get_read_profile(exif_file.full_path)
+                    results[index] = exiftool_process.get_tags(profile.tags, exif_file.full_path,
+                                                               ExifMixin._exiftool_options(profile))
+                except ExifToolTimeoutError as error:
+                    exif_file.exif_timed_out = True
+                    logger.error('exiftool hangs on "%s": %s', exif_file.full_path, error)
+                except (ValueError, IndexError) as error:
+                    logger.error('could not read exif tags of "%s": %s', exif_file.full_path, error)
+
+        return results
+
+    def parse_exif_tags(self, path_to_file, exif_tags=None):
         """
         Wrapper for read_exif_tags which additionally collapses the create date
         :param path_to_file:
+        :param exif_tags: tags read earlier (e.g. from the scan journal) - if given, exiftool is not called
         """
-        self.read_exif_tags(path_to_file)
+        if exif_tags is None:
+            self.read_exif_tags(path_to_file)
+        else:
+            self.exif_data = dict(exif_tags)
+        self.exif_tags = dict(self.exif_data)
         self._exif_collapse_create_dates()
         self.logger.debug('Parsed tags: %s', self.exif_data)
 
@@ -0,0 +1,486 @@
+# To change this license header, choose License Headers in Project Properties.
+# To change this template file, choose Tools | Templates
+# and open the template in the editor.
+
+"""
+Lightweight EXIF reader for JPEG, TIFF and HEIC files (and create dates of QuickTime/MP4 videos)
+
+Reads the few tags mediagrabber needs (create dates, camera make/model, GPS position and image
+size) directly from the EXIF block, without starting exiftool. The tags are returned in the
+format of exiftool's JSON output with the options -G -n (e.g. 'EXIF:DateTimeOriginal'), so they
+can be used in place of the exiftool output.
+
+For videos, the create dates of the movie, the first track and its media are read from the
+moov box (mvhd, tkhd, mdhd) - the media data is skipped by seeking.
+"""
+
+import datetime
+import mmap
+import os
+import struct
+
+# TIFF tags (IFD0, Exif IFD, GPS IFD) => exiftool tag names
+IFD0_TAGS = {
+    0x0100: 'EXIF:ImageWidth',
+    0x0101: 'EXIF:ImageHeight',
+    0x010F: 'EXIF:Make',
+    0x0110: 'EXIF:Model',
+    0x0132: 'EXIF:ModifyDate',
+}
+EXIF_IFD_TAGS = {
+    0x9003: 'EXIF:DateTimeOriginal',
+    0x9004: 'EXIF:CreateDate',
+}
+GPS_IFD_TAGS = {
+    0x0002: 'EXIF:GPSLatitude',
+    0x0004: 'EXIF:GPSLongitude',
+}
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+
+# create date tags, one of them is needed for a usable result
+DATE_TAGS = ('EXIF:DateTimeOriginal', 'EXIF:CreateDate', 'EXIF:ModifyDate',
+             'QuickTime:CreateDate', 'QuickTime:TrackCreateDate', 'QuickTime:MediaCreateDate')
+
+# TIFF field types => (struct format, size)
+FIELD_TYPES = {
+    1: ('B', 1),  # BYTE
+    2: ('s', 1),  # ASCII
+    3: ('H', 2),  # SHORT
+    4: ('L', 4),  # LONG
+    5: ('LL', 8),  # RATIONAL
+    7: ('B', 1),  # UNDEFINED
+    9: ('l', 4),  # SLONG
+    10: ('ll', 8),  # SRATIONAL
+}
+
+# JPEG start of frame markers (contain the image size)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1', b'avif'}
+
+# first box of QuickTime/MP4 files (old QuickTime files have no ftyp box)
+QUICKTIME_BOXES = {b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'}
+
+# QuickTime timestamps count the seconds since 1904-01-01
+QUICKTIME_EPOCH = datetime.datetime(1904, 1, 1)
+
+# QuickTime boxes with create dates => exiftool tag names
+QUICKTIME_DATE_BOXES = {
+    b'mvhd': 'QuickTime:CreateDate',
+    b'tkhd': 'QuickTime:TrackCreateDate',
+    b'mdhd': 'QuickTime:MediaCreateDate',
+}
+
+
+class ExifFormatError(ValueError):
+    """
+    The file is not a supported format or the EXIF block is broken
+    """
+
+
+def read_exif_tags(path_to_file):
+    """
+    Read the EXIF tags of a JPEG, TIFF or HEIC file (create dates of a QuickTime/MP4 file)
+
+    Returns None if the file has no valid create date in its EXIF block (or is not supported),
+    exiftool has to be used in this case.
+    :param path_to_file:
+    :return: dict of tags as returned by exiftool (-G -n), including SourceFile and File:* tags
+    """
+    try:
+        with open(path_to_file, 'rb') as f:
+            tags = _read_tags(f)
+            file_stat = os.fstat(f.fileno())
+    except (OSError, ValueError, OverflowError, struct.error):
+        return None
+
+    if not any(_is_valid_date(tags.get(tag)) for tag in DATE_TAGS):
+        return None
+
+    tags['SourceFile'] = path_to_file
+    tags['File:FileName'] = os.path.basename(path_to_file)
+    tags['File:FileModifyDate'] = _format_file_date(file_stat.st_mtime)
+    create_time = getattr(file_stat, 'st_birthtime', None)
+    if create_time is None and os.name == 'nt':
+        create_time = file_stat.st_ctime
+    if create_time is not None:
+        tags['File:FileCreateDate'] = _format_file_date(create_time)
+
+    return tags
+
+
+def _read_tags(f):
+    """
+    Read the tags according to the file format (detected by the first bytes)
+    """
+    header = f.read(12)
+    if header[:2] == b'\xff\xd8':
+        return _read_jpeg(f)
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        # the IFDs may be anywhere in the file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _parse_tiff(data, file_type='TIFF')
+    if header[4:8] == b'ftyp' and header[8:12] in HEIF_BRANDS:
+        return _read_heif(f)
+    if header[4:8] in QUICKTIME_BOXES:
+        return _read_quicktime(f)
+    raise ExifFormatError('unsupported file format')
+
+
+def _read_jpeg(f):
+    """
+    Read the EXIF block (APP1) and the image size (SOF) of a JPEG file
+    """
+    tags = {}
+    exif_found = False
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            break
+        marker = marker[1]
+        if marker == 0xFF:
+            # fill byte
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        if marker in (0xD9, 0xDA):
+            # end of image / start of scan: no more metadata
+            break
+
+        length = struct.unpack('>H', f.read(2))[0]
+        if length < 2:
+            break
+
+        if marker == 0xE1 and not exif_found:
+            segment = f.read(length - 2)
+            if segment[:6] == b'Exif\x00\x00':
+                tags.update(_parse_tiff(segment[6:]))
+                exif_found = True
+            continue
+
+        if marker in JPEG_SOF_MARKERS:
+            segment = f.read(length - 2)
+            height, width = struct.unpack('>HH', segment[1:5])
+            tags['File:ImageWidth'] = width
+            tags['File:ImageHeight'] = height
+            break
+
+        f.seek(length - 2, os.SEEK_CUR)
+
+    return tags
+
+
+def _read_heif(f):
+    """
+    Read the EXIF block of a HEIF/HEIC file (item of type 'Exif' in the meta box)
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    f.seek(0)
+
+    meta = None
+    for box_type, start, end in _iter_boxes(f, 0, file_size):
+        if box_type == b'meta':
+            f.seek(start)
+            meta = f.read(end - start)
+            break
+    if meta is None:
+        raise ExifFormatError('no meta box')
+
+    # meta is a full box (version and flags first)
+    exif_item_id = None
+    locations = {}
+    for box_type, start, end in _iter_buffer_boxes(meta, 4, len(meta)):
+        if box_type == b'iinf':
+            exif_item_id = _heif_exif_item_id(meta, start, end)
+        elif box_type == b'iloc':
+            locations = _heif_item_locations(meta, start)
+
+    if exif_item_id is None or exif_item_id not in locations:
+        raise ExifFormatError('no exif item')
+
+    offset, length = locations[exif_item_id]
+    f.seek(offset)
+    data = f.read(length)
+    # the data starts with the offset of the TIFF header
+    tiff_offset = struct.unpack('>L', data[:4])[0] + 4
+    return _parse_tiff(data[tiff_offset:])
+
+
+def _read_quicktime(f):
+    """
+    Read the create dates of a QuickTime/MP4 file
+
+    Walks the box tree moov => mvhd, moov/trak => tkhd, moov/trak/mdia => mdhd (first track) with
+    seeks, only the header boxes are read.
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+
+    tags = {}
+    for box_type, start, end in _iter_boxes(f, 0, file_size):
+        if box_type != b'moov':
+            continue
+        for moov_type, moov_start, moov_end in _iter_boxes(f, start, end):
+            if moov_type == b'mvhd':
+                _read_quicktime_date(f, moov_type, moov_start, moov_end, tags)
+            elif moov_type == b'trak' and 'QuickTime:TrackCreateDate' not in tags:
+                for trak_type, trak_start, trak_end in _iter_boxes(f, moov_start, moov_end):
+                    if trak_type == b'tkhd':
+                        _read_quicktime_date(f, trak_type, trak_start, trak_end, tags)
+                    elif trak_type == b'mdia':
+                        for mdia_type, mdia_start, mdia_end in _iter_boxes(f, trak_start, trak_end):
+                            if mdia_type == b'mdhd':
+                                _read_quicktime_date(f, mdia_type, mdia_start, mdia_end, tags)
+        break
+
+    return tags
+
+
+def _read_quicktime_date(f, box_type, start, end, tags):
+    """
+    Read the creation time of a mvhd, tkhd or mdhd box (full box: version 1 has 64 bit times)
+    """
+    f.seek(start)
+    data = f.read(min(12, end - start))
+    if len(data) < 8 or (data[0] == 1 and len(data) < 12):
+        raise ExifFormatError('truncated %s box' % box_type.decode('latin-1'))
+    if data[0] == 1:
+        seconds = struct.unpack('>Q', data[4:12])[0]
+    else:
+        seconds = struct.unpack('>L', data[4:8])[0]
+
+    if seconds == 0:
+        # not set (exiftool shows zeros as well)
+        tags[QUICKTIME_DATE_BOXES[box_type]] = '0000:00:00 00:00:00'
+    else:
+        date = QUICKTIME_EPOCH + datetime.timedelta(seconds=seconds)
+        tags[QUICKTIME_DATE_BOXES[box_type]] = '{:%Y:%m:%d %H:%M:%S}'.format(date)
+
+
+def _iter_boxes(f, start, end):
+    """
+    Iterate over the ISO base media boxes of a file between start and end
+
+    The end of a box is limited to end (a truncated file or a box larger than its parent box).
+    :return: iterator of (box type, start of content, end of box)
+    """
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            raise ExifFormatError('truncated box header')
+        size, box_type = struct.unpack('>L4s', header)
+        header_size = 8
+        if size == 1:
+            large_size = f.read(8)
+            if len(large_size) < 8:
+                raise ExifFormatError('truncated box header')
+            size = struct.unpack('>Q', large_size)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size:
+            break
+        yield box_type, position + header_size, min(position + size, end)
+        position += size
+
+
+def _iter_buffer_boxes(data, start, end):
+    """
+    Iterate over the ISO base media boxes in data between start and end (see _iter_boxes())
+    """
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack('>L4s', data[position:position + 8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[position + 8:position + 16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size:
+            break
+        yield box_type, position + header_size, min(position + size, end)
+        position += size
+
+
+def _heif_exif_item_id(data, start, end):
+    """
+    Parse the iinf box
+    :return: id of the item of type 'Exif' or None
+    """
+    version = data[start]
+    position = start + 4
+    if version == 0:
+        position += 2
+    else:
+        position += 4
+
+    for box_type, infe_start, infe_end in _iter_buffer_boxes(data, position, end):
+        if box_type != b'infe':
+            continue
+        infe_version = data[infe_start]
+        if infe_version < 2:
+            continue
+        position = infe_start + 4
+        if infe_version == 2:
+            item_id = struct.unpack('>H', data[position:position + 2])[0]
+            position += 2
+        else:
+            item_id = struct.unpack('>L', data[position:position + 4])[0]
+            position += 4
+        item_type = data[position + 2:position + 6]
+        if item_type == b'Exif':
+            return item_id
+
+    return None
+
+
+def _heif_item_locations(data, start):
+    """
+    Parse the iloc box
+    :return: dict item id => (file offset, length) of the first extent (file based items only)
+    """
+    version = data[start]
+    position = start + 4
+    offset_size = data[position] >> 4
+    length_size = data[position] & 0x0F
+    base_offset_size = data[position + 1] >> 4
+    index_size = data[position + 1] & 0x0F if version in (1, 2) else 0
+    position += 2
+
+    def read_int(size):
+        nonlocal position
+        value = int.from_bytes(data[position:position + size], 'big') if size else 0
+        position += size
+        return value
+
+    item_count = read_int(2 if version < 2 else 4)
+    locations = {}
+    for _ in range(item_count):
+        item_id = read_int(2 if version < 2 else 4)
+        construction_method = read_int(2) & 0x0F if version in (1, 2) else 0
+        read_int(2)  # data reference index
+        base_offset = read_int(base_offset_size)
+        extent_count = read_int(2)
+        for extent in range(extent_count):
+            read_int(index_size)
+            extent_offset = read_int(offset_size)
+            extent_length = read_int(length_size)
+            if extent == 0 and construction_method == 0:
+                locations[item_id] = (base_offset + extent_offset, extent_length)
+
+    return locations
+
+
+def _parse_tiff(data, file_type=None):
+    """
+    Parse the IFDs of a TIFF structure (EXIF block)
+    :param data: bytes, starting with the TIFF header
+    :param file_type: 'TIFF' for TIFF files (image size from IFD0), None for embedded EXIF blocks
+    """
+    if data[:2] == b'II':
+        byte_order = '<'
+    elif data[:2] == b'MM':
+        byte_order = '>'
+    else:
+        raise ExifFormatError('invalid TIFF header')
+
+    tags = {}
+    ifd0_offset = struct.unpack(byte_order + 'L', data[4:8])[0]
+    ifd0 = _read_ifd(data, ifd0_offset, byte_order)
+
+    for tag_id, name in IFD0_TAGS.items():
+        if tag_id in ifd0 and (file_type == 'TIFF' or tag_id not in (0x0100, 0x0101)):
+            tags[name] = ifd0[tag_id]
+
+    if EXIF_IFD_POINTER in ifd0:
+        exif_ifd = _read_ifd(data, _ifd_pointer(data, ifd0[EXIF_IFD_POINTER]), byte_order)
+        for tag_id, name in EXIF_IFD_TAGS.items():
+            if tag_id in exif_ifd:
+                tags[name] = exif_ifd[tag_id]
+
+    if GPS_IFD_POINTER in ifd0:
+        gps_ifd = _read_ifd(data, _ifd_pointer(data, ifd0[GPS_IFD_POINTER]), byte_order)
+        for tag_id, name in GPS_IFD_TAGS.items():
+            value = gps_ifd.get(tag_id)
+            if isinstance(value, tuple) and len(value) == 3:
+                # degrees, minutes, seconds => decimal degrees (unsigned, same as exiftool -n)
+                tags[name] = value[0] + value[1] / 60 + value[2] / 3600
+
+    return tags
+
+
+def _ifd_pointer(data, value):
+    """
+    Check the value of an IFD pointer tag (a single offset within data)
+    """
+    if not isinstance(value, int) or not 8 <= value < len(data):
+        raise ExifFormatError('invalid IFD pointer: %r' % (value,))
+    return value
+
+
+def _read_ifd(data, offset, byte_order):
+    """
+    Read the entries of an IFD
+    :return: dict tag id => value (str for ASCII, number or tuple of numbers)
+    """
+    if offset + 2 > len(data):
+        raise ExifFormatError('invalid IFD offset')
+
+    entries = {}
+    entry_count = struct.unpack(byte_order + 'H', data[offset:offset + 2])[0]
+    for index in range(entry_count):
+        entry = offset + 2 + index * 12
+        if entry + 12 > len(data):
+            break
+        tag_id, field_type, count = struct.unpack(byte_order + 'HHL', data[entry:entry + 8])
+        if field_type not in FIELD_TYPES:
+            continue
+
+        value_format, value_size = FIELD_TYPES[field_type]
+        size = value_size * count
+        if size <= 4:
+            value_data = data[entry + 8:entry + 8 + size]
+        else:
+            value_offset = struct.unpack(byte_order + 'L', data[entry + 8:entry + 12])[0]
+            value_data = data[value_offset:value_offset + size]
+            if len(value_data) < size:
+                continue
+
+        if field_type == 2:
+            entries[tag_id] = value_data.split(b'\x00', 1)[0].decode('utf-8', 'replace').strip()
+        elif field_type in (5, 10):
+            numbers = struct.unpack(byte_order + value_format[0] * (2 * count), value_data)
+            values = tuple(n / d if d else 0.0 for n, d in zip(numbers[::2], numbers[1::2]))
+            entries[tag_id] = values[0] if count == 1 else values
+        else:
+            values = struct.unpack(byte_order + value_format * count, value_data)
+            entries[tag_id] = values[0] if count == 1 else values
+
+    return entries
+
+
+def _is_valid_date(value):
+    """
+    Check for a complete timestamp 'YYYY:mm:dd HH:MM:SS' (not all zeros)
+    """
+    if not isinstance(value, str) or len(value) < 19:
+        return False
+    try:
+        datetime.datetime.strptime(value[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return False
+    return True
+
+
+def _format_file_date(timestamp):
+    """
+    Format a file system timestamp like exiftool (local time with time zone offset)
+    """
+    date = datetime.datetime.fromtimestamp(timestamp).astimezone()
+    offset = date.strftime('%z')
+    return date.strftime('%Y:%m:%d %H:%M:%S') + offset[:3] + ':' + offset[3:]
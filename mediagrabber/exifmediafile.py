@@ -39,9 +39,12 @@ class ExifMediaFile(ExifMixin, MediaFile):
         """
         super().read_exif_tags(self.full_path)
 
-    def parse_exif_info(self):
-        # read and parse exif info into self.file_properties
-        super().parse_exif_tags(self.full_path)
+    def parse_exif_info(self, exif_tags=None):
+        """
+        Read and parse exif info into self.file_properties
+        :param exif_tags: tags read earlier - if given, exiftool is not called
+        """
+        super().parse_exif_tags(self.full_path, exif_tags)
 
         # date_time_original
         dto = self._get_date_from_timestamp(self, self.exif_data['CollapsedDateTimeOriginal'])
@@ -126,6 +129,6 @@ if __name__ == "__main__":
     print('emf:\n', emf)
     emf.parse_exif_info()
     print('emf (exif):\n', emf)
-    emf.calculate_md5()
-    print('emf (exif + md5):\n', emf)
+    emf.calculate_hash()
+    print('emf (exif + hash):\n', emf)
     del emf
@@ -58,6 +58,7 @@ from __future__ import unicode_literals
 import sys
 import subprocess
 import os
+import select
 import json
 import warnings
 import codecs
@@ -75,13 +76,14 @@ If the executable is not located in one of the paths listed in the
 """
 
 # Sentinel indicating the end of the output of a sequence of commands.
-# The standard value should be fine.
+# The standard value should be fine.  Commands are numbered
+# (``-executeNUM``), so the actual sentinel is ``{readyNUM}``.
 sentinel = b"{ready}"
 
 # The block size when reading from exiftool.  The standard value
 # should be fine, though other values might give better performance in
 # some cases.
-block_size = 4096
+block_size = 65536
 
 # This code has been adapted from Lib/os.py in the Python source tree
 # (sha1 265e36e277f3)
@@ -112,6 +114,38 @@ def _fscodec():
 fsencode = _fscodec()
 del _fscodec
 
+def find_sentinel(output, ready, start=0):
+    """Find the end-of-output sentinel ``ready`` in ``output``.
+
+    ``exiftool`` prints the sentinel on a line of its own, so a match
+    that does not start a line or is not followed by a line break
+    (e.g. in a tag value) is skipped.  Returns the position of the
+    sentinel, or -1.  If it is not found, the search can continue from
+    :py:func:`sentinel_search_start` when more output has arrived.
+    """
+    position = output.find(ready, start)
+    while position >= 0:
+        end = position + len(ready)
+        if ((position == 0 or output[position - 1:position] == b"\n") and
+                (output[end:end + 1] == b"\n" or output[end:end + 2] == b"\r\n")):
+            return position
+        position = output.find(ready, position + 1)
+    return -1
+
+def sentinel_search_start(output, ready):
+    """Position to continue the search for ``ready`` from when more
+    output arrives: the sentinel or its line break may be incomplete.
+    """
+    return max(0, len(output) - len(ready) - 1)
+
+class ExifToolTimeoutError(ValueError):
+    """Raised if ``exiftool`` produced no output within the timeout.
+
+    The hanging process has been killed and restarted when this is
+    raised, so the instance can be used for the next request.
+    """
+
+
 class ExifTool(object):
     """Run the `exiftool` command-line tool and communicate to it.
 
@@ -146,14 +180,24 @@ class ExifTool(object):
 
        A Boolean value indicating whether this instance is currently
        associated with a running subprocess.
+
+    .. py:attribute:: timeout
+
+       Seconds ``exiftool`` may take without any output while a batch
+       is executed (``None``: wait forever).  If it takes longer (e.g.
+       hangs on a corrupt file), the process is killed and restarted
+       and :py:exc:`ExifToolTimeoutError` is raised.  Not supported on
+       Windows, where pipes cannot be polled.
     """
 
-    def __init__(self, executable_=None):
+    def __init__(self, executable_=None, timeout=None):
         if executable_ is None:
             self.executable = executable
         else:
             self.executable = executable_
+        self.timeout = timeout
         self.running = False
+        self._execute_number = 0
 
     def start(self):
         """Start an ``exiftool`` process in batch mode for this instance.
@@ -187,6 +231,17 @@ class ExifTool(object):
         del self._process
         self.running = False
 
+    def restart(self):
+        """Kill the ``exiftool`` process (e.g. if it hangs) and start a
+        new one.
+        """
+        if self.running:
+            self._process.kill()
+            self._process.communicate()
+            del self._process
+            self.running = False
+        self.start()
+
     def __enter__(self):
         self.start()
         return self
@@ -209,6 +264,16 @@ class ExifTool(object):
         end-of-output sentinel and returned as a raw ``bytes`` object,
         excluding the sentinel.
 
+        Each batch is sent with a sequence number (``-executeNUM``), so
+        the end of its output is marked by ``{readyNUM}``.  The output
+        is collected in a growing buffer and only the newly read part is
+        searched for the sentinel, so reading takes linear time also for
+        large outputs.
+
+        If the process ends or does not respond within :py:attr:`timeout`,
+        it is restarted and ``ValueError`` (:py:exc:`ExifToolTimeoutError`)
+        is raised.
+
         The parameters must also be raw ``bytes``, in whatever
         encoding exiftool accepts.  For filenames, this should be the
         system's filesystem encoding.
@@ -218,13 +283,54 @@ class ExifTool(object):
         """
         if not self.running:
             raise ValueError("ExifTool instance not running.")
-        self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
-        self._process.stdin.flush()
-        output = b""
+        self._execute_number += 1
+        execute = b"-execute" + str(self._execute_number).encode()
+        ready = sentinel[:-1] + str(self._execute_number).encode() + b"}"
+        try:
+            self._process.stdin.write(b"\n".join(params + (execute + b"\n",)))
+            self._process.stdin.flush()
+        except OSError:
+            self.restart()
+            raise ValueError("ExifTool process ended unexpectedly.")
+        return self._read_output(ready)
+
+    def _read_output(self, ready):
+        """Read the output of a batch up to the sentinel ``ready``.
+
+        The sentinel is on a line of its own and nothing follows it (see
+        :py:func:`find_sentinel`), so a match in the middle of the output
+        (e.g. in a tag value) is skipped.  Returns the output with
+        leading whitespace removed, excluding the sentinel.
+        """
+        output = bytearray()
         fd = self._process.stdout.fileno()
-        while not output[-32:].strip().endswith(sentinel):
-            output += os.read(fd, block_size)
-        return output.strip()[:-len(sentinel)]
+        search_start = 0
+        while True:
+            if not self._wait_for_output(fd):
+                self.restart()
+                raise ExifToolTimeoutError(
+                    "ExifTool did not respond within %ss." % self.timeout)
+            data = os.read(fd, block_size)
+            if not data:
+                self.restart()
+                raise ValueError("ExifTool process ended unexpectedly.")
+            output += data
+            position = find_sentinel(output, ready, search_start)
+            while position >= 0:
+                if not output[position + len(ready):].strip():
+                    return bytes(output[:position]).lstrip()
+                position = find_sentinel(output, ready, position + 1)
+            # the sentinel may be split between two reads
+            search_start = sentinel_search_start(output, ready)
+
+    def _wait_for_output(self, fd):
+        """Wait until output can be read from ``fd``, at most
+        :py:attr:`timeout` seconds.  Returns ``False`` on timeout.
+        """
+        if self.timeout is None or sys.platform == "win32":
+            return True
+        readable, _, _ = select.select([fd], [], [], self.timeout)
+        return bool(readable)
 
     def execute_json(self, *params):
         """Execute the given batch of parameters and parse the JSON output.
@@ -267,7 +373,7 @@ class ExifTool(object):
         """
         return self.execute_json(filename)[0]
 
-    def get_tags_batch(self, tags, filenames):
+    def get_tags_batch(self, tags, filenames, options=()):
         """Return only specified tags for the given files.
 
         The first argument is an iterable of tags.  The tag names may
@@ -275,6 +381,9 @@ class ExifTool(object):
 
         The second argument is an iterable of file names.
 
+        Additional exiftool options (e.g. ``-fast``) can be passed as
+        an iterable of strings in ``options``.
+
         The format of the return value is the same as for
         :py:meth:`execute_json()`.
         """
@@ -286,17 +395,18 @@ class ExifTool(object):
         if isinstance(filenames, basestring):
             raise TypeError("The argument 'filenames' must be "
                             "an iterable of strings")
-        params = ["-" + t for t in tags]
+        params = list(options)
+        params.extend("-" + t for t in tags)
         params.extend(filenames)
         return self.execute_json(*params)
 
-    def get_tags(self, tags, filename):
+    def get_tags(self, tags, filename, options=()):
         """Return only specified tags for a single file.
 
         The returned dictionary has the format described in the
         documentation of :py:meth:`execute_json()`.
         """
-        return self.get_tags_batch(tags, [filename])[0]
+        return self.get_tags_batch(tags, [filename], options)[0]
 
     def get_tag_batch(self, tag, filenames):
         """Extract a single tag from the given files.
@@ -0,0 +1,265 @@
+# To change this license header, choose License Headers in Project Properties.
+# To change this template file, choose Tools | Templates
+# and open the template in the editor.
+
+import asyncio
+import json
+import logging
+import subprocess
+import sys
+import threading
+from collections import deque
+
+import exiftool
+
+
+class AsyncExifTool:
+    """
+    asyncio client for an exiftool process in stay open mode
+
+    Several requests can be in flight at the same time: every request is sent with its own
+    sequence number (-executeNUM) and gets a future, which is resolved by a reader task when the
+    output up to the sentinel {readyNUM} has arrived. exiftool answers the requests in order.
+
+    If exiftool produces no output for timeout seconds while requests are in flight (e.g. it hangs
+    on a corrupt file), the process is killed and restarted: the first request fails with
+    ExifToolTimeoutError, the other requests are sent to the new process again.
+    """
+
+    def __init__(self, executable_=None, logger=None, timeout=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.executable = executable_ or exiftool.executable
+        self.timeout = timeout
+        self.running = False
+        self._process = None
+        self._reader = None
+        self._pending = deque()  # (sequence number, future, request) of the requests in flight
+        self._execute_number = 0
+        self._restarting = False
+        self._last_output = 0
+
+    async def start(self):
+        """
+        Start the exiftool process and the reader task
+        """
+        if self.running:
+            return
+
+        await self._start_process()
+        self._reader = asyncio.ensure_future(self._read_responses())
+        self.running = True
+        self.logger.debug('started async exiftool process')
+
+    async def _start_process(self):
+        self._process = await asyncio.create_subprocess_exec(
+            self.executable, "-stay_open", "True", "-@", "-", "-common_args", "-G", "-n",
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    async def terminate(self):
+        """
+        Terminate the exiftool process (pending requests are answered first)
+        """
+        if not self.running:
+            return
+
+        self.running = False
+        self._process.stdin.write(b"-stay_open\nFalse\n")
+        await self._process.stdin.drain()
+        await self._process.wait()
+        await self._reader
+        self.logger.debug('terminated async exiftool process')
+
+    def submit(self, *params):
+        """
+        Send a request to exiftool without waiting for the output (see ExifTool.execute())
+        :param params: parameters as bytes
+        :return: future of the output (bytes)
+        """
+        if not self.running:
+            raise ValueError("ExifTool instance not running.")
+
+        self._execute_number += 1
+        future = asyncio.get_event_loop().create_future()
+        execute = b"-execute" + str(self._execute_number).encode()
+        request = b"\n".join(params + (execute + b"\n",))
+
+        if not self._pending:
+            # the timeout starts with the first request in flight
+            self._last_output = asyncio.get_event_loop().time()
+        self._pending.append((self._execute_number, future, request))
+        if not self._restarting:
+            # (requests submitted while restarting are sent to the new process)
+            self._process.stdin.write(request)
+        return future
+
+    async def execute(self, *params):
+        future = self.submit(*params)
+        if not self._restarting:
+            await self._process.stdin.drain()
+        return await future
+
+    async def execute_json(self, *params):
+        params = map(exiftool.fsencode, params)
+        return json.loads((await self.execute(b"-j", *params)).decode("utf-8"))
+
+    async def get_tags_batch(self, tags, filenames, options=()):
+        params = list(options)
+        params.extend("-" + t for t in tags)
+        params.extend(filenames)
+        return await self.execute_json(*params)
+
+    async def get_tags(self, tags, filename, options=()):
+        return (await self.get_tags_batch(tags, [filename], options))[0]
+
+    async def _read_responses(self):
+        """
+        Read the output of exiftool and resolve the futures of the requests in order
+        """
+        output = bytearray()
+        search_start = 0
+        loop = asyncio.get_event_loop()
+
+        while True:
+            error = None
+            try:
+                data = await asyncio.wait_for(self._process.stdout.read(exiftool.block_size),
+                                              None if self.timeout is None else min(1.0, self.timeout))
+            except asyncio.TimeoutError:
+                if not self._pending or loop.time() - self._last_output < self.timeout:
+                    continue
+                self.logger.warning('exiftool did not respond within %ss - restarting', self.timeout)
+                data = b""
+                error = exiftool.ExifToolTimeoutError("ExifTool did not respond within %ss." % self.timeout)
+
+            if not data:
+                if error is None:
+                    # process ended - restart it if requests are waiting (unless terminated)
+                    if not self.running or not self._pending:
+                        break
+                    self.logger.warning('exiftool process ended unexpectedly - restarting')
+                    error = ValueError("ExifTool process ended unexpectedly.")
+                try:
+                    await self._restart_process(error)
+                except OSError as start_error:
+                    self.logger.error('could not restart exiftool: %s', start_error)
+                    break
+                output = bytearray()
+                search_start = 0
+                continue
+            output += data
+            self._last_output = loop.time()
+
+            while self._pending:
+                number, future, request = self._pending[0]
+                ready = exiftool.sentinel[:-1] + str(number).encode() + b"}"
+
+                # the sentinel is on a line of its own (a match in a tag value is skipped)
+                position = exiftool.find_sentinel(output, ready, search_start)
+                if position < 0:
+                    search_start = exiftool.sentinel_search_start(output, ready)
+                    break
+
+                self._pending.popleft()
+                if not future.cancelled():
+                    future.set_result(bytes(output[:position]).lstrip())
+                del output[:position + len(ready)]
+                search_start = 0
+
+        # process ended - fail the requests still waiting
+        while self._pending:
+            number, future, request = self._pending.popleft()
+            if not future.cancelled():
+                future.set_exception(ValueError("ExifTool process ended unexpectedly."))
+
+    async def _restart_process(self, error):
+        """
+        Kill the exiftool process (if it hangs), fail its current request with error and send the
+        other requests to a new process
+        """
+        self._restarting = True
+        try:
+            if self._process.returncode is None:
+                self._process.kill()
+            await self._process.wait()
+
+            number, future, request = self._pending.popleft()
+            if not future.cancelled():
+                future.set_exception(error)
+
+            await self._start_process()
+        finally:
+            self._restarting = False
+
+        self._last_output = asyncio.get_event_loop().time()
+        for number, future, request in self._pending:
+            self._process.stdin.write(request)
+
+
+class ExifToolThread:
+    """
+    Runs an AsyncExifTool in an event loop in a background thread
+
+    Provides the blocking methods of ExifTool (so it can be used instead of it) and submit_*()
+    methods returning a concurrent.futures.Future. This way, the synchronous import loop can
+    request the metadata of the next files and hash/copy the current files in the meantime.
+    """
+
+    def __init__(self, executable_=None, logger=None, timeout=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.running = False
+        self._exiftool = AsyncExifTool(executable_, self.logger, timeout)
+        self._loop = None
+        self._thread = None
+
+    def start(self):
+        if self.running:
+            return
+
+        if sys.platform == 'win32':
+            # subprocesses need the proactor event loop on windows
+            self._loop = asyncio.ProactorEventLoop()
+        else:
+            self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='exiftool', daemon=True)
+        self._thread.start()
+        self._call(self._exiftool.start()).result()
+        self.running = True
+
+    def terminate(self):
+        if not self.running:
+            return
+
+        self._call(self._exiftool.terminate()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self.running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.terminate()
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def submit_tags_batch(self, tags, filenames, options=()):
+        """
+        Request the specified tags for the given files, without waiting for the result
+        :return: concurrent.futures.Future of the result (format see ExifTool.get_tags_batch())
+        """
+        return self._call(self._exiftool.get_tags_batch(tags, list(filenames), options))
+
+    def execute(self, *params):
+        return self._call(self._exiftool.execute(*params)).result()
+
+    def execute_json(self, *params):
+        return self._call(self._exiftool.execute_json(*params)).result()
+
+    def get_tags_batch(self, tags, filenames, options=()):
+        return self.submit_tags_batch(tags, filenames, options).result()
+
+    def get_tags(self, tags, filename, options=()):
+        return self._call(self._exiftool.get_tags(tags, filename, options)).result()
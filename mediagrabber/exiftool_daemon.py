@@ -0,0 +1,407 @@
+# To change this license header, choose License Headers in Project Properties.
+# To change this template file, choose Tools | Templates
+# and open the template in the editor.
+
+"""
+Background daemon keeping exiftool processes (stay open mode) running between mediagrabber runs
+
+Starting exiftool (perl) takes up to a second on a NAS - with the daemon running, scheduled runs
+attach to its warm processes through a local Unix socket instead of starting their own. The daemon
+ends when no client was connected for the idle timeout.
+
+Start it e.g. at boot or before the scheduled runs:
+
+    python3 exiftool_daemon.py --workers 2 --idle-timeout 3600
+
+Protocol: a request is the exiftool parameter list joined by newlines (same as exiftool's -@ argfile),
+sent with a 4-byte length prefix. The response is a status byte (0: ok, 1: error, 2: timeout), a 4-byte
+length and the exiftool output (or the error message).
+
+The socket is created in a directory only the user can access ($XDG_RUNTIME_DIR or a private directory
+in the temp directory). Clients only connect to a socket of the same user, so other users can neither
+receive the file paths nor answer with forged tags.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from exiftool import ExifTool, ExifToolTimeoutError
+from exiftool_pool import ExifToolPool
+
+# message headers: request length / response status and length
+_request_header = struct.Struct('!I')
+_response_header = struct.Struct('!BI')
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_TIMEOUT = 2
+
+
+def is_supported():
+    """
+    Unix sockets are not available on all platforms (e.g. windows)
+    """
+    return hasattr(socket, 'AF_UNIX')
+
+
+def _getuid():
+    return os.getuid() if hasattr(os, 'getuid') else 0
+
+
+def default_socket_path():
+    """
+    Socket path used by the daemon and the clients if not specified (one per user, in a directory
+    only the user can access)
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'mediagrabber-exiftool.sock')
+    return os.path.join(tempfile.gettempdir(), 'mediagrabber-%s' % _getuid(), 'exiftool.sock')
+
+
+def _check_owner(path, private=False):
+    """
+    Check that the path belongs to the current user (or root for directories)
+    :param private: the path must not be writable by other users either, unless it is a sticky
+                    directory (e.g. /tmp: files of other users cannot be replaced)
+    :raise OSError: if the path can be controlled by another user
+    """
+    path_stat = os.lstat(path)
+    if path_stat.st_uid not in (_getuid(), 0) or (not stat.S_ISDIR(path_stat.st_mode) and
+                                                   path_stat.st_uid != _getuid()):
+        raise OSError('%s belongs to another user' % path)
+    if private and path_stat.st_mode & 0o022 and not path_stat.st_mode & stat.S_ISVTX:
+        raise OSError('%s is writable by other users' % path)
+
+
+def check_socket(socket_path):
+    """
+    Check that the socket was created by the current user and cannot be replaced by another user
+    :raise OSError: if the socket is not safe to connect to
+    """
+    if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+        raise OSError('%s is not a socket' % socket_path)
+    _check_owner(socket_path)
+    _check_owner(os.path.dirname(os.path.abspath(socket_path)), private=True)
+
+
+def _create_socket_dir(socket_path):
+    """
+    Create the directory of the socket (accessible by the current user only) if needed
+    :raise OSError: if the directory can be controlled by another user
+    """
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    if not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir, mode=0o700)
+    _check_owner(socket_dir, private=True)
+
+
+def connect(socket_path=None, timeout=None):
+    """
+    Connect to the daemon if it is running
+    :param socket_path: socket of the daemon (default: default_socket_path())
+    :param timeout: seconds to wait for the response to a request (None: wait forever)
+    :return: started ExifToolClient or None
+    """
+    if not is_supported():
+        return None
+
+    client = ExifToolClient(socket_path, timeout)
+    if not os.path.exists(client.socket_path):
+        return None
+
+    try:
+        client.start()
+    except OSError as error:
+        logging.getLogger(__name__).warning('cannot connect to exiftool daemon: %s', error)
+        return None
+
+    return client
+
+
+def _recv_exactly(sock, size):
+    """
+    Receive size bytes from the socket
+    """
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError('connection closed')
+        received += count
+
+    return bytes(data)
+
+
+class ExifToolClient(ExifTool):
+    """
+    ExifTool connected to the exiftool daemon instead of its own process
+
+    All ExifTool methods can be used (execute() is passed to the daemon), so a client can be used
+    wherever an ExifTool instance is used, e.g. as worker of an ExifToolPool. The requests of a client
+    are run one after the other, the daemon runs the requests of several clients in parallel.
+
+    timeout: seconds to wait for the response to a request (None: wait forever). If it expires, the
+    connection is closed and ExifToolTimeoutError is raised. The daemon restarts hanging processes
+    after its own --timeout.
+    """
+
+    def __init__(self, socket_path=None, timeout=None):
+        super(ExifToolClient, self).__init__(timeout=timeout)
+        self.socket_path = socket_path or default_socket_path()
+        self._socket = None
+
+    def start(self):
+        """
+        Connect to the daemon (raises OSError if it is not running or the socket does not belong to
+        the current user)
+        """
+        if self.running:
+            return
+
+        check_socket(self.socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(self.socket_path)
+            self._check_peer()
+            self._socket.settimeout(self.timeout)
+        except OSError:
+            self._socket.close()
+            self._socket = None
+            raise
+
+        self.running = True
+
+    def _check_peer(self):
+        """
+        Check that the daemon runs as the current user (where the credentials are available)
+        """
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return
+
+        credentials = struct.Struct('3i')
+        pid, uid, gid = credentials.unpack(self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                                   credentials.size))
+        if uid != _getuid():
+            raise OSError('exiftool daemon on %s runs as another user (uid %s)' % (self.socket_path, uid))
+
+    def terminate(self):
+        """
+        Disconnect from the daemon (its exiftool processes keep running)
+        """
+        if not self.running:
+            return
+
+        self._socket.close()
+        self._socket = None
+        self.running = False
+
+    def restart(self):
+        """
+        Reconnect to the daemon (the daemon restarts hanging processes itself)
+        """
+        self.terminate()
+        self.start()
+
+    def execute(self, *params):
+        """
+        Execute the parameters with an exiftool process of the daemon (see ExifTool.execute())
+        """
+        if not self.running:
+            raise ValueError("ExifTool instance not running.")
+
+        request = b"\n".join(params)
+        try:
+            self._socket.sendall(_request_header.pack(len(request)) + request)
+            status, length = _response_header.unpack(_recv_exactly(self._socket, _response_header.size))
+            output = _recv_exactly(self._socket, length)
+        except socket.timeout:
+            # the response would arrive on this connection later - use a new one
+            try:
+                self.restart()
+            except OSError:
+                pass
+            raise ExifToolTimeoutError("ExifTool daemon did not respond within %ss." % self.timeout)
+        except OSError as error:
+            self.terminate()
+            raise ValueError("ExifTool daemon connection failed: %s" % error)
+
+        if status == STATUS_TIMEOUT:
+            raise ExifToolTimeoutError(output.decode('utf-8', 'replace'))
+        if status != STATUS_OK:
+            raise ValueError(output.decode('utf-8', 'replace'))
+
+        return output
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """
+    Runs the requests of a client connection until the client disconnects
+    """
+
+    def handle(self):
+        daemon = self.server.exiftool_daemon
+        daemon.connection_opened()
+        try:
+            while True:
+                try:
+                    length, = _request_header.unpack(_recv_exactly(self.request, _request_header.size))
+                    request = _recv_exactly(self.request, length)
+                except ConnectionError:
+                    break
+
+                status, output = daemon.run_request(request)
+                self.request.sendall(_response_header.pack(status, len(output)) + output)
+        finally:
+            daemon.connection_closed()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ExifToolDaemon:
+    """
+    Serves a pool of exiftool processes on a Unix socket
+    """
+
+    def __init__(self, socket_path=None, size=1, idle_timeout=600, executable_=None, logger=None, timeout=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.socket_path = socket_path or default_socket_path()
+        self.idle_timeout = idle_timeout
+        self.pool = ExifToolPool(size, executable_, self.logger, timeout=timeout)
+        self._server = None
+        self._lock = threading.Lock()
+        self._connections = 0
+        self._last_activity = time.monotonic()
+
+    def serve(self):
+        """
+        Start the exiftool processes and serve requests until the idle timeout expires
+        """
+        if not is_supported():
+            raise OSError('unix sockets are not supported on this platform')
+
+        _create_socket_dir(self.socket_path)
+        if os.path.exists(self.socket_path):
+            client = connect(self.socket_path)
+            if client is not None:
+                client.terminate()
+                raise OSError('exiftool daemon is running already: %s' % self.socket_path)
+            # left over by a daemon which did not end properly
+            os.unlink(self.socket_path)
+
+        self.pool.start()
+        try:
+            # the socket is accessible by the current user only
+            old_umask = os.umask(0o177)
+            try:
+                self._server = _Server(self.socket_path, _RequestHandler)
+            finally:
+                os.umask(old_umask)
+            self._server.exiftool_daemon = self
+
+            watcher = threading.Thread(target=self._watch_idle, name='idle-watcher', daemon=True)
+            watcher.start()
+            self.logger.info('exiftool daemon listening on %s (%s processes, idle timeout: %ss)', self.socket_path,
+                             self.pool.size, self.idle_timeout)
+            self._server.serve_forever()
+        finally:
+            if self._server is not None:
+                self._server.server_close()
+                os.unlink(self.socket_path)
+            self.pool.terminate()
+            self.logger.info('exiftool daemon stopped')
+
+    def shutdown(self):
+        """
+        Stop serving (called from another thread)
+        """
+        if self._server is not None:
+            self._server.shutdown()
+
+    def connection_opened(self):
+        with self._lock:
+            self._connections += 1
+            self._last_activity = time.monotonic()
+        self.logger.debug('client connected')
+
+    def connection_closed(self):
+        with self._lock:
+            self._connections -= 1
+            self._last_activity = time.monotonic()
+        self.logger.debug('client disconnected')
+
+    def run_request(self, request):
+        """
+        Run a request with the next idle exiftool process
+        :return: status, output
+        """
+        try:
+            return STATUS_OK, self.pool.execute(*request.split(b"\n"))
+        except ExifToolTimeoutError as error:
+            self.logger.warning('exiftool request failed: %s', error)
+            return STATUS_TIMEOUT, str(error).encode('utf-8')
+        except ValueError as error:
+            self.logger.warning('exiftool request failed: %s', error)
+            return STATUS_ERROR, str(error).encode('utf-8')
+
+    def _watch_idle(self):
+        """
+        Shut down the server when no client was connected for the idle timeout
+        """
+        while True:
+            time.sleep(min(1.0, self.idle_timeout))
+            with self._lock:
+                idle_time = time.monotonic() - self._last_activity if self._connections == 0 else 0
+            if idle_time >= self.idle_timeout:
+                self.logger.info('no clients for %ss - stopping', self.idle_timeout)
+                self.shutdown()
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='exiftool daemon for mediagrabber')
+    parser.add_argument('--socket', default=default_socket_path(), dest='socket_path',
+                        help='unix socket to listen on (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=1, dest='workers',
+                        help='number of exiftool processes (default: 1)')
+    parser.add_argument('--idle-timeout', type=float, default=600, dest='idle_timeout',
+                        help='stop after this many seconds without clients (default: 600)')
+    parser.add_argument('--timeout', type=float, default=60, dest='timeout',
+                        help='restart an exiftool process which does not respond within this many seconds '
+                             '(default: 60, 0: never)')
+    parser.add_argument('-d', '--debug', action='store_true', dest='debug',
+                        help='debug: log every client connection')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s  %(levelname)-8s  %(message)s')
+
+    # stop properly (remove the socket) when killed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    daemon = ExifToolDaemon(args.socket_path, args.workers, args.idle_timeout, timeout=args.timeout or None)
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    except OSError as error:
+        logging.error('%s', error)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
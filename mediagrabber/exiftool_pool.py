@@ -0,0 +1,154 @@
+# To change this license header, choose License Headers in Project Properties.
+# To change this template file, choose Tools | Templates
+# and open the template in the editor.
+
+import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+from exiftool import ExifTool
+
+
+class ExifToolPool:
+    """
+    Pool of exiftool processes (stay open mode) to read metadata on several cores
+
+    The pool can be used like a single ExifTool instance: batches passed to get_tags_batch() are
+    split into chunks, which are dispatched to the idle processes and read in parallel (exiftool
+    does the parsing, the threads only wait for the output). Single files are read by the next idle
+    process. A process can also be checked out for other commands with worker().
+
+    Instead of starting exiftool processes, the pool can use other ExifTool instances created by
+    worker_factory (e.g. connections to the exiftool daemon, see exiftool_daemon.ExifToolClient).
+
+    A process which does not respond within timeout seconds is restarted (see ExifTool.timeout).
+    """
+
+    def __init__(self, size=1, executable_=None, logger=None, worker_factory=None, timeout=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.logger.debug('Init ExifToolPool')
+        self.size = max(1, size)
+        self.executable = executable_
+        self.worker_factory = worker_factory or partial(ExifTool, executable_, timeout)
+        self.running = False
+        self._workers = []
+        self._idle_workers = None
+        self._executor = None
+        self._request_executor = None
+
+    def start(self):
+        """
+        Start the exiftool processes of the pool
+        """
+        if self.running:
+            return
+
+        self._workers = [self.worker_factory() for _ in range(self.size)]
+        self._idle_workers = queue.Queue()
+        for et in self._workers:
+            et.start()
+            self._idle_workers.put(et)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.size)
+        self._request_executor = ThreadPoolExecutor(max_workers=1)
+        self.running = True
+        self.logger.debug('started %s exiftool processes', self.size)
+
+    def terminate(self):
+        """
+        Terminate all exiftool processes of the pool
+        """
+        if not self.running:
+            return
+
+        self._request_executor.shutdown()
+        self._executor.shutdown()
+        for et in self._workers:
+            et.terminate()
+
+        self._workers = []
+        self._idle_workers = None
+        self._executor = None
+        self._request_executor = None
+        self.running = False
+        self.logger.debug('terminated exiftool processes')
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.terminate()
+
+    @contextmanager
+    def worker(self):
+        """
+        Check out an idle exiftool process for the block (waits until a process is idle)
+        """
+        if not self.running:
+            raise ValueError("ExifToolPool not running.")
+
+        et = self._idle_workers.get()
+        try:
+            yield et
+        finally:
+            self._idle_workers.put(et)
+
+    def execute(self, *params):
+        with self.worker() as et:
+            return et.execute(*params)
+
+    def execute_json(self, *params):
+        with self.worker() as et:
+            return et.execute_json(*params)
+
+    def get_tags_batch(self, tags, filenames, options=()):
+        """
+        Return the specified tags for the given files (format see ExifTool.get_tags_batch())
+
+        The files are split into one chunk per process. The results are returned in the order of
+        the chunks. If a chunk fails, its files are left out of the result (same as files exiftool
+        cannot read) - the error is raised only if all chunks fail.
+        """
+        filenames = list(filenames)
+        if self.size == 1 or len(filenames) < 2:
+            with self.worker() as et:
+                return et.get_tags_batch(tags, filenames, options)
+
+        chunk_size = -(-len(filenames) // self.size)
+        chunks = [filenames[i:i + chunk_size] for i in range(0, len(filenames), chunk_size)]
+        futures = [self._executor.submit(self._get_tags_chunk, tags, chunk, options) for chunk in chunks]
+
+        results = []
+        error = None
+        for chunk, future in zip(chunks, futures):
+            try:
+                results.extend(future.result())
+            except ValueError as chunk_error:
+                self.logger.warning('reading %s files failed: %s', len(chunk), chunk_error)
+                error = chunk_error
+
+        if error is not None and not results:
+            raise error
+
+        return results
+
+    def submit_tags_batch(self, tags, filenames, options=()):
+        """
+        Request the specified tags for the given files, without waiting for the result
+        :return: concurrent.futures.Future of the get_tags_batch() result
+        """
+        return self._request_executor.submit(self.get_tags_batch, tags, list(filenames), options)
+
+    def _get_tags_chunk(self, tags, filenames, options):
+        with self.worker() as et:
+            return et.get_tags_batch(tags, filenames, options)
+
+    def get_tags(self, tags, filename, options=()):
+        """
+        Return the specified tags for a single file (format see ExifTool.get_tags())
+        """
+        with self.worker() as et:
+            return et.get_tags(tags, filename, options)
@@ -3,6 +3,55 @@
 # Author: Bastien Semene
 
 import hashlib
+from functools import partial
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# content hash algorithms: name => constructor of a hashlib-like object (update(), hexdigest(), digest())
+# - md5: algorithm of indexes created by earlier versions
+# - sha256: uses the SHA extensions of the CPU (via OpenSSL) where available - about twice as fast as md5
+# - blake2b: 256 bit digest, faster than sha256 on CPUs without SHA extensions
+# - xxh3: 128 bit, not cryptographic but fastest (requires the xxhash package)
+HASH_ALGORITHMS = {
+    'md5': hashlib.md5,
+    'sha256': hashlib.sha256,
+    'blake2b': partial(hashlib.blake2b, digest_size=32),
+}
+if xxhash is not None:
+    HASH_ALGORITHMS['xxh3'] = xxhash.xxh3_128
+
+# algorithm of new indexes
+DEFAULT_HASH_ALGORITHM = 'sha256'
+
+
+def register_hash_algorithm(name, constructor):
+    '''
+    Make another algorithm available (constructor returns a hashlib-like object)
+    '''
+    HASH_ALGORITHMS[name] = constructor
+
+
+def hash_for_file(path, algorithm='md5', block_size=1024*1024, human_readable=True):
+    '''
+    The file is read into one reusable buffer (no new bytes object per block),
+    hashing is the bottleneck for files in the page cache
+    '''
+    hasher = HASH_ALGORITHMS[algorithm]()
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            hasher.update(view[:count])
+    if human_readable:
+        return hasher.hexdigest()
+    return hasher.digest()
+
 
 def md5_for_file(path, block_size=256*128, human_readable=True):
     '''
@@ -10,10 +59,4 @@ def md5_for_file(path, block_size=256*128, human_readable=True):
     to avoid performances issues
     Here I have blocks of 4096 octets (Default NTFS)
     '''
-    md5 = hashlib.md5()
-    with open(path,'rb') as f: 
-        for chunk in iter(lambda: f.read(block_size), b''): 
-             md5.update(chunk)
-    if human_readable:
-        return md5.hexdigest()
-    return md5.digest()
+    return hash_for_file(path, 'md5', block_size, human_readable)
@@ -5,11 +5,15 @@
 import datetime
 import logging
 import os
+import warnings
 
 import filehash
 
 
 class MediaFile:
+    # content hash algorithm (see filehash.HASH_ALGORITHMS), the hash is stored as file_hash_md5
+    hash_algorithm = 'md5'
+
     def __init__(self, file_path=None, logger=None, *args, **kwargs):
         self.logger = logger or logging.getLogger(__name__)
         self.logger.debug('Init MediaFile')
@@ -19,8 +23,11 @@ class MediaFile:
 
         # set up properties
         self.file_id = None
+        # file_hash_md5: content hash (hex digest) of the algorithm named by hash_algorithm, not
+        # necessarily md5 (the name is kept for existing indexes and callers)
         self.file_properties = {
             'file_hash_md5': None,
+            'hash_algorithm': self.hash_algorithm,
             'file_type': None,
             'file_size': None,
             'file_date': None
@@ -31,6 +38,9 @@ class MediaFile:
             'source_filename': None,
         }
 
+        # hashes calculated so far (algorithm => hash)
+        self.file_hashes = {}
+
         self.full_path = None
 
         if file_path is not None:
@@ -54,11 +64,35 @@ class MediaFile:
     def name(self):
         return str(self.source_properties['source_filename'])
 
-    def calculate_md5(self):
+    def calculate_hash(self):
+        """
+        Calculate the content hash with hash_algorithm (stored in file_hash_md5)
+        """
         if self.full_path is not None:
-            md5 = filehash.md5_for_file(self.full_path)
-            self.file_properties['file_hash_md5'] = md5
-            return md5
+            file_hash = self.get_hash(self.hash_algorithm)
+            self.file_properties['file_hash_md5'] = file_hash
+            self.file_properties['hash_algorithm'] = self.hash_algorithm
+            return file_hash
+
+    def calculate_md5(self):
+        """
+        Deprecated: use calculate_hash() - calculates the hash with hash_algorithm (md5 only for
+        indexes which still use md5)
+        """
+        warnings.warn('MediaFile.calculate_md5() is deprecated, use calculate_hash()', DeprecationWarning,
+                      stacklevel=2)
+        return self.calculate_hash()
+
+    def get_hash(self, algorithm):
+        """
+        Get the content hash with the given algorithm (calculated once), e.g. to compare the file
+        with records of the index which were hashed with another algorithm
+        """
+        file_hash = self.file_hashes.get(algorithm)
+        if file_hash is None and self.full_path is not None:
+            file_hash = filehash.hash_for_file(self.full_path, algorithm)
+            self.file_hashes[algorithm] = file_hash
+        return file_hash
 
     def get_filetype(self):
         if self.full_path is not None:
@@ -72,6 +106,17 @@ class MediaFile:
             c_date = "{:%Y-%m-%d %H:%M:%S}".format(c_date)
             return c_date
 
+    def get_file_identity(self):
+        """
+        Identity of the file on disk, independent of its path: (device, inode, size, mtime in ns)
+
+        Returns None if the file system does not provide inode numbers
+        """
+        if self.full_path is not None:
+            stat = os.stat(self.full_path)
+            if stat.st_ino:
+                return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
     def get_file_size(self):
         size = os.path.getsize(self.full_path)  # bytes
         return size
@@ -9,12 +9,19 @@ import os
 import re
 import shutil
 import sys
+import time
 from collections import namedtuple
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
 from timeit import default_timer as timer
 
 from database import DataBase
 from exifmediafile import ExifMediaFile
-from exiftool import ExifTool
+from exiftool_async import ExifToolThread
+import exiftool_daemon
+from exiftool_pool import ExifToolPool
+import filehash
 
 
 class MediaGrabber:
@@ -44,6 +51,31 @@ class MediaGrabber:
         self.ignore_subfolder_patterns = []
         self.file_extensions = []
         self.db_file = '.mediagrabber.db'
+        self.batch_size = 100
+        self.commit_interval = 5.0
+        self.compact_db = False
+        self.concurrent = False
+        self.exif_batch_size = 64  # max. files per exiftool call
+        self.exif_batch_time = 2.0  # targeted seconds per exiftool call (batch size adapts)
+        self.exif_workers = 1
+        self.exif_timeout = 60.0  # seconds exiftool may hang on a file before it is restarted (0: never)
+        self.fast_exif = True
+        self.read_profile = 'standard'
+        self.cache_max_entries = 0  # scan journal budget (0: unlimited)
+        self.cache_max_mb = 0
+        self.hash_algorithm = None  # content hash algorithm (None: keep the algorithm of the index)
+        self.rehash_limit = 1000  # max. records re-keyed per run after changing the algorithm (0: all)
+        self.exif_daemon = True  # use the exiftool daemon if it is running
+        self.exif_socket = exiftool_daemon.default_socket_path()
+        self.exiftool = None  # exiftool processes, shared by all phases of the run
+        self._exif_prefetch = None
+        self.skip_unchanged_dirs = False
+        self.full_walk_every = 10
+        self._dir_snapshots = None
+        self._removed_dirs = None
+        self._incomplete_dirs = None
+        self._dir_parents = None
+        self._full_walk = True
         self.location = os.path.dirname(os.path.abspath(__file__))
 
         # initialize stats
@@ -72,13 +104,29 @@ class MediaGrabber:
         # set db file
         self.db_file = os.path.join(self.target_dir, self.db_file)
 
+        # read exif blocks directly (if disabled, exiftool is used for all files)
+        ExifMediaFile.use_exif_reader = self.fast_exif
+        ExifMediaFile.read_profile = self.read_profile
+        ExifMediaFile.exif_daemon_socket = self.exif_socket if self.exif_daemon else None
+        ExifMediaFile.exif_timeout = self.exif_timeout or None
+
         # Initialize database
-        self.db = DataBase(self.db_file)
+        self.db = DataBase(self.db_file, concurrent=self.concurrent)
+        self.db.journal_max_entries = self.cache_max_entries or None
+        self.db.journal_max_bytes = int(self.cache_max_mb * 1024 * 1024) or None
+        if self.compact_db:
+            self.db.convert_to_compact()
+        if self.hash_algorithm is not None:
+            self.db.set_hash_algorithm(self.hash_algorithm)
+        self._check_hash_algorithms()
+        ExifMediaFile.hash_algorithm = self.db.hash_algorithm
 
         # dispatch according to mode
         self._dispatch()
 
         # clean up
+        if self.exiftool is not None:
+            self.exiftool.terminate()
         self.db.disconnect()
 
     def _init_stats(self):
@@ -125,6 +173,16 @@ class MediaGrabber:
             else:
                 self.logger.debug(no_sources)
 
+    def _check_hash_algorithms(self):
+        """
+        Check if the hash algorithms used in the index are available (xxh3 requires the xxhash package)
+        """
+        for algorithm in [self.db.hash_algorithm] + self.db.legacy_hash_algorithms:
+            if algorithm not in filehash.HASH_ALGORITHMS:
+                error_algorithm = 'hash algorithm of the index is not available: <' + algorithm + '> - exiting...'
+                self.logger.error(error_algorithm)
+                sys.exit(error_algorithm)
+
     def _check_encodings(self):
         """
         Check default- and filesystem encoding and show warning if fs encoding is not 'utf-8'
@@ -152,11 +210,13 @@ class MediaGrabber:
             if self.db.db_is_empty():
                 self._rebuild_index()
             self._import_files()
+            self._rehash_target_files()
 
         elif self.mode == 'index':
             self.logger.info('-- indexing --')
             self.logger.info('')
             self._rebuild_index()
+            self._rehash_target_files()
 
         elif self.mode == 'reset':
             self._reset_sources()
@@ -231,6 +291,22 @@ class MediaGrabber:
         self.logger.info('> verbose    = %s', self.verbose)
         self.logger.info('> quiet      = %s', self.quiet)
         self.logger.info('> debug      = %s', self.debug)
+        self.logger.info('> batch size = %s', self.batch_size)
+        self.logger.info('> commit int.= %ss', self.commit_interval)
+        self.logger.info('> compact db = %s', self.compact_db)
+        self.logger.info('> concurrent = %s', self.concurrent)
+        self.logger.info('> exif batch = %s', self.exif_batch_size)
+        self.logger.info('> exif wrkrs = %s', self.exif_workers)
+        self.logger.info('> exif tmout = %ss', self.exif_timeout)
+        self.logger.info('> fast exif  = %s', self.fast_exif)
+        self.logger.info('> read prof. = %s', self.read_profile)
+        self.logger.info('> exif daemon= %s', self.exif_socket if self.exif_daemon else None)
+        self.logger.info('> cache max. = %s entries / %sMB (0: unlimited)', self.cache_max_entries,
+                         self.cache_max_mb)
+        self.logger.info('> hash algo. = %s (re-hash limit: %s)', self.hash_algorithm or 'index',
+                         self.rehash_limit)
+        self.logger.info('> skip dirs  = %s (full walk every %s runs)', self.skip_unchanged_dirs,
+                         self.full_walk_every)
         self.logger.info('---')
 
     def _read_arguments(self):
@@ -265,6 +341,55 @@ class MediaGrabber:
                             help='quiet: suppress all output to console')
         parser.add_argument('-d', '--debug', action='store_true', dest='debug',
                             help='debug: write a detailed logfile for debugging')
+        parser.add_argument('--batch-size', type=int, default=100, dest='batch_size',
+                            help='number of files per database transaction (default: 100)')
+        parser.add_argument('--commit-interval', type=float, default=5.0, dest='commit_interval',
+                            help='max. seconds between database commits (default: 5)')
+        parser.add_argument('--compact-db', action='store_true', default=False, dest='compact_db',
+                            help='store hashes, dates and numbers in compact form in the index (converts an existing '
+                                 'index, cannot be undone)')
+        parser.add_argument('--concurrent', action='store_true', default=False, dest='concurrent',
+                            help='allow several imports into the same target directory at the same time')
+        parser.add_argument('--exif-batch-size', type=int, default=64, dest='exif_batch_size',
+                            help='max. number of files read per exiftool call (default: 64, 1: no batches)')
+        parser.add_argument('--exif-workers', type=int, default=1, dest='exif_workers',
+                            help='number of exiftool processes reading metadata in parallel (default: 1)')
+        parser.add_argument('--exif-timeout', type=float, default=60, dest='exif_timeout',
+                            help='restart exiftool if it does not respond within this many seconds, the file is '
+                                 'skipped in later runs; with the exiftool daemon: max. wait for its response '
+                                 '(default: 60, 0: never)')
+        parser.add_argument('--no-fast-exif', action='store_false', default=True, dest='fast_exif',
+                            help='always read metadata with exiftool (do not read jpg/tif/heic/mov/mp4 metadata '
+                                 'directly)')
+        parser.add_argument('--read-profile', choices=('full', 'standard', 'fast'), default='standard',
+                            dest='read_profile',
+                            help=(
+                                'what exiftool reads: full: all tags, whole file \n'
+                                'standard: tags of the file type, -fast, no maker notes (default) \n'
+                                'fast: like standard with -fast2'
+                            ))
+        parser.add_argument('--exif-socket', default=exiftool_daemon.default_socket_path(), dest='exif_socket',
+                            help='socket of the exiftool daemon (see exiftool_daemon.py), used instead of starting '
+                                 'exiftool if the daemon is running (default: %(default)s)')
+        parser.add_argument('--no-exif-daemon', action='store_false', default=True, dest='exif_daemon',
+                            help='always start own exiftool processes (do not use the exiftool daemon)')
+        parser.add_argument('--cache-max-entries', type=int, default=0, dest='cache_max_entries',
+                            help='max. number of files in the metadata cache, least recently used files are removed '
+                                 'first (default: 0, unlimited)')
+        parser.add_argument('--cache-max-mb', type=float, default=0, dest='cache_max_mb',
+                            help='max. size of the metadata cache in MB (default: 0, unlimited)')
+        parser.add_argument('--hash-algorithm', choices=sorted(filehash.HASH_ALGORITHMS), dest='hash_algorithm',
+                            help='content hash algorithm of the index (default: keep the algorithm of the index, '
+                                 'new indexes: ' + filehash.DEFAULT_HASH_ALGORITHM + '), existing records are '
+                                 're-hashed over the next runs')
+        parser.add_argument('--rehash-limit', type=int, default=1000, dest='rehash_limit',
+                            help='max. number of records re-hashed per run after changing the hash algorithm '
+                                 '(default: 1000, 0: all)')
+        parser.add_argument('--skip-unchanged-dirs', action='store_true', default=False, dest='skip_unchanged_dirs',
+                            help='do not scan source directories which did not change since the last import')
+        parser.add_argument('--full-walk-every', type=int, default=10, dest='full_walk_every',
+                            help='with --skip-unchanged-dirs: scan all directories every n-th run (default: 10, '
+                                 '0: never)')
         args = parser.parse_args()
 
         self.mode = args.mode
@@ -278,6 +403,26 @@ class MediaGrabber:
         self.quiet = args.quiet
         self.verbose = args.verbose
         self.debug = args.debug
+        self.batch_size = max(1, args.batch_size)
+        self.commit_interval = args.commit_interval
+        if args.concurrent:
+            # commit every file, so the index is not locked while processing the next files
+            self.batch_size = 1
+        self.compact_db = args.compact_db
+        self.concurrent = args.concurrent
+        self.exif_batch_size = max(1, args.exif_batch_size)
+        self.exif_workers = max(1, args.exif_workers)
+        self.exif_timeout = max(0, args.exif_timeout)
+        self.fast_exif = args.fast_exif
+        self.read_profile = args.read_profile
+        self.exif_socket = args.exif_socket
+        self.exif_daemon = args.exif_daemon and exiftool_daemon.is_supported()
+        self.cache_max_entries = max(0, args.cache_max_entries)
+        self.cache_max_mb = max(0, args.cache_max_mb)
+        self.hash_algorithm = args.hash_algorithm
+        self.rehash_limit = max(0, args.rehash_limit)
+        self.skip_unchanged_dirs = args.skip_unchanged_dirs
+        self.full_walk_every = max(0, args.full_walk_every)
 
     @staticmethod
     def _filter_file_by_ext(the_file, filter_ext=None):
@@ -340,6 +485,22 @@ class MediaGrabber:
         # check if all files in target have a record in db files table (add missing entries)
         self._scan_target_files()
 
+    def _rehash_target_files(self):
+        """
+        Re-key index records hashed with another algorithm (after changing the hash algorithm)
+
+        At most rehash_limit records are converted per run, the next runs continue.
+        """
+        if not self.db.legacy_hash_algorithms:
+            return
+
+        self.logger.info('re-hashing target files (%s)...', self.db.hash_algorithm)
+        start = timer()
+        rehashed, remaining = self.db.rehash_files(self.target_dir, self.rehash_limit or None)
+        self.logger.info('...done! %s records re-hashed in %ss, %s left for the next runs', rehashed,
+                         format(timer() - start, '.2f'), remaining)
+        self.logger.info('')
+
     def _scan_target_files(self):
         """
         loop trough all target dir files and check if in db
@@ -355,47 +516,67 @@ class MediaGrabber:
         """
         go through all target records and see if file is there
         if file does not exist, delete db record
+
+        records are grouped by target path, every target directory is listed only once
+        and the listing is compared against the records of the directory
         :return:
         """
-        target_files_in_db = self.db.get_target_file_list()
-        nof_db_files = len(target_files_in_db)
+        nof_db_files = self.db.count_target_records()
 
         if nof_db_files > 0:
             self.logger.info('validating ' + str(nof_db_files) + ' target records...')
             self._selective_logger('---')
 
             file_count = 0
+            dir_count = 0
             removed_count = 0
             total_time = 0
+            missing_file_ids = []
 
-            for db_file in target_files_in_db:
+            # records are streamed from the db (constant memory), ordered by path
+            target_records = self.db.iter_target_files(by_path=True)
+            for relative_path, dir_records in groupby(target_records, key=itemgetter(1)):
                 start = timer()
-                file_count += 1
-                self.logger.debug(db_file)
-                fn = os.path.join(self.target_dir, db_file['relative_path'], db_file['filename'])
-
-                self._selective_logger(
-                    '[' + str(file_count) + ']: ' + db_file['filename'] + ' (id:' + str(db_file['file_id']) + ')')
-
-                if not os.path.isfile(fn):
-                    self.logger.warning("file '" + db_file['filename'] + "' does not exist - dropping target record")
-                    # delete record
-                    self.db.drop_target_record(db_file['file_id'])
-                    removed_count += 1
-                else:
-                    self._selective_logger("file exists in target - record is valid")
+                dir_count += 1
+                dir_path = os.path.join(self.target_dir, relative_path)
+                self._selective_logger('[' + str(dir_count) + ']: ' + relative_path)
+
+                try:
+                    dir_files = self._list_dir_files(dir_path)
+                except OSError as error:
+                    # e.g. permission denied or I/O error - the files may still be there
+                    self.logger.warning("cannot list directory '%s' - keeping its records (%s)", relative_path, error)
+                    continue
+
+                dir_file_count = 0
+                for file_id, _, filename in dir_records:
+                    dir_file_count += 1
+                    self.logger.debug('record: %s, %s, %s', file_id, relative_path, filename)
+
+                    if os.path.normcase(filename) not in dir_files:
+                        self.logger.warning("file '" + filename + "' does not exist - dropping target record")
+                        # delete record (in one batch after the check)
+                        missing_file_ids.append(file_id)
+                        removed_count += 1
+
+                file_count += dir_file_count
 
                 end = timer()
                 processing_time = end - start
                 total_time += processing_time
 
-                self._selective_logger('time: %ss / total: %ss', format(processing_time, '.3f'),
-                                       format(total_time, '.2f'))
+                self._selective_logger('checked %s records - time: %ss / total: %ss', str(dir_file_count),
+                                       format(processing_time, '.3f'), format(total_time, '.2f'))
                 self._selective_logger('---')
 
+            if missing_file_ids:
+                start = timer()
+                self.db.drop_target_records(missing_file_ids)
+                total_time += timer() - start
+
             self.logger.info('...done')
-            self._selective_logger('checked %s entries in %ss and removed %s entries', str(file_count),
-                                   format(total_time, '.3f'), str(removed_count))
+            self._selective_logger('checked %s entries in %s directories in %ss and removed %s entries',
+                                   str(file_count), str(dir_count), format(total_time, '.3f'), str(removed_count))
 
             # update stats counters
             self.stats.total_time_db += total_time
@@ -405,6 +586,20 @@ class MediaGrabber:
         else:
             self.logger.info('database contains no target records to validate')
 
+    @staticmethod
+    def _list_dir_files(dir_path):
+        """
+        Get the names of all files in a directory (one directory listing)
+        :param dir_path: str
+        :return: set of (normcased) filenames, empty if the directory does not exist
+        :raise OSError: if the directory cannot be listed (e.g. permission denied)
+        """
+        try:
+            with os.scandir(dir_path) as entries:
+                return {os.path.normcase(entry.name) for entry in entries if entry.is_file()}
+        except (FileNotFoundError, NotADirectoryError):
+            return set()
+
     def _import_files(self):
         """
         Scan import directories and check files against index copy if new file
@@ -435,9 +630,8 @@ class MediaGrabber:
         Process a list of files - check file name and content and copy/move accordingly
         :param list_of_dirs:
         """
-        # start ExifTool
-        et = ExifTool()
-        et.start()
+        # start ExifTool (or reuse processes of the previous phase)
+        et = self._start_exiftool()
 
         # init stats counters
         total_time = 0
@@ -451,6 +645,16 @@ class MediaGrabber:
         # init file list
         file_list = []
 
+        # files read ahead in batches: path => ExifMediaFile (None if the file could not be read)
+        prepared_files = {}
+        self._exif_prefetch = None
+        exif_batch_size = min(8, self.exif_batch_size)
+
+        # skip unchanged source directories (import only)
+        use_dir_snapshots = self.skip_unchanged_dirs and self.indexing_mode is False
+        if use_dir_snapshots:
+            self._start_dir_snapshots()
+
         self._selective_logger('---')
 
         # iterate over source dirs
@@ -484,97 +688,292 @@ class MediaGrabber:
             # nothing to do
             self.logger.info('no files for process!')
         else:
-            # iterate over source files and import new files to target
-            for my_file in file_list:
-                start = timer()
-                file_count += 1
-                total_file_size_before = self.stats.total_file_size
-                emf = None
+            # preload known sources of the dirs, so the known source check is done in memory
+            if self.indexing_mode is False:
+                self.db.load_source_index(list_of_dirs)
 
-                self._selective_logger(
-                    '[' + str(file_count) + ' / ' + str(total_files) + '] (' + format((file_count / total_files) * 100,
-                                                                                      '.1f') + '%): ' + my_file)
-
-                # check if source filename exists in db
-                if self.db.source_exists(my_file) and self.indexing_mode is False:
-                    # is known source, skip
-                    skipped_count += 1
-                    self._selective_logger('file is a known source - skipping')
-                else:
-                    # if not known: get file info
-                    emf = ExifMediaFile(my_file, et)
-                    emf.parse_exif_info()
-                    emf.calculate_md5()
-
-                    # check if hash matches
-                    if self.db.file_hash_matches(emf):
-                        # md5 match: file is duplicate
-                        # count as skipped
+            # iterate over source files and import new files to target
+            # (db changes are committed in batches, pending changes are flushed on exit)
+            with self.db.batch(self.batch_size, self.commit_interval):
+                for file_index, my_file in enumerate(file_list):
+                    start = timer()
+                    file_count += 1
+                    total_file_size_before = self.stats.total_file_size
+                    emf = None
+
+                    self._selective_logger(
+                        '[' + str(file_count) + ' / ' + str(total_files) + '] (' +
+                        format((file_count / total_files) * 100, '.1f') + '%): ' + my_file)
+
+                    # check if source filename exists in db
+                    if self.indexing_mode is False and self.db.source_exists(my_file):
+                        # is known source, skip
                         skipped_count += 1
-
-                        db_path, db_fn = self.db.get_target_path_filename(emf)
-
-                        if self.indexing_mode is True:
-                            # check if this is the file which is already in the db - else delete (duplicate)
-                            if self._is_target_file(emf, my_file):
-                                self._selective_logger("ok, record for file exists: '" + db_fn + "'")
+                        self._selective_logger('file is a known source - skipping')
+                    else:
+                        # if not known: get file info (read in batches with the next files)
+                        if my_file not in prepared_files:
+                            exif_batch_size = self._read_file_info_batch(file_list, file_index, et, prepared_files,
+                                                                         exif_batch_size)
+                        emf = prepared_files.pop(my_file)
+
+                        if emf is None:
+                            # file could not be read, count as skipped
+                            skipped_count += 1
+                            self.logger.error('could not read file info - skipping: %s', my_file)
+                            if use_dir_snapshots:
+                                # try again in the next run
+                                self._incomplete_dirs.add(os.path.dirname(my_file))
+
+                        # check if hash matches
+                        elif self.db.file_hash_matches(emf):
+                            # md5 match: file is duplicate
+                            # count as skipped
+                            skipped_count += 1
+
+                            db_path, db_fn = self.db.get_target_path_filename(emf)
+
+                            if self.indexing_mode is True:
+                                # check if this is the file which is already in the db - else delete (duplicate)
+                                if self._is_target_file(emf, my_file):
+                                    self._selective_logger("ok, record for file exists: '" + db_fn + "'")
+                                else:
+                                    # file is a duplicate, remove
+                                    self.logger.warning(
+                                        "duplicate found: original '" + db_fn + "' => removing duplicate: '" +
+                                        my_file + "'")
+                                    self._remove_file(my_file)
                             else:
-                                # file is a duplicate, remove
-                                self.logger.warning(
-                                    "duplicate found: original '" + db_fn + "' => removing duplicate: '" + my_file + "'")
-                                self._remove_file(my_file)
+                                # add source entry for this file
+                                self._selective_logger("file is already in target as '" + db_fn + "'")
+                                self._selective_logger('added as new source')
+                                self.db.add_source(emf)
+                                # skip (no file operation)
                         else:
-                            # add source entry for this file
-                            self._selective_logger("file is already in target as '" + db_fn + "'")
-                            self._selective_logger('added as new source')
-                            self.db.add_source(emf)
-                            # skip (no file operation)
-                    else:
-                        # md5 is different,
-                        # insert file
-                        self._selective_logger('identified as new file')
-                        self._insert_new_target_file(emf)
-                        self._selective_logger('created new file record: ' + emf.get_target_filename())
-
-                if emf is not None:
-                    self.logger.debug('target name: %s, target size: %s', emf.get_target_filename(),
-                                      emf.file_properties['file_size'])
-                end = timer()
-                processing_time = end - start
-                processing_size_mb = (self.stats.total_file_size - total_file_size_before) / 1024 / 1024
-                total_time += processing_time
-
-                # update average time
-                if len(last_times) > min_timer_samples:
-                    last_times.pop(0)  # remove oldest value
-                last_times.append(processing_time)
-                avg_time = sum(last_times) / float(len(last_times))
-
-                # show some stats in verbose mode
-                self._selective_logger('time: %ss / avg: %s | total: %ss | size: %sMB | remaining: %s files / ~%ss',
-                                       format(processing_time, '.3f'),
-                                       format(avg_time, '.3f'),
-                                       format(total_time, '.2f'),
-                                       format(processing_size_mb, '.2f'),
-                                       str(total_files - file_count),
-                                       format((total_files - file_count) * avg_time, '.0f')
-                                       )
-                self._selective_logger('---')
+                            # md5 is different,
+                            # insert file
+                            self._selective_logger('identified as new file')
+                            self._insert_new_target_file(emf)
+                            self._selective_logger('created new file record: ' + emf.get_target_filename())
+
+                    # file done - db changes are committed once the batch is full
+                    self.db.end_unit()
+
+                    if emf is not None:
+                        self.logger.debug('target name: %s, target size: %s', emf.get_target_filename(),
+                                          emf.file_properties['file_size'])
+                    end = timer()
+                    processing_time = end - start
+                    processing_size_mb = (self.stats.total_file_size - total_file_size_before) / 1024 / 1024
+                    total_time += processing_time
+
+                    # update average time
+                    if len(last_times) > min_timer_samples:
+                        last_times.pop(0)  # remove oldest value
+                    last_times.append(processing_time)
+                    avg_time = sum(last_times) / float(len(last_times))
+
+                    # show some stats in verbose mode
+                    self._selective_logger(
+                        'time: %ss / avg: %s | total: %ss | size: %sMB | remaining: %s files / ~%ss',
+                        format(processing_time, '.3f'),
+                        format(avg_time, '.3f'),
+                        format(total_time, '.2f'),
+                        format(processing_size_mb, '.2f'),
+                        str(total_files - file_count),
+                        format((total_files - file_count) * avg_time, '.0f')
+                    )
+                    self._selective_logger('---')
+
+        # all files processed - record directory snapshots for the next run
+        if use_dir_snapshots:
+            self._save_dir_snapshots()
+
+        # keep the metadata cache (scan journal) within its budget
+        with self.db.write_lock():
+            self.db.trim_scan_journal()
 
         # update stats counters
         self.stats.total_time_file += total_time
         self.stats.file_count += file_count
         self.stats.skipped_files += skipped_count
 
-        # clean up
-        et.terminate()
-
         self.logger.info('...done!')
         self.logger.info('')
 
         # display stats
         self._show_stats()
 
+    def _start_exiftool(self):
+        """
+        Start the exiftool processes (once per run, shared by import and index phases)
+
+        If the exiftool daemon is running, a pool of connections to the daemon is used. Otherwise,
+        a single process is run by the asyncio client (requests are pipelined), several processes
+        by a pool.
+        :return: ExifToolThread or ExifToolPool
+        """
+        if self.exiftool is None:
+            if self._exif_daemon_running():
+                self.exiftool = ExifToolPool(self.exif_workers,
+                                             worker_factory=partial(exiftool_daemon.ExifToolClient, self.exif_socket,
+                                                                    self.exif_timeout or None))
+                self.logger.info('using exiftool daemon: %s', self.exif_socket)
+            elif self.exif_workers > 1:
+                self.exiftool = ExifToolPool(self.exif_workers, timeout=self.exif_timeout or None)
+            else:
+                self.exiftool = ExifToolThread(timeout=self.exif_timeout or None)
+            self.exiftool.start()
+
+        return self.exiftool
+
+    def _exif_daemon_running(self):
+        """
+        Check if the exiftool daemon accepts connections
+        """
+        if not self.exif_daemon:
+            return False
+
+        client = exiftool_daemon.connect(self.exif_socket)
+        if client is None:
+            return False
+
+        client.terminate()
+        return True
+
+    def _read_file_info_batch(self, file_list, start_index, et, prepared_files, batch_size):
+        """
+        Get file info (exif tags and hash) for the next files of the list
+
+        Files which are not known sources are collected starting at start_index, until there are
+        batch_size files to read with exiftool. The exif tags are read with a single exiftool call.
+        If a file was scanned before (same device, inode, size and mtime), the results are taken
+        from the scan journal instead of running exiftool and hashing the file.
+
+        The exif tags of the batch after this one are requested before this batch is hashed, so
+        exiftool reads them while the files of this batch are hashed and copied.
+
+        Failures of a file (e.g. no create date) only affect this file, it is added as None. Files
+        exiftool hangs on are put on the skip list, so they are not read again in later runs.
+
+        The batch size adapts to the time of the exiftool call: it is doubled if the call is fast
+        and halved if it exceeds self.exif_batch_time (max. self.exif_batch_size).
+        :param file_list: list of files to process
+        :param start_index: index of the next file to process (not a known source)
+        :param et: ExifToolThread or ExifToolPool instance
+        :param prepared_files: dict to add the files to (path => ExifMediaFile or None)
+        :param batch_size: current batch size
+        :return: batch size for the next batch
+        """
+        file_batch = self._exif_prefetch
+        self._exif_prefetch = None
+        if file_batch is None or file_list[start_index] not in (my_file for my_file, emf in file_batch[0]):
+            file_batch = self._request_file_batch(file_list, start_index, et, batch_size, check_first=False)
+        batch, exif_batch, exif_requests, request_time, next_index = file_batch
+
+        # request the next batch right away
+        if next_index < len(file_list):
+            self._exif_prefetch = self._request_file_batch(file_list, next_index, et, batch_size)
+
+        # read exif tags of all files which are not in the scan journal
+        exif_results = ExifMediaFile.read_exif_tags_batch(exif_batch, et, exif_requests)
+        batch_time = timer() - request_time
+
+        if exif_batch:
+            self.logger.debug('read %s files in %ss (batch size: %s)', len(exif_batch), format(batch_time, '.3f'),
+                              batch_size)
+        for emf, exif_tags in zip(exif_batch, exif_results):
+            emf.exif_tags = exif_tags
+            if emf.exif_timed_out:
+                # do not let the file stall the following runs
+                self.logger.warning('exiftool hangs on file - skipped in later runs: %s', emf.full_path)
+                self.db.add_exif_skip_entry(emf, 'exiftool timeout')
+
+        for my_file, emf in batch:
+            prepared_files[my_file] = self._parse_file_info(emf)
+
+        # adapt batch size
+        if batch_time > self.exif_batch_time:
+            batch_size = max(1, batch_size // 2)
+        elif batch_time < self.exif_batch_time / 2 and len(exif_batch) == batch_size:
+            batch_size = min(self.exif_batch_size, batch_size * 2)
+
+        return batch_size
+
+    def _request_file_batch(self, file_list, start_index, et, batch_size, check_first=True):
+        """
+        Collect the next batch of files (see _read_file_info_batch()) and request their exif tags
+        :param file_list: list of files to process
+        :param start_index: index of the first file of the batch
+        :param et: ExifToolThread or ExifToolPool instance
+        :param batch_size: max. number of files to read with exiftool
+        :param check_first: check if the first file is a known source as well
+        :return: tuple (list of (path, ExifMediaFile), files to read with exiftool, futures of the exiftool
+                 results (one per read profile), time of the request, index after the batch)
+        """
+        batch = []
+        exif_batch = []
+        file_index = start_index
+        while file_index < len(file_list) and len(exif_batch) < batch_size:
+            my_file = file_list[file_index]
+            file_index += 1
+
+            if (check_first or file_index > start_index + 1) and self.indexing_mode is False and \
+                    self.db.source_exists(my_file):
+                # known source, skipped when processed
+                continue
+
+            emf = ExifMediaFile(my_file, et)
+            batch.append((my_file, emf))
+
+            if emf.full_path is None:
+                # file is gone
+                continue
+
+            journal_entry = self.db.get_scan_journal_entry(emf)
+            if journal_entry is not None:
+                file_hash_md5, exif_tags = journal_entry
+                emf.exif_tags = exif_tags
+                emf.file_properties['file_hash_md5'] = file_hash_md5
+            else:
+                # read the exif block directly if possible, else with exiftool
+                emf.exif_tags = emf.read_exif_tags_fast(emf.full_path)
+                if emf.exif_tags is None:
+                    if self.db.is_exif_skip_listed(emf):
+                        self.logger.warning('exiftool hung on the file before - skipping: %s', my_file)
+                    else:
+                        exif_batch.append(emf)
+
+        exif_requests = ExifMediaFile.request_exif_tags_batch(exif_batch, et)
+
+        return batch, exif_batch, exif_requests, timer(), file_index
+
+    def _parse_file_info(self, emf: ExifMediaFile):
+        """
+        Parse the exif tags read for the file, calculate the hash if it is not known from the scan journal
+        :param emf: file with exif_tags (and file_hash_md5 if taken from the scan journal)
+        :return: emf or None if the file could not be parsed
+        """
+        if emf.full_path is None or not emf.exif_tags:
+            return None
+
+        from_journal = emf.file_properties['file_hash_md5'] is not None
+
+        try:
+            emf.parse_exif_info(emf.exif_tags)
+            if not from_journal:
+                emf.calculate_hash()
+        except (KeyError, TypeError, ValueError, OSError) as error:
+            self.logger.error('could not parse file info of "%s": %s', emf.full_path, error)
+            return None
+
+        if from_journal:
+            self.logger.debug('unchanged file - using info from scan journal: %s', emf.full_path)
+        else:
+            self.db.add_scan_journal_entry(emf)
+
+        return emf
+
     def _is_target_file(self, emf: ExifMediaFile, my_file):
 
         db_path, db_fn = self.db.get_target_path_filename(emf)
@@ -607,6 +1006,14 @@ class MediaGrabber:
                 self.logger.info('> total time       : %ss', format(self.stats.total_time_file, '.2f'))
                 self.logger.info('---')
 
+            # metadata cache (scan journal)
+            if self.db.journal_hits + self.db.journal_misses > 0:
+                self.logger.info('metadata cache')
+                self.logger.info('> hits             : %s', str(self.db.journal_hits))
+                self.logger.info('> misses           : %s', str(self.db.journal_misses))
+                self.logger.info('> evicted          : %s', str(self.db.journal_evicted))
+                self.logger.info('---')
+
             # db records (validation)
             if self.stats.db_count > 0:
                 self.logger.info('target records')
@@ -628,19 +1035,24 @@ class MediaGrabber:
 
     def _insert_new_target_file(self, emf: ExifMediaFile):
 
-        # make sure we have md5 hash of file
+        # make sure we have the hash of the file
         if emf.file_properties['file_hash_md5'] is None:
-            emf.calculate_md5()
+            emf.calculate_hash()
 
-        # make sure filename is unique
-        self.db.assign_unique_target_filename(emf)
+        # assign unique filename and add db records in one step (other importers may run concurrently)
+        with self.db.write_lock():
+            if self.concurrent and self.db.file_hash_matches(emf):
+                # the same file was added by another importer in the meantime
+                if self.indexing_mode is False:
+                    self.db.add_source(emf)
+                self._selective_logger('file was added by another importer - added as new source')
+                return
 
-        # add db record for file
-        self.db.add_file(emf)
+            # make sure filename is unique
+            self.db.assign_unique_target_filename(emf)
 
-        # add sources
-        if self.indexing_mode is False:
-            self.db.add_source(emf)
+            # add db records for file and source (no sources when indexing)
+            self.db.ingest_files([emf], add_sources=self.indexing_mode is False)
 
         # move/copy physical file
         source = os.path.abspath(emf.get_full_source_path())
@@ -650,7 +1062,7 @@ class MediaGrabber:
         # dry run?
         if not self.simulate:
             if not os.path.exists(target_path):
-                os.makedirs(target_path)
+                os.makedirs(target_path, exist_ok=True)
                 self.logger.debug('created  dir <' + target_path + '>')
 
             if source != target:
@@ -716,6 +1128,60 @@ class MediaGrabber:
         self.db.drop_sources()
         self.logger.info('done - dropped all source infos')
 
+    def _start_dir_snapshots(self):
+        """
+        Prepare directory snapshots for this run and decide if a full walk is due
+
+        A full walk is done every full_walk_every runs and whenever the file filters changed
+        """
+        self._dir_snapshots = {}
+        self._removed_dirs = []
+        self._incomplete_dirs = set()
+        self._dir_parents = {}
+
+        run_count = int(self.db.get_setting('dir_snapshot_run_count', 0))
+        walk_filter = repr((sorted(self.file_extensions), self.ignore_subfolder_patterns))
+
+        if walk_filter != self.db.get_setting('dir_snapshot_walk_filter'):
+            self.logger.info('file filters changed - scanning all directories')
+            self._full_walk = True
+        elif self.full_walk_every and run_count % self.full_walk_every == 0:
+            self.logger.info('scanning all directories (every %s runs)', self.full_walk_every)
+            self._full_walk = True
+        else:
+            self._full_walk = False
+
+        self._walk_filter = walk_filter
+        self._run_count = run_count
+
+    def _save_dir_snapshots(self):
+        """
+        Store the directory snapshots of this run (not in probe mode - the files were not imported)
+
+        Incomplete directories get no snapshot and their snapshot of an earlier run is removed, so
+        they are listed again next run: directories with files which could not be read (e.g. skip
+        listed), directories which could not be listed or were modified just now. The same goes for
+        all their parent directories - the walk only descends from an unchanged directory into
+        subdirectories with a snapshot.
+        """
+        if not self.simulate:
+            incomplete_dirs = set()
+            for dir_path in self._incomplete_dirs:
+                while dir_path is not None and dir_path not in incomplete_dirs:
+                    incomplete_dirs.add(dir_path)
+                    dir_path = self._dir_parents.get(dir_path)
+
+            snapshots = {dir_path: snapshot for dir_path, snapshot in self._dir_snapshots.items()
+                         if dir_path not in incomplete_dirs}
+            self.db.save_dir_snapshots(snapshots, self._removed_dirs + sorted(incomplete_dirs))
+            self.db.set_setting('dir_snapshot_walk_filter', self._walk_filter)
+            self.db.set_setting('dir_snapshot_run_count', str(self._run_count + 1))
+
+        self._dir_snapshots = None
+        self._removed_dirs = None
+        self._incomplete_dirs = None
+        self._dir_parents = None
+
     def _get_file_list(self, the_path):
         """
         Build a list of files in the passed directory which matches the extensions
@@ -723,6 +1189,8 @@ class MediaGrabber:
         :param the_path: str
         :return: []
         """
+        if self._dir_snapshots is not None:
+            return self._get_file_list_incremental(the_path)
 
         file_list = []
 
@@ -743,6 +1211,79 @@ class MediaGrabber:
         file_list.sort()
         return file_list
 
+    def _get_file_list_incremental(self, the_path):
+        """
+        Same as _get_file_list, but directories whose mtime did not change since the last run are not listed
+
+        Adding, removing or renaming a file changes the mtime of its directory, so all files of an
+        unchanged directory are known already. The subdirectories of an unchanged directory are taken from
+        the snapshots and checked one by one. Directories which are not recorded completely are
+        collected in _incomplete_dirs (see _save_dir_snapshots()).
+        :param the_path: str
+        :return: []
+        """
+        file_list = []
+        skipped_dirs = 0
+        skipped_entries = 0
+
+        snapshots = self.db.load_dir_snapshots(the_path)
+        children = {}
+        for dir_path, (parent_path, mtime_ns, entry_count) in snapshots.items():
+            children.setdefault(parent_path, []).append(dir_path)
+
+        # directories modified in the last seconds are not recorded (changes within the mtime resolution)
+        recent_mtime_ns = time.time_ns() - 2 * 10 ** 9
+
+        dirs_to_scan = [(os.path.abspath(the_path), None)]
+        while dirs_to_scan:
+            dir_path, parent_path = dirs_to_scan.pop()
+            self._dir_parents[dir_path] = parent_path
+
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                self._removed_dirs.append(dir_path)
+                continue
+
+            snapshot = snapshots.get(dir_path)
+            if not self._full_walk and snapshot is not None and snapshot[1] == mtime_ns:
+                # unchanged directory - only descend into known subdirectories
+                self.logger.debug('unchanged directory: %s', dir_path)
+                skipped_dirs += 1
+                skipped_entries += snapshot[2]
+                dirs_to_scan.extend((child_path, dir_path) for child_path in children.get(dir_path, []))
+                continue
+
+            try:
+                with os.scandir(dir_path) as entries:
+                    entries = list(entries)
+            except OSError as error:
+                self.logger.warning('cannot list directory <%s>: %s', dir_path, error)
+                self._incomplete_dirs.add(dir_path)
+                continue
+
+            for entry in entries:
+                if entry.is_dir():
+                    # same as os.walk: do not follow symlinks to directories
+                    if not entry.is_symlink() and not self._filter_path(entry.path, self.ignore_subfolder_patterns):
+                        dirs_to_scan.append((entry.path, dir_path))
+                elif entry.is_file() and self._filter_file_by_ext(entry.path, self.file_extensions):
+                    self.logger.debug('added file: %s', entry.path)
+                    file_list.append(entry.path)
+
+            if mtime_ns < recent_mtime_ns:
+                self._dir_snapshots[dir_path] = (parent_path, mtime_ns, len(entries))
+            else:
+                self._incomplete_dirs.add(dir_path)
+
+        if skipped_dirs:
+            self._selective_logger('skipped ' + str(skipped_dirs) + ' unchanged directories (' +
+                                   str(skipped_entries) + ' entries)')
+
+        # sort file list
+        file_list.sort()
+        return file_list
+
 
 def init_loggers():
     # get logger and set level (required)
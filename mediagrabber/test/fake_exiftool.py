@@ -0,0 +1,36 @@
+"""
+Stand-in for exiftool in stay open mode (-stay_open True -@ -), used by test_exiftool_timeout.py
+
+Reads the parameters from stdin and answers every -executeNUM with a JSON record per file and the
+sentinel {readyNUM}. Hangs (without any output) on files with 'hang' in their name, like exiftool
+on some corrupt files.
+"""
+import json
+import sys
+import time
+
+
+def main():
+    params = []
+    for line in sys.stdin.buffer:
+        param = line.rstrip(b'\r\n').decode('utf-8')
+        if param == '-stay_open':
+            continue
+        if param == 'False':
+            break
+        if not param.startswith('-execute'):
+            params.append(param)
+            continue
+
+        files = [param for param in params if not param.startswith('-')]
+        params = []
+        if any('hang' in path for path in files):
+            time.sleep(3600)
+        if files:
+            sys.stdout.write(json.dumps([{'SourceFile': path} for path in files]) + '\n')
+        sys.stdout.write('{ready%s}\n' % param[len('-execute'):])
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import unittest
+import warnings
+
+from database import DataBase
+from exifmediafile import ExifMediaFile
+
+# schema of the first release (before schema migrations, user_version 0)
+BASELINE_SCHEMA = (
+    'CREATE TABLE file ('
+    'file_id INTEGER PRIMARY KEY NOT NULL,'
+    'file_type TEXT,'
+    'file_size BIGINT,'
+    'file_hash_md5 TEXT DEFAULT (NULL),'
+    'file_date TIMESTAMP,'
+    'date_time_original TIMESTAMP NOT NULL,'
+    'target_path TEXT NOT NULL DEFAULT (NULL),'
+    'target_filename TEXT NOT NULL DEFAULT (NULL),'
+    'image_width TEXT DEFAULT (NULL),'
+    'image_height TEXT DEFAULT (NULL),'
+    'camera_make TEXT DEFAULT (NULL),'
+    'camera_model TEXT DEFAULT (NULL),'
+    'gps_longitude TEXT DEFAULT (NULL),'
+    'gps_latitude TEXT DEFAULT (NULL),'
+    'date_added TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP),'
+    'copied BOOLEAN NOT NULL DEFAULT (0),'
+    'date_copied TIMESTAMP);'
+    'CREATE UNIQUE INDEX idx_unique_target_path_file ON file (target_path, target_filename);'
+    'CREATE UNIQUE INDEX idx_file_hash_md5 ON file (file_hash_md5);'
+    'CREATE TABLE source ('
+    'source_id INTEGER PRIMARY KEY NOT NULL UNIQUE,'
+    'source_path TEXT NOT NULL,'
+    'source_filename TEXT NOT NULL,'
+    'file_id INTEGER NOT NULL'
+    ' REFERENCES file (file_id) '
+    ' ON DELETE CASCADE'
+    ' ON UPDATE CASCADE,'
+    'date_added TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP));'
+    'CREATE UNIQUE INDEX unique_path_filename ON source (source_path, source_filename);'
+)
+
+
+def setUpModule():
+    # missing files etc. are logged as warnings
+    logging.disable(logging.WARNING)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+class DataBaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source_dir = os.path.join(self.directory.name, 'source')
+        self.target_dir = os.path.join(self.directory.name, 'target')
+        os.makedirs(self.source_dir)
+        os.makedirs(self.target_dir)
+        self.db_file = os.path.join(self.target_dir, '.mediagrabber.db')
+
+    def tearDown(self):
+        ExifMediaFile.hash_algorithm = 'md5'
+        self.directory.cleanup()
+
+    def media_file(self, name, content, second=0):
+        """
+        Source file with parsed file info (create date 2017-05-29 09:15:<second>)
+        """
+        path = os.path.join(self.source_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        emf = ExifMediaFile(path, object())
+        emf.parse_exif_info({'SourceFile': path, 'EXIF:DateTimeOriginal': '2017:05:29 09:15:%02d' % second})
+        emf.calculate_hash()
+        return emf
+
+    def import_file(self, db, emf):
+        """
+        Add the file record and copy the file to its target path
+        """
+        db.add_file(emf)
+        target_path = os.path.join(self.target_dir, emf.file_properties['target_path'])
+        os.makedirs(target_path, exist_ok=True)
+        with open(emf.full_path, 'rb') as source, \
+                open(os.path.join(target_path, emf.file_properties['target_filename']), 'wb') as target:
+            target.write(source.read())
+
+
+class MigrationTest(DataBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.files = [self.media_file('f%s.jpg' % i, b'content %d' % i, i) for i in range(3)]
+
+        connection = sqlite3.connect(self.db_file)
+        connection.executescript(BASELINE_SCHEMA)
+        for file_id, emf in enumerate(self.files, start=1):
+            connection.execute(
+                'INSERT INTO file (file_id, file_type, file_size, file_hash_md5, date_time_original, target_path, '
+                'target_filename) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (file_id, 'JPEG', emf.file_properties['file_size'], emf.file_properties['file_hash_md5'],
+                 emf.file_properties['date_time_original'], '2017/05', os.path.basename(emf.full_path)))
+            connection.execute('INSERT INTO source (source_path, source_filename, file_id) VALUES (?, ?, ?)',
+                               (self.source_dir, os.path.basename(emf.full_path), file_id))
+        connection.commit()
+        connection.close()
+
+    def columns(self, db, table):
+        return [row[1] for row in db.execute_sql('pragma table_info(%s)' % table).fetchall()]
+
+    def test_migrate_baseline_db(self):
+        db = DataBase(self.db_file)
+        self.assertEqual(db.get_schema_version(), len(DataBase.schema_migrations))
+        self.assertEqual(db.execute_sql('pragma integrity_check').fetchone(), ('ok',))
+        self.assertIsNone(db.execute_sql('pragma foreign_key_check').fetchone())
+
+        file_columns = self.columns(db, 'file')
+        self.assertIn('target_directory_id', file_columns)
+        self.assertIn('hash_algorithm', file_columns)
+        self.assertNotIn('target_path', file_columns)
+        self.assertIn('source_directory_id', self.columns(db, 'source'))
+        for table in ('scan_journal', 'dir_snapshot', 'setting', 'exif_skip_list', 'directory'):
+            self.assertTrue(self.columns(db, table), table)
+
+        # existing records keep md5
+        self.assertEqual(db.get_setting('hash_algorithm'), 'md5')
+        self.assertEqual(db.hash_algorithm, 'md5')
+        properties = db.get_file_properties(2)
+        self.assertEqual(properties['target_path'], '2017/05')
+        self.assertEqual(properties['target_filename'], 'f1.jpg')
+        self.assertEqual(properties['hash_algorithm'], 'md5')
+
+        for emf in self.files:
+            self.assertTrue(db.source_exists(emf.full_path))
+            self.assertTrue(db.file_hash_matches(emf))
+        db.disconnect()
+
+    def test_migrated_db_is_not_changed_again(self):
+        DataBase(self.db_file).disconnect()
+        with open(self.db_file, 'rb') as f:
+            migrated = f.read()
+
+        db = DataBase(self.db_file)
+        self.assertEqual(db.get_schema_version(), len(DataBase.schema_migrations))
+        db.disconnect()
+        with open(self.db_file, 'rb') as f:
+            self.assertEqual(f.read(), migrated)
+
+    def test_fresh_db_has_same_schema(self):
+        migrated = DataBase(self.db_file)
+        fresh = DataBase(os.path.join(self.directory.name, 'fresh.db'))
+        sql = "SELECT type, name, tbl_name, sql FROM sqlite_master ORDER BY name"
+        self.assertEqual(fresh.execute_sql(sql).fetchall(), migrated.execute_sql(sql).fetchall())
+        self.assertEqual(fresh.get_schema_version(), migrated.get_schema_version())
+        migrated.disconnect()
+        fresh.disconnect()
+
+
+class RehashTest(DataBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.db = DataBase(self.db_file)
+        self.db.set_hash_algorithm('md5')
+        ExifMediaFile.hash_algorithm = 'md5'
+        self.files = [self.media_file('f%s.jpg' % i, b'content %d' % i * 100, i) for i in range(5)]
+        for emf in self.files:
+            self.import_file(self.db, emf)
+
+        self.db.set_hash_algorithm('sha256')
+        ExifMediaFile.hash_algorithm = 'sha256'
+
+    def tearDown(self):
+        self.db.disconnect()
+        super().tearDown()
+
+    def records(self):
+        sql = 'SELECT file_id, file_hash_md5, hash_algorithm FROM file ORDER BY file_id'
+        return self.db.execute_sql(sql).fetchall()
+
+    def test_new_indexes_use_default_algorithm(self):
+        db = DataBase(os.path.join(self.directory.name, 'new.db'))
+        self.assertEqual(db.hash_algorithm, 'sha256')
+        self.assertEqual(db.legacy_hash_algorithms, [])
+        db.disconnect()
+
+    def test_switch_algorithm(self):
+        self.assertEqual(self.db.get_setting('hash_algorithm'), 'sha256')
+        self.assertEqual(self.db.legacy_hash_algorithms, ['md5'])
+
+    def test_rehash_resumes(self):
+        self.assertEqual(self.db.rehash_files(self.target_dir, 2), (2, 3))
+        first_ids = [file_id for file_id, _, algorithm in self.records() if algorithm == 'sha256']
+        self.assertEqual(self.db.get_setting('rehash_file_id'), str(first_ids[-1]))
+
+        # the next run continues after the last re-hashed record
+        self.assertEqual(self.db.rehash_files(self.target_dir, 2), (2, 1))
+        self.assertEqual(self.db.rehash_files(self.target_dir, 2), (1, 0))
+        self.assertEqual(self.db.get_setting('rehash_file_id'), '0')
+        self.assertEqual(self.db.legacy_hash_algorithms, [])
+
+        for (_, file_hash, algorithm), emf in zip(self.records(), self.files):
+            with open(emf.full_path, 'rb') as f:
+                self.assertEqual(file_hash, hashlib.sha256(f.read()).hexdigest())
+            self.assertEqual(algorithm, 'sha256')
+
+        self.assertEqual(self.db.rehash_files(self.target_dir, 2), (0, 0))
+
+    def test_rehash_all(self):
+        self.assertEqual(self.db.rehash_files(self.target_dir), (5, 0))
+
+    def test_missing_file_is_retried(self):
+        missing = self.files[1]
+        os.remove(os.path.join(self.target_dir, missing.file_properties['target_path'],
+                               missing.file_properties['target_filename']))
+
+        self.assertEqual(self.db.rehash_files(self.target_dir, 3), (2, 3))
+        self.assertEqual(self.db.rehash_files(self.target_dir, 3), (2, 1))
+        # the pass is complete - the next run starts over with the records left
+        self.assertEqual(self.db.get_setting('rehash_file_id'), '0')
+        self.assertEqual(self.db.legacy_hash_algorithms, ['md5'])
+        self.assertEqual(self.db.rehash_files(self.target_dir, 3), (0, 1))
+
+    def test_lookup_during_transition(self):
+        self.db.rehash_files(self.target_dir, 2)
+
+        for index in (0, 4):
+            # same content as a re-hashed record and as a record still hashed with md5
+            copy = self.media_file('copy%s.jpg' % index, b'content %d' % index * 100, 30)
+            self.assertEqual(copy.file_properties['hash_algorithm'], 'sha256')
+            self.assertTrue(self.db.file_hash_matches(copy))
+            self.assertEqual(copy.file_id, str(self.files[index].file_id))
+
+        new_file = self.media_file('new.jpg', b'new content', 40)
+        self.assertFalse(self.db.file_hash_matches(new_file))
+        # no record of the same size: the md5 hash is not calculated
+        self.assertEqual(list(new_file.file_hashes), ['sha256'])
+
+    def test_scan_journal_of_other_algorithm_is_not_used(self):
+        emf = self.files[0]
+        self.db.add_scan_journal_entry(emf)
+        self.assertIsNone(self.db.get_scan_journal_entry(emf))
+
+        emf.file_hashes = {}
+        emf.calculate_hash()
+        self.db.add_scan_journal_entry(emf)
+        self.assertEqual(self.db.get_scan_journal_entry(emf)[0], emf.file_properties['file_hash_md5'])
+
+
+class ScanJournalTest(DataBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.db = DataBase(self.db_file)
+        self.db.set_hash_algorithm('md5')
+        self.files = [self.media_file('f%s.jpg' % i, b'content %d' % i, i) for i in range(3)]
+        for emf in self.files:
+            self.db.add_scan_journal_entry(emf)
+        self.db.execute_sql('UPDATE scan_journal SET last_used = 0')
+
+    def tearDown(self):
+        self.db.disconnect()
+        super().tearDown()
+
+    def last_used(self):
+        sql = 'SELECT last_used FROM scan_journal WHERE file_hash_md5 = ?'
+        return [self.db.execute_sql(sql, (emf.file_properties['file_hash_md5'],)).fetchone()[0]
+                for emf in self.files]
+
+    def test_lookup_does_not_write(self):
+        self.assertIsNotNone(self.db.get_scan_journal_entry(self.files[1]))
+        self.assertFalse(self.db.db_connection.in_transaction)
+        self.assertEqual(self.last_used(), [0, 0, 0])
+
+    def test_trim_updates_last_used_of_hits(self):
+        self.db.get_scan_journal_entry(self.files[1])
+        self.db.get_scan_journal_entry(self.files[1])
+        self.db.journal_max_entries = 2
+        self.assertEqual(self.db.trim_scan_journal(), 1)
+
+        # the used entry is kept, one of the others is evicted
+        remaining = [emf for emf in self.files if self.db.get_scan_journal_entry(emf) is not None]
+        self.assertEqual(len(remaining), 2)
+        self.assertIn(self.files[1], remaining)
+
+    def test_update_last_used(self):
+        self.db.get_scan_journal_entry(self.files[0])
+        self.db.get_scan_journal_entry(self.files[2])
+        self.assertEqual(self.db.update_scan_journal_last_used(), 2)
+        self.assertEqual(self.db.update_scan_journal_last_used(), 0)
+        last_used = self.last_used()
+        self.assertGreater(last_used[0], 0)
+        self.assertEqual(last_used[1], 0)
+        self.assertGreater(last_used[2], 0)
+
+
+class SkipListTest(DataBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.db = DataBase(self.db_file)
+        self.emf = self.media_file('hang.mov', b'content')
+        self.db.add_exif_skip_entry(self.emf, 'exiftool did not respond')
+
+    def tearDown(self):
+        self.db.disconnect()
+        super().tearDown()
+
+    def test_skip_listed(self):
+        self.assertTrue(self.db.is_exif_skip_listed(self.emf))
+        self.assertFalse(self.db.is_exif_skip_listed(self.media_file('other.mov', b'other')))
+
+    def test_changed_file_is_read_again(self):
+        stat = os.stat(self.emf.full_path)
+        os.utime(self.emf.full_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertFalse(self.db.is_exif_skip_listed(self.emf))
+
+    def test_moved_file_stays_skip_listed(self):
+        moved = os.path.join(self.source_dir, 'moved.mov')
+        os.rename(self.emf.full_path, moved)
+        self.assertTrue(self.db.is_exif_skip_listed(ExifMediaFile(moved, object())))
+
+    def test_drop_sources_clears_skip_list(self):
+        self.db.drop_sources()
+        self.assertFalse(self.db.is_exif_skip_listed(self.emf))
+
+
+class MediaFileHashTest(DataBaseTestCase):
+
+    def test_calculate_md5_is_deprecated_alias(self):
+        emf = self.media_file('f.jpg', b'content')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertEqual(emf.calculate_md5(), hashlib.md5(b'content').hexdigest())
+        self.assertTrue(issubclass(caught[0].category, DeprecationWarning))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import importlib.util
+import logging
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from database import DataBase
+from exifmediafile import ExifMediaFile
+
+# the script module has the same name as the package it lives in
+_spec = importlib.util.spec_from_file_location(
+    'mediagrabber_script', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mediagrabber.py'))
+mediagrabber_script = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(mediagrabber_script)
+
+
+def setUpModule():
+    logging.disable(logging.WARNING)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+class DirSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source_dir = os.path.join(self.directory.name, 'source')
+        os.makedirs(self.source_dir)
+        self.db = DataBase(os.path.join(self.directory.name, 'index.db'))
+
+    def tearDown(self):
+        self.db.disconnect()
+        self.directory.cleanup()
+
+    def add_file(self, name, second):
+        path = os.path.join(self.source_dir, name)
+        with open(path, 'wb') as f:
+            f.write(name.encode())
+        emf = ExifMediaFile(path, object())
+        emf.parse_exif_info({'SourceFile': path, 'EXIF:DateTimeOriginal': '2017:05:29 09:15:%02d' % second})
+        emf.calculate_hash()
+        self.db.add_file(emf)
+        self.db.add_source(emf)
+        return emf
+
+    def media_grabber(self, snapshots, incomplete_dirs=()):
+        """
+        MediaGrabber at the end of an import with the given directory snapshots (no command line)
+        """
+        mg = mediagrabber_script.MediaGrabber.__new__(mediagrabber_script.MediaGrabber)
+        mg.db = self.db
+        mg.simulate = False
+        mg._dir_snapshots = snapshots
+        mg._removed_dirs = []
+        mg._incomplete_dirs = set(incomplete_dirs)
+        mg._dir_parents = {dir_path: snapshot[0] for dir_path, snapshot in snapshots.items()}
+        mg._walk_filter = 'filter'
+        mg._run_count = 0
+        return mg
+
+    def test_dropped_records_remove_snapshots_of_their_sources_and_parents(self):
+        emf = self.add_file('a.jpg', 1)
+        other_dir = os.path.join(self.directory.name, 'other')
+        self.db.save_dir_snapshots({self.directory.name: (None, 1, 2), self.source_dir: (self.directory.name, 1, 1),
+                                    other_dir: (self.directory.name, 1, 0)})
+
+        self.db.drop_target_records([emf.file_id])
+
+        self.assertEqual(self.db.load_dir_snapshots(self.directory.name), {other_dir: (self.directory.name, 1, 0)})
+        self.assertFalse(self.db.source_exists(emf.full_path))
+
+    def test_drop_all_records_removes_snapshots(self):
+        self.add_file('a.jpg', 1)
+        self.db.save_dir_snapshots({self.source_dir: (None, 1, 1)})
+
+        self.db.drop_all_records()
+
+        self.assertEqual(self.db.load_dir_snapshots(self.source_dir), {})
+
+    def test_incomplete_directories_get_no_snapshot(self):
+        complete_dir = os.path.join(self.source_dir, 'complete')
+        incomplete_dir = os.path.join(self.source_dir, 'incomplete')
+        # snapshot of an earlier (full walk) run with the same mtime
+        self.db.save_dir_snapshots({incomplete_dir: (self.source_dir, 5, 2)})
+
+        mg = self.media_grabber({
+            self.source_dir: (None, 5, 2),
+            complete_dir: (self.source_dir, 5, 1),
+            incomplete_dir: (self.source_dir, 5, 2),
+        }, incomplete_dirs=[incomplete_dir])
+        mg._save_dir_snapshots()
+
+        # the parent is incomplete as well
+        self.assertEqual(sorted(self.db.load_dir_snapshots(self.source_dir)), [complete_dir])
+        self.assertEqual(self.db.get_setting('dir_snapshot_run_count'), '1')
+
+
+class IncrementalWalkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source_dir = os.path.join(self.directory.name, 'source')
+        os.makedirs(self.source_dir)
+        self.db = DataBase(os.path.join(self.directory.name, 'index.db'))
+        self.old_mtime_ns = time.time_ns() - 60 * 10 ** 9
+
+    def tearDown(self):
+        self.db.disconnect()
+        self.directory.cleanup()
+
+    def add_file(self, path, age=True):
+        """
+        Add a file; age: set the mtime of its directories (up to the source dir) to an older, unique time
+        """
+        path = os.path.join(self.source_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'content')
+        if age:
+            self.age(os.path.dirname(path))
+        return path
+
+    def age(self, dir_path):
+        while True:
+            self.old_mtime_ns += 10 ** 9
+            os.utime(dir_path, ns=(self.old_mtime_ns, self.old_mtime_ns))
+            if dir_path == self.source_dir:
+                break
+            dir_path = os.path.dirname(dir_path)
+
+    def walk(self, incomplete_files=()):
+        """
+        Files listed by an incremental walk of the source dir (snapshots saved as at the end of an import)
+        """
+        mg = mediagrabber_script.MediaGrabber.__new__(mediagrabber_script.MediaGrabber)
+        mg.logger = logging.getLogger(__name__)
+        mg.verbose = False
+        mg.db = self.db
+        mg.simulate = False
+        mg.file_extensions = ['jpg']
+        mg.ignore_subfolder_patterns = []
+        mg.full_walk_every = 0
+        mg._dir_snapshots = None
+        mg._start_dir_snapshots()
+        file_list = mg._get_file_list(self.source_dir)
+        for path in incomplete_files:
+            mg._incomplete_dirs.add(os.path.dirname(path))
+        mg._save_dir_snapshots()
+        return file_list
+
+    def test_unchanged_directories_are_skipped(self):
+        first = self.add_file('a/1.jpg')
+        self.walk()
+        self.assertEqual(self.walk(), [])
+
+        second = self.add_file('a/2.jpg')
+        self.assertEqual(self.walk(), [first, second])
+
+    def test_recently_modified_subdirectory(self):
+        # new/ was modified just now, the source dir before
+        first = self.add_file('new/1.jpg', age=False)
+        self.age(self.source_dir)
+        self.assertEqual(self.walk(), [first])
+
+        # the subdirectory got no snapshot and is listed again, even though the source dir is unchanged
+        second = self.add_file('new/2.jpg', age=False)
+        self.old_mtime_ns += 10 ** 9
+        os.utime(os.path.dirname(second), ns=(self.old_mtime_ns, self.old_mtime_ns))
+        self.assertEqual(self.walk(), [first, second])
+        self.assertEqual(self.walk(), [])
+
+    def test_incomplete_subdirectory(self):
+        failed = self.add_file('a/b/failed.jpg')
+        self.add_file('c/ok.jpg')
+        self.walk(incomplete_files=[failed])
+
+        self.assertEqual(self.walk(), [failed])
+        self.assertEqual(self.walk(), [])
+
+    def test_unlisted_subdirectory(self):
+        path = self.add_file('a/1.jpg')
+        unlisted = os.path.dirname(path)
+        scandir = os.scandir
+
+        def failing_scandir(dir_path):
+            if dir_path == unlisted:
+                raise PermissionError('permission denied')
+            return scandir(dir_path)
+
+        with mock.patch('os.scandir', failing_scandir):
+            self.assertEqual(self.walk(), [])
+        self.assertEqual(self.walk(), [path])
+
+
+if __name__ == '__main__':
+    unittest.main()
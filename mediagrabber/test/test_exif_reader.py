@@ -0,0 +1,184 @@
+import datetime
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import exif_reader
+from exif_reader import ExifFormatError
+from exifmediafile import ExifMediaFile
+
+# 2017-05-29 09:15:05 in seconds since 1904-01-01
+QUICKTIME_SECONDS = int((datetime.datetime(2017, 5, 29, 9, 15, 5) - exif_reader.QUICKTIME_EPOCH).total_seconds())
+
+
+def ifd(entries, offset):
+    """
+    Little endian IFD at offset: entries (tag id, field type, count, value bytes), values larger
+    than 4 bytes follow the IFD
+    """
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    head = struct.pack('<H', len(entries))
+    tail = b''
+    for tag_id, field_type, count, value in entries:
+        head += struct.pack('<HHL', tag_id, field_type, count)
+        if len(value) <= 4:
+            head += value.ljust(4, b'\x00')
+        else:
+            head += struct.pack('<L', data_offset + len(tail))
+            tail += value
+    return head + struct.pack('<L', 0) + tail
+
+
+def tiff(date=b'2017:05:29 09:15:05\x00', exif_pointer=None, exif_pointer_count=1):
+    """
+    TIFF structure with Make in IFD0 and DateTimeOriginal in the Exif IFD
+    """
+    def ifd0(pointer):
+        return ifd([(0x010F, 2, 6, b'Canon\x00'),
+                    (0x8769, 4, exif_pointer_count, struct.pack('<L', pointer) * exif_pointer_count)], 8)
+
+    exif_offset = 8 + len(ifd0(0))
+    exif_ifd = ifd([(0x9003, 2, len(date), date)], exif_offset)
+    return b'II*\x00' + struct.pack('<L', 8) + ifd0(exif_offset if exif_pointer is None else exif_pointer) + exif_ifd
+
+
+def jpeg(exif_block):
+    app1 = b'Exif\x00\x00' + exif_block
+    sof = struct.pack('>BHHB', 8, 3024, 4032, 3) + bytes(9)
+    return (b'\xff\xd8' + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 +
+            b'\xff\xc0' + struct.pack('>H', len(sof) + 2) + sof + b'\xff\xd9')
+
+
+def box(box_type, content=b'', size=None):
+    """
+    ISO base media box (size: declared size, default: actual size)
+    """
+    return struct.pack('>L4s', 8 + len(content) if size is None else size, box_type) + content
+
+
+def date_box(box_type, seconds=QUICKTIME_SECONDS, version=0):
+    if version == 1:
+        return box(box_type, struct.pack('>B3xQQ', 1, seconds, seconds) + bytes(20))
+    return box(box_type, struct.pack('>B3xLL', 0, seconds, seconds) + bytes(20))
+
+
+def quicktime(*moov_boxes):
+    return box(b'ftyp', b'qt  \x00\x00\x00\x00') + box(b'moov', b''.join(moov_boxes)) + box(b'mdat', bytes(64))
+
+
+class ReaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read_quicktime(self, data):
+        with open(self.write('video.mov', data), 'rb') as f:
+            return exif_reader._read_quicktime(f)
+
+
+class JpegTest(ReaderTestCase):
+
+    def test_tags(self):
+        tags = exif_reader.read_exif_tags(self.write('image.jpg', jpeg(tiff())))
+        self.assertEqual(tags['EXIF:DateTimeOriginal'], '2017:05:29 09:15:05')
+        self.assertEqual(tags['EXIF:Make'], 'Canon')
+        self.assertEqual(tags['File:ImageWidth'], 4032)
+        self.assertEqual(tags['File:ImageHeight'], 3024)
+
+    def test_no_valid_date(self):
+        path = self.write('image.jpg', jpeg(tiff(date=b'0000:00:00 00:00:00\x00')))
+        self.assertIsNone(exif_reader.read_exif_tags(path))
+
+    def test_pointer_with_several_values(self):
+        with self.assertRaises(ExifFormatError):
+            exif_reader._parse_tiff(tiff(exif_pointer_count=2))
+        self.assertIsNone(exif_reader.read_exif_tags(self.write('image.jpg', jpeg(tiff(exif_pointer_count=2)))))
+
+    def test_pointer_out_of_bounds(self):
+        for pointer in (0, 4, 100000):
+            with self.assertRaises(ExifFormatError):
+                exif_reader._parse_tiff(tiff(exif_pointer=pointer))
+
+    def test_truncated_file(self):
+        data = jpeg(tiff())
+        for length in (3, 6, 20, 40, data.index(b'2017')):
+            self.assertIsNone(exif_reader.read_exif_tags(self.write('image.jpg', data[:length])))
+
+
+class FastReadFallbackTest(ReaderTestCase):
+
+    def test_reader_error_falls_back_to_exiftool(self):
+        path = self.write('image.jpg', jpeg(tiff()))
+        emf = ExifMediaFile(path, object())
+        with mock.patch('exif_reader.read_exif_tags', side_effect=TypeError('unexpected value')):
+            self.assertIsNone(emf.read_exif_tags_fast(path))
+
+
+class QuickTimeTest(ReaderTestCase):
+
+    def test_create_dates(self):
+        data = quicktime(date_box(b'mvhd'), box(b'trak', date_box(b'tkhd') + box(b'mdia', date_box(b'mdhd'))))
+        tags = exif_reader.read_exif_tags(self.write('video.mov', data))
+        self.assertEqual(tags['QuickTime:CreateDate'], '2017:05:29 09:15:05')
+        self.assertEqual(tags['QuickTime:TrackCreateDate'], '2017:05:29 09:15:05')
+        self.assertEqual(tags['QuickTime:MediaCreateDate'], '2017:05:29 09:15:05')
+        self.assertEqual(tags['File:FileName'], 'video.mov')
+
+    def test_version_1_date(self):
+        tags = self.read_quicktime(quicktime(date_box(b'mvhd', version=1)))
+        self.assertEqual(tags['QuickTime:CreateDate'], '2017:05:29 09:15:05')
+
+    def test_date_not_set(self):
+        tags = self.read_quicktime(quicktime(date_box(b'mvhd', seconds=0)))
+        self.assertEqual(tags['QuickTime:CreateDate'], '0000:00:00 00:00:00')
+
+    def test_file_ends_after_box_header(self):
+        # moov claims 1000 bytes, the file ends after the mvhd header
+        data = box(b'ftyp', b'qt  \x00\x00\x00\x00') + box(b'moov', box(b'mvhd', size=108), size=1000)
+        with self.assertRaises(ExifFormatError):
+            self.read_quicktime(data)
+        self.assertIsNone(exif_reader.read_exif_tags(self.write('video.mov', data)))
+
+    def test_file_ends_in_date(self):
+        data = quicktime(date_box(b'mvhd', version=1))
+        data = data[:data.index(b'mvhd') + 10]
+        with self.assertRaises(ExifFormatError):
+            self.read_quicktime(data)
+        self.assertIsNone(exif_reader.read_exif_tags(self.write('video.mov', data)))
+
+    def test_file_ends_in_large_size(self):
+        # 64 bit box size, cut off by the end of the file
+        data = box(b'ftyp', b'qt  \x00\x00\x00\x00') + struct.pack('>L4s', 1, b'moov') + b'\x00\x00'
+        with self.assertRaises(ExifFormatError):
+            self.read_quicktime(data)
+
+    def test_box_larger_than_parent(self):
+        # the trak box claims more than its parent: its end is limited to the end of moov
+        trak = box(b'trak', date_box(b'tkhd'), size=5000)
+        data = quicktime(date_box(b'mvhd'), trak)
+        with open(self.write('video.mov', data), 'rb') as f:
+            moov = [entry for entry in exif_reader._iter_boxes(f, 0, len(data)) if entry[0] == b'moov'][0]
+            trak_entry = [entry for entry in exif_reader._iter_boxes(f, moov[1], moov[2]) if entry[0] == b'trak'][0]
+        self.assertEqual(trak_entry[2], moov[2])
+        self.assertEqual(self.read_quicktime(data)['QuickTime:TrackCreateDate'], '2017:05:29 09:15:05')
+
+    def test_date_box_smaller_than_date(self):
+        # the box is complete, but too small for the date
+        data = quicktime(box(b'mvhd', b'\x00\x00\x00\x00\x01'), date_box(b'free'))
+        with self.assertRaises(ExifFormatError):
+            self.read_quicktime(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import exiftool_daemon
+from exiftool import ExifToolTimeoutError
+from exiftool_daemon import ExifToolClient, check_socket
+
+
+@unittest.skipUnless(exiftool_daemon.is_supported(), 'unix sockets are not supported')
+class SocketTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket_dir = os.path.join(self.directory.name, 'private')
+        os.mkdir(self.socket_dir, 0o700)
+        self.socket_path = os.path.join(self.socket_dir, 'exiftool.sock')
+        self.connections = []
+
+    def tearDown(self):
+        for connection in self.connections:
+            connection.close()
+        self.directory.cleanup()
+
+    def listen(self):
+        """
+        Socket accepting connections, but never responding
+        """
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen(4)
+        self.connections.append(server)
+
+        def accept():
+            while True:
+                try:
+                    self.connections.append(server.accept()[0])
+                except OSError:
+                    return
+
+        threading.Thread(target=accept, daemon=True).start()
+        return server
+
+
+class DefaultSocketPathTest(unittest.TestCase):
+
+    def test_runtime_dir(self):
+        with tempfile.TemporaryDirectory() as runtime_dir, \
+                mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': runtime_dir}):
+            self.assertEqual(exiftool_daemon.default_socket_path(),
+                             os.path.join(runtime_dir, 'mediagrabber-exiftool.sock'))
+
+    def test_private_temp_dir(self):
+        with mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': ''}):
+            path = exiftool_daemon.default_socket_path()
+        self.assertEqual(os.path.dirname(os.path.dirname(path)), tempfile.gettempdir())
+        self.assertNotEqual(os.path.dirname(path), tempfile.gettempdir())
+
+
+class CheckSocketTest(SocketTestCase):
+
+    def test_own_socket(self):
+        self.listen()
+        check_socket(self.socket_path)
+
+    def test_socket_of_other_user(self):
+        self.listen()
+        with mock.patch('exiftool_daemon._getuid', return_value=os.getuid() + 1):
+            with self.assertRaises(OSError):
+                check_socket(self.socket_path)
+            self.assertIsNone(exiftool_daemon.connect(self.socket_path))
+
+    def test_directory_writable_by_others(self):
+        self.listen()
+        os.chmod(self.socket_dir, 0o777)
+        with self.assertRaises(OSError):
+            check_socket(self.socket_path)
+        # unless only the owner can remove files in it (e.g. /tmp)
+        os.chmod(self.socket_dir, 0o1777)
+        check_socket(self.socket_path)
+
+    def test_not_a_socket(self):
+        with open(self.socket_path, 'w'):
+            pass
+        with self.assertRaises(OSError):
+            check_socket(self.socket_path)
+        self.assertIsNone(exiftool_daemon.connect(self.socket_path))
+
+    def test_daemon_creates_private_directory(self):
+        socket_path = os.path.join(self.directory.name, 'new', 'exiftool.sock')
+        exiftool_daemon._create_socket_dir(socket_path)
+        self.assertEqual(os.stat(os.path.dirname(socket_path)).st_mode & 0o777, 0o700)
+
+        os.chmod(os.path.dirname(socket_path), 0o777)
+        with self.assertRaises(OSError):
+            exiftool_daemon._create_socket_dir(socket_path)
+
+
+class ClientTest(SocketTestCase):
+
+    @unittest.skipUnless(hasattr(socket, 'SO_PEERCRED'), 'peer credentials are not available')
+    def test_daemon_of_other_user(self):
+        self.listen()
+        client = ExifToolClient(self.socket_path)
+        client._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client._socket.connect(self.socket_path)
+        self.connections.append(client._socket)
+        with mock.patch('exiftool_daemon._getuid', return_value=os.getuid() + 1):
+            with self.assertRaises(OSError):
+                client._check_peer()
+        client._check_peer()
+
+    def test_timeout(self):
+        self.listen()
+        client = exiftool_daemon.connect(self.socket_path, timeout=0.2)
+        self.assertIsNotNone(client)
+        with self.assertRaises(ExifToolTimeoutError):
+            client.execute(b'-j', b'/a/x.jpg')
+        # reconnected for the next request
+        self.assertTrue(client.running)
+        client.terminate()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import asyncio
+import io
+import os
+import unittest
+from unittest import mock
+
+import exiftool
+import exiftool_async
+from exiftool import ExifTool, find_sentinel
+
+OUTPUTS = [
+    # JSON, tag value containing the sentinel text
+    (b'[{"SourceFile": "/a/x.jpg", "XMP:Comment": "{ready1}"}]\n{ready1}\n',
+     b'[{"SourceFile": "/a/x.jpg", "XMP:Comment": "{ready1}"}]\n'),
+    # JSON, tag value ending with the sentinel text and a line break
+    (b'[{"SourceFile": "/a/x.jpg", "XMP:Comment": "note {ready1}\n"}]\n{ready1}\n',
+     b'[{"SourceFile": "/a/x.jpg", "XMP:Comment": "note {ready1}\n"}]\n'),
+    # table, sentinel text as the last column
+    (b'/a/x.jpg\t{ready1}\n/a/y.jpg\tok\n{ready1}\n',
+     b'/a/x.jpg\t{ready1}\n/a/y.jpg\tok\n'),
+    # sentinel of another batch
+    (b'/a/x.jpg\t{ready12}\n{ready1}\n', b'/a/x.jpg\t{ready12}\n'),
+    # Windows line breaks
+    (b'/a/x.jpg\t{ready1}\r\n/a/y.jpg\tok\r\n{ready1}\r\n', b'/a/x.jpg\t{ready1}\r\n/a/y.jpg\tok\r\n'),
+    # no output
+    (b'{ready1}\n', b''),
+]
+
+
+class FindSentinelTest(unittest.TestCase):
+
+    def test_sentinel_on_own_line(self):
+        self.assertEqual(find_sentinel(b'out\n{ready1}\n', b'{ready1}'), 4)
+        self.assertEqual(find_sentinel(b'{ready1}\r\n', b'{ready1}'), 0)
+
+    def test_sentinel_in_value(self):
+        self.assertEqual(find_sentinel(b'a\t{ready1}\n', b'{ready1}'), -1)
+        self.assertEqual(find_sentinel(b'"{ready1}"\n', b'{ready1}'), -1)
+        self.assertEqual(find_sentinel(b'\n{ready1} x\n', b'{ready1}'), -1)
+
+    def test_incomplete_sentinel_line(self):
+        output = bytearray(b'out\n{rea')
+        for more in (b'dy1}', b'\r', b'\n'):
+            self.assertEqual(find_sentinel(output, b'{ready1}'), -1)
+            start = exiftool.sentinel_search_start(output, b'{ready1}')
+            output += more
+        # found from the resume position once the line is complete
+        self.assertEqual(find_sentinel(output, b'{ready1}', start), 4)
+
+
+class FakeProcess:
+    """
+    exiftool process with the given output in a pipe
+    """
+
+    def __init__(self, output):
+        self.stdin = io.BytesIO()
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, output)
+        os.close(write_fd)
+        self.stdout = os.fdopen(read_fd, 'rb')
+
+
+class ReadOutputTest(unittest.TestCase):
+
+    def execute(self, output):
+        et = ExifTool()
+        et.running = True
+        et._process = FakeProcess(output)
+        try:
+            return et.execute(b'-j', b'/a/x.jpg')
+        finally:
+            et._process.stdout.close()
+            et.running = False
+
+    def test_sentinel_in_output(self):
+        for output, expected in OUTPUTS:
+            # any split of the output between reads
+            for size in range(1, len(output) + 1):
+                with mock.patch.object(exiftool, 'block_size', size):
+                    self.assertEqual(self.execute(output), expected, (output, size))
+
+    def test_execute_number_is_sent(self):
+        et = ExifTool()
+        et.running = True
+        et._process = FakeProcess(b'{ready1}\n')
+        et.execute(b'-j', b'/a/x.jpg')
+        self.assertEqual(et._process.stdin.getvalue(), b'-j\n/a/x.jpg\n-execute1\n')
+        et._process.stdout.close()
+        et.running = False
+
+
+class AsyncReadOutputTest(unittest.TestCase):
+
+    def test_sentinel_in_pipelined_output(self):
+        async def read(output, size):
+            et = exiftool_async.AsyncExifTool()
+            reader = asyncio.StreamReader()
+            reader.feed_data(output)
+            reader.feed_eof()
+            et._process = mock.Mock(stdout=reader, returncode=0)
+            et.running = False
+            futures = []
+            for number in (1, 2):
+                future = asyncio.get_running_loop().create_future()
+                et._pending.append((number, future, ()))
+                futures.append(future)
+            with mock.patch.object(exiftool, 'block_size', size):
+                await et._read_responses()
+            return [future.result() for future in futures]
+
+        for output, expected in OUTPUTS:
+            second = output.replace(b'{ready1}', b'{ready2}')
+            for size in (1, 3, 7, len(output)):
+                self.assertEqual(asyncio.run(read(output + second, size)),
+                                 [expected, expected.replace(b'{ready1}', b'{ready2}')], (output, size))
+
+
+if __name__ == '__main__':
+    unittest.main()
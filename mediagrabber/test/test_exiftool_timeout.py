@@ -0,0 +1,83 @@
+import asyncio
+import os
+import stat
+import sys
+import tempfile
+import unittest
+
+import exiftool_async
+from exiftool import ExifTool, ExifToolTimeoutError
+
+FAKE_EXIFTOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_exiftool.py')
+TIMEOUT = 0.5
+
+
+@unittest.skipIf(sys.platform == 'win32', 'pipes cannot be polled on windows')
+class HangingExifToolTestCase(unittest.TestCase):
+    """
+    Runs fake_exiftool.py as exiftool executable, which hangs on files named *hang*
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.executable = os.path.join(self.directory.name, 'exiftool')
+        with open(self.executable, 'w') as f:
+            f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, FAKE_EXIFTOOL))
+        os.chmod(self.executable, stat.S_IRWXU)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class ExifToolTimeoutTest(HangingExifToolTestCase):
+
+    def test_hanging_process_is_restarted(self):
+        with ExifTool(self.executable, timeout=TIMEOUT) as et:
+            self.assertEqual(et.get_tags_batch(['FileName'], ['/a/x.jpg']), [{'SourceFile': '/a/x.jpg'}])
+            process = et._process
+
+            with self.assertRaises(ExifToolTimeoutError):
+                et.get_tags_batch(['FileName'], ['/a/hang.jpg'])
+            # the hanging process is killed, the next call goes to a new one
+            self.assertIsNotNone(process.returncode)
+            self.assertIsNot(et._process, process)
+            self.assertTrue(et.running)
+            self.assertEqual(et.get_tags_batch(['FileName'], ['/a/y.jpg']), [{'SourceFile': '/a/y.jpg'}])
+
+
+class AsyncExifToolTimeoutTest(HangingExifToolTestCase):
+
+    def test_pending_requests_are_sent_again(self):
+        async def run():
+            et = exiftool_async.AsyncExifTool(self.executable, timeout=TIMEOUT)
+            await et.start()
+            try:
+                hanging = asyncio.ensure_future(et.get_tags_batch(['FileName'], ['/a/hang.jpg']))
+                # waits behind the hanging request
+                pending = asyncio.ensure_future(et.get_tags_batch(['FileName'], ['/a/x.jpg']))
+                process = et._process
+
+                with self.assertRaises(ExifToolTimeoutError):
+                    await hanging
+                self.assertEqual(await pending, [{'SourceFile': '/a/x.jpg'}])
+                self.assertIsNotNone(process.returncode)
+                self.assertIsNot(et._process, process)
+
+                self.assertEqual(await et.get_tags_batch(['FileName'], ['/a/y.jpg']), [{'SourceFile': '/a/y.jpg'}])
+            finally:
+                await et.terminate()
+
+        asyncio.run(asyncio.wait_for(run(), 10))
+
+    def test_thread(self):
+        with exiftool_async.ExifToolThread(self.executable, timeout=TIMEOUT) as et:
+            hanging = et.submit_tags_batch(['FileName'], ['/a/hang.jpg'])
+            pending = et.submit_tags_batch(['FileName'], ['/a/x.jpg'])
+            with self.assertRaises(ExifToolTimeoutError):
+                hanging.result(10)
+            self.assertEqual(pending.result(10), [{'SourceFile': '/a/x.jpg'}])
+            self.assertEqual(et.get_tags_batch(['FileName'], ['/a/y.jpg']), [{'SourceFile': '/a/y.jpg'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import importlib.util
+import logging
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from database import DataBase
+from exifmediafile import ExifMediaFile
+
+# the script module has the same name as the package it lives in
+_spec = importlib.util.spec_from_file_location(
+    'mediagrabber_script', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mediagrabber.py'))
+mediagrabber_script = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(mediagrabber_script)
+
+
+def setUpModule():
+    logging.disable(logging.WARNING)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+class ValidateTargetRecordsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.target_dir = os.path.join(self.directory.name, 'target')
+        self.db = DataBase(os.path.join(self.directory.name, 'index.db'))
+        self.files = [self.import_file('a.jpg', 1), self.import_file('b.jpg', 2, 2018)]
+
+    def tearDown(self):
+        self.db.disconnect()
+        self.directory.cleanup()
+
+    def import_file(self, name, second, year=2017):
+        """
+        Record of a file copied to <target>/<year>/<month>
+        """
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as f:
+            f.write(name.encode())
+        emf = ExifMediaFile(path, object())
+        emf.parse_exif_info({'SourceFile': path, 'EXIF:DateTimeOriginal': '%s:05:29 09:15:%02d' % (year, second)})
+        emf.calculate_hash()
+        self.db.add_file(emf)
+        target_path = os.path.join(self.target_dir, emf.file_properties['target_path'])
+        os.makedirs(target_path, exist_ok=True)
+        os.rename(path, os.path.join(target_path, emf.file_properties['target_filename']))
+        return emf
+
+    def validate(self):
+        mg = mediagrabber_script.MediaGrabber.__new__(mediagrabber_script.MediaGrabber)
+        mg.db = self.db
+        mg.target_dir = self.target_dir
+        mg.logger = logging.getLogger(__name__)
+        mg.verbose = False
+        mg._init_stats()
+        mg._validate_target_records()
+        return self.db.count_target_records()
+
+    def test_missing_file(self):
+        emf = self.files[0]
+        os.remove(os.path.join(self.target_dir, emf.file_properties['target_path'],
+                               emf.file_properties['target_filename']))
+        self.assertEqual(self.validate(), 1)
+
+    def test_unreadable_directory_keeps_records(self):
+        unreadable = os.path.join(self.target_dir, self.files[0].file_properties['target_path'])
+        scandir = os.scandir
+
+        def failing_scandir(path):
+            if path == unreadable:
+                raise PermissionError('permission denied')
+            return scandir(path)
+
+        with mock.patch('os.scandir', failing_scandir):
+            self.assertEqual(self.validate(), 2)
+
+        # the records of other directories are still checked
+        os.remove(os.path.join(self.target_dir, self.files[1].file_properties['target_path'],
+                               self.files[1].file_properties['target_filename']))
+        with mock.patch('os.scandir', failing_scandir):
+            self.assertEqual(self.validate(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()